@@ -0,0 +1,200 @@
+# account_rules.py
+"""
+Local, deterministic account matching for line-item descriptions.
+
+Account names from the chart of accounts (ACCOUNTS, ACCOUNT_CLASSIFICATIONS,
+EXPENSE_CLASSIFICATIONS), the expense field labels in
+utils.get_expense_fields() and a table of common statement synonyms are
+compiled into an Aho-Corasick automaton over words. A description is
+scanned once, whatever the number of phrases, and answered in microseconds
+without the network.
+
+Only accounts listed in ACCOUNT_CLASSIFICATIONS are ever returned, since
+journal entries need their categories.
+
+Confidence grows with the weight of the matched phrases and with how much
+of the description they cover. It drops when a different account also
+matches. classifier.py accepts confident matches and sends the rest to the
+LLM.
+"""
+import re
+from collections import deque
+from app_constants import ACCOUNT_CLASSIFICATIONS, ACCOUNTS, EXPENSE_CLASSIFICATIONS
+from utils import get_expense_fields
+
+# Phrase weights by source
+ACCOUNT_NAME_WEIGHT = 1.0
+EXPENSE_FIELD_WEIGHT = 0.95
+SYNONYM_WEIGHT = 0.9
+EXPENSE_GROUP_WEIGHT = 0.85
+
+# Accounts for the expense fields on property forms; the rest have no single account
+EXPENSE_FIELD_ACCOUNTS = {
+    'hoa_fees': 'Home Owners Association Fees',
+    'maintenance': 'Maintenance and Repairs',
+    'management_fee': 'Property Management Fees',
+    'reserve_fund': 'Levies',
+    'special_assessments': 'Levies',
+    'insurance': 'Insurance',
+    'property_taxes': 'Property Taxes',
+    'electricity': 'Utilities',
+    'gas': 'Utilities',
+    'water_sewer': 'Utilities',
+    'other_city_charges': 'Property Taxes',
+}
+
+# Wording seen on statements and invoices, by account
+SYNONYMS = {
+    'Home Owners Association Fees': ['hoa', 'hoa fees', 'hoa dues', 'association dues', 'body corporate',
+                                     'strata fees', 'condo fees'],
+    'Levies': ['levy', 'special levy', 'special assessment'],
+    'Utilities': ['water', 'sewer', 'sewerage', 'electricity', 'electric', 'power', 'gas', 'utility bill'],
+    'Waste Management': ['trash', 'garbage', 'refuse', 'rubbish', 'waste removal'],
+    'Maintenance and Repairs': ['repairs', 'plumbing', 'plumber', 'electrician', 'handyman', 'painting'],
+    'Landscaping': ['lawn', 'garden', 'garden service', 'gardening', 'landscape'],
+    'Pest Control': ['pest', 'exterminator', 'extermination', 'fumigation'],
+    'Cleaning Services': ['cleaning', 'janitorial'],
+    'Property Insurance': ['insurance premium', 'building insurance', 'homeowners insurance'],
+    'Property Taxes': ['property tax', 'rates', 'municipal rates', 'council tax', 'real estate tax'],
+    'Property Management Fees': ['management fee', 'letting fee', 'property manager fee'],
+    'Bank Fees': ['bank charges', 'bank fee', 'bank service fee'],
+    'Mortgage Interest': ['bond interest', 'loan interest', 'interest charged'],
+    'Security Systems': ['alarm', 'armed response', 'security', 'cctv'],
+    'Elevator Maintenance': ['lift maintenance', 'elevator service'],
+    'Marketing and Advertising': ['advertising', 'listing fee'],
+    'Legal and Professional Fees': ['legal', 'attorney', 'lawyer', 'accounting fees', 'audit fee'],
+}
+
+_STOPWORDS = frozenset(('a', 'an', 'and', 'for', 'in', 'of', 'on', 'the', 'to'))
+_WORD = re.compile(r'[a-z0-9]+')
+
+
+def _stem(word):
+    """Folds simple plurals, so 'levies' and 'levy' or 'fees' and 'fee' meet."""
+    if len(word) > 4 and word.endswith('ies'):
+        return word[:-3] + 'y'
+    if len(word) > 4 and word.endswith(('xes', 'ches', 'shes', 'sses')):
+        return word[:-2]
+    if len(word) > 3 and word.endswith('s') and not word.endswith('ss'):
+        return word[:-1]
+    return word
+
+def words(text):
+    """Matchable words of a description: lower case, stemmed, without stopwords or bare numbers."""
+    return [
+        _stem(word)
+        for word in _WORD.findall((text or '').lower().replace('&', ' and '))
+        if word not in _STOPWORDS and not word.isdigit()
+    ]
+
+def _ledger_accounts():
+    accounts = set()
+    for groups in ACCOUNT_CLASSIFICATIONS.values():
+        for names in (groups.values() if isinstance(groups, dict) else [groups]):
+            accounts.update(names)
+    return frozenset(accounts)
+
+# Accounts journal entries can be generated for (transaction.get_sub_category_from_account resolves them)
+LEDGER_ACCOUNTS = _ledger_accounts()
+
+
+class AccountMatcher:
+    """Word-level Aho-Corasick automaton mapping phrases to accounts."""
+
+    def __init__(self, phrases):
+        """phrases: iterable of (phrase, account, weight); the heaviest entry for a phrase wins."""
+        best = {}
+        for phrase, account, weight in phrases:
+            key = tuple(words(phrase))
+            if key and (key not in best or weight > best[key][1]):
+                best[key] = (account, weight)
+
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for key, (account, weight) in best.items():
+            node = 0
+            for word in key:
+                if word not in self._goto[node]:
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                    self._goto[node][word] = len(self._goto) - 1
+                node = self._goto[node][word]
+            self._out[node].append((len(key), account, weight))
+
+        # Breadth-first failure links; each node also reports its suffixes' phrases
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for word, child in self._goto[node].items():
+                fallback = self._fail[node]
+                while fallback and word not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(word, 0)
+                self._out[child] = self._out[child] + self._out[self._fail[child]]
+                queue.append(child)
+
+    @classmethod
+    def from_constants(cls):
+        """Matcher over the chart of accounts, expense field labels and SYNONYMS."""
+        valid = LEDGER_ACCOUNTS
+        phrases = []
+        for account in valid | set(ACCOUNTS):
+            phrases.append((account, account, ACCOUNT_NAME_WEIGHT))
+        for groups in EXPENSE_CLASSIFICATIONS.values():
+            for group, names in groups.items():
+                targets = [name for name in names if name in valid]
+                if targets:
+                    phrases.append((group, targets[0], EXPENSE_GROUP_WEIGHT))
+                phrases.extend((name, name, ACCOUNT_NAME_WEIGHT) for name in names)
+        labels = get_expense_fields()
+        for field, account in EXPENSE_FIELD_ACCOUNTS.items():
+            phrases.append((labels[field], account, EXPENSE_FIELD_WEIGHT))
+        for account, synonyms in SYNONYMS.items():
+            phrases.extend((synonym, account, SYNONYM_WEIGHT) for synonym in synonyms)
+        return cls((phrase, account, weight) for phrase, account, weight in phrases if account in valid)
+
+    def match(self, description):
+        """(account, confidence) for a description, or (None, 0.0) when no phrase matches."""
+        tokens = words(description)
+        if not tokens:
+            return None, 0.0
+
+        covered = {}  # account -> (positions covered, heaviest weight)
+        node = 0
+        for index, word in enumerate(tokens):
+            while node and word not in self._goto[node]:
+                node = self._fail[node]
+            node = self._goto[node].get(word, 0)
+            for length, account, weight in self._out[node]:
+                positions, heaviest = covered.get(account, (set(), 0.0))
+                positions.update(range(index - length + 1, index + 1))
+                covered[account] = (positions, max(heaviest, weight))
+
+        if not covered:
+            return None, 0.0
+
+        scores = sorted(
+            ((weight * (0.6 + 0.4 * len(positions) / len(tokens)), account)
+             for account, (positions, weight) in covered.items()),
+            reverse=True
+        )
+        best, account = scores[0]
+        # Another account matching words the best one does not explain makes the answer less certain;
+        # shorter phrases inside the best match ('insurance' in 'property insurance') do not
+        best_positions = covered[account][0]
+        rivals = [score for score, other in scores[1:] if not covered[other][0] <= best_positions]
+        if rivals:
+            best *= 1 - 0.5 * rivals[0] / best
+        return account, round(best, 3)
+
+
+_matcher = None
+
+def match_account(description):
+    """(account, confidence) from the shared matcher, built on first use."""
+    global _matcher
+    if _matcher is None:
+        _matcher = AccountMatcher.from_constants()
+    return _matcher.match(description)
@@ -1,44 +1,34 @@
-from flask import Blueprint, app, current_app, jsonify, request, render_template, flash, redirect, session, url_for, send_file, make_response
+from flask import Blueprint, app, current_app, jsonify, request, render_template, flash, redirect, session, url_for, send_file
 from datetime import datetime, timedelta
 
 import requests
+import http_client
 from app_constants import ACCOUNT_CLASSIFICATIONS
-from extensions import db
+from extensions import cache, db, workers_share_cache
 from forms import BudgetForm
 from models import Property, Owner, Transaction, Budget, User
 from flask_login import current_user, login_required
 from collections import defaultdict
 from decimal import Decimal
+from functools import cached_property
 from sqlalchemy.sql import func
 from sqlalchemy import func
 from werkzeug.utils import secure_filename
-import csv
-import io
 import pdfkit
 from sqlalchemy.orm import joinedload
-from utils import allowed_file
+from utils import allowed_file, stream_csv
 from transaction import transactions
+from ledger import account_balances, account_totals, ledger_count, ledger_version
+from pagination import keyset_paginate
+from pdf_renderer import pdf_response
 
 accounting_routes = Blueprint('accounting_routes', __name__)
 
-def get_sort_query(query, sort_by='date', order='desc'):
-    """Helper function to sort query based on parameters"""
-    sort_column = None
-    if sort_by == 'date':
-        # For grouped queries, use the aggregated version
-        if 'group_by' in str(query):
-            sort_column = func.max(Transaction.transaction_date)
-        else:
-            sort_column = Transaction.transaction_date
-    elif sort_by == 'amount':
-        if 'group_by' in str(query):
-            sort_column = func.sum(Transaction.debit_amount)
-        else:
-            sort_column = Transaction.debit_amount
-
-    if order == 'desc':
-        return query.order_by(sort_column.desc())
-    return query.order_by(sort_column.asc())
+def get_sort_columns(sort_by='date'):
+    """Keyset ordering for the expense list; the id breaks ties so pages never overlap"""
+    if sort_by == 'amount':
+        return (Transaction.amount, Transaction.id)
+    return (Transaction.transaction_date, Transaction.id)
 
 @accounting_routes.route('/property/<int:property_id>/expenses', methods=['GET'])
 @login_required
@@ -53,43 +43,62 @@ def get_expenses(property_id):
         if not property or property.owner_id != owner.id:
             return jsonify({'error': 'Property not found or access denied'}), 403
 
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 20, type=int)
+        per_page = min(request.args.get('per_page', 20, type=int), 100)
         start_date = request.args.get('start_date', 
                                     datetime(datetime.now().year, 1, 1).strftime('%Y-%m-%d'))
         end_date = request.args.get('end_date', 
                                   datetime.now().strftime('%Y-%m-%d'))
         category = request.args.get('category')
+        expense_categories = [
+            'Operating Expenses',
+            'Occupancy Expenses',
+            'Common Area Expenses',
+            'Financial Expenses'
+        ]
+        period_start = datetime.strptime(start_date, '%Y-%m-%d').date()
+        period_end = datetime.strptime(end_date, '%Y-%m-%d').date()
         
         base_query = Transaction.query.filter(
             Transaction.property_id == property_id,
-            Transaction.transaction_date.between(
-                datetime.strptime(start_date, '%Y-%m-%d'),
-                datetime.strptime(end_date, '%Y-%m-%d')
-            ),
-            Transaction.main_category.in_([
-                'Operating Expenses',
-                'Occupancy Expenses',
-                'Common Area Expenses',
-                'Financial Expenses'
-            ])
+            Transaction.transaction_date.between(period_start, period_end),
+            Transaction.main_category.in_(expense_categories)
         )
 
         if category:
             base_query = base_query.filter(Transaction.account == category)
 
-        # Create nested structure for summary
+        # Create nested structure for summary, summed in the database
         expenses_summary = defaultdict(lambda: defaultdict(Decimal))
-        for t in base_query.all():
-            main_cat = t.main_category
-            sub_cat = t.account or 'Other'
-            expenses_summary[main_cat][sub_cat] += Decimal(str(t.debit_amount or 0))
-
-        # Get paginated transaction details
+        summary_rows = base_query.with_entities(
+            Transaction.main_category,
+            Transaction.account,
+            func.sum(Transaction.amount)
+        ).group_by(Transaction.main_category, Transaction.account)
+        for main_cat, account, total in summary_rows:
+            expenses_summary[main_cat][account or 'Other'] += Decimal(str(total or 0))
+
+        # Get one page of transaction details, seeking from the cursor
         sort_by = request.args.get('sort', 'date')
         order = request.args.get('order', 'desc')
-        base_query = get_sort_query(base_query, sort_by, order)
-        pagination = base_query.paginate(page=page, per_page=per_page, error_out=False)
+        expenses_page = keyset_paginate(
+            base_query,
+            get_sort_columns(sort_by),
+            after=request.args.get('after'),
+            before=request.args.get('before'),
+            per_page=per_page,
+            descending=order == 'desc'
+        )
+
+        # Approximate total from the ledger rollup, only when asked for
+        if request.args.get('include_total', 'false').lower() in ('1', 'true', 'yes'):
+            filters = {'account': category} if category else {}
+            expenses_page.total = ledger_count(
+                period_start,
+                period_end + timedelta(days=1),
+                property_id=property_id,
+                main_category=expense_categories,
+                **filters
+            )
 
         transactions = [{
             'id': t.id,
@@ -97,10 +106,10 @@ def get_expenses(property_id):
             'category': t.main_category,
             'account': t.account,
             'description': t.description,
-            'amount': str(t.debit_amount or 0),
+            'amount': str(t.amount or 0),
             'is_verified': t.is_verified,
             'document': t.document
-        } for t in pagination.items]
+        } for t in expenses_page.items]
 
         # Convert defaultdict to regular dict for JSON serialization
         expenses_summary = {
@@ -111,13 +120,7 @@ def get_expenses(property_id):
         return jsonify({
             'expenses': expenses_summary,  # Categorized summary
             'transactions': transactions,  # Detailed list
-            'pagination': {
-                'total_pages': pagination.pages,
-                'current_page': page,
-                'total_items': pagination.total,
-                'has_next': pagination.has_next,
-                'has_prev': pagination.has_prev
-            },
+            'pagination': expenses_page.to_dict(),
             'filters': {
                 'start_date': start_date,
                 'end_date': end_date,
@@ -435,52 +438,18 @@ def income_statement():
     start_date = datetime.strptime(start_date, '%Y-%m-%d')
     end_date = datetime.strptime(end_date, '%Y-%m-%d') + timedelta(days=1)  # Include the end date
 
-    # Data Retrieval: Include only reconciled transactions within the date range
+    # Data Retrieval: cached statement figures for the owner and date range
     owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all() 
+    figures = income_statement_figures(owner.id, start_date, end_date)
 
-    # owner = Owner.query.options(joinedload(Owner.user)).filter_by(user_id=current_user.id).first()
-
-    # Calculations
-    revenue = sum(transaction.amount for transaction in transactions if transaction.main_category == 'Revenue')
-    cost_of_sales = sum(transaction.amount for transaction in transactions if transaction.sub_category == 'Cost of Sales')
-    gross_income = revenue - cost_of_sales
-
-    overhead_expenses = sum(transaction.amount for transaction in transactions if transaction.main_category == 'Expenses' and transaction.sub_category != 'Cost of Sales')
-    net_income = gross_income - overhead_expenses
-
-    # Revenue Categorization
-    revenue_categories = {
-        'Rental Income': 0,
-        'Other Income': 0
-    }
-    
-    for transaction in transactions:
-        if transaction.main_category == 'Revenue':
-            if transaction.sub_category in revenue_categories:
-                revenue_categories[transaction.sub_category] += transaction.amount
-
-    # Expense Categorization
-    expense_categories = {}
-    overhead_expense_categories = {}  
-    for transaction in transactions:
-        if transaction.main_category == 'Expenses' and transaction.sub_category != 'Cost of Sales':
-            category = transaction.sub_category
-            expense_categories.setdefault(category, 0)
-            expense_categories[category] += transaction.amount
-
-            # Exclude 'Cost of Sales' from overhead expenses
-            if category != 'Cost of Sales':  
-                overhead_expense_categories.setdefault(category, 0)
-                overhead_expense_categories[category] += transaction.amount
-
-    # Calculate total overhead expenses (excluding 'Cost of Sales')
-    overhead_expenses = sum(overhead_expense_categories.values())
+    revenue = figures['revenue']
+    revenue_categories = figures['revenue_categories']
+    cost_of_sales = figures['cost_of_sales']
+    gross_income = figures['gross_income']
+    expense_categories = figures['expense_categories']
+    overhead_expense_categories = dict(expense_categories)
+    overhead_expenses = figures['overhead_expenses']
+    net_income = figures['net_income']
 
     # Prepare the response with formatted amounts
     income_statement_data = {
@@ -512,99 +481,12 @@ def balance_sheet():
     start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)  # Include the end date
 
-    # Data Retrieval: Include only reconciled transactions within the date range
+    # Data Retrieval: cached figures from one grouped query over the owner's reconciled transactions
     owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
-
-    # --- Calculations ---
-    # Assets
-    assets = 0
-    for category, accounts in ACCOUNT_CLASSIFICATIONS['Assets'].items():
-        for account in accounts:
-            assets += sum(t.amount for t in transactions if t.account == account)
-
-    current_assets = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Assets']['Current Assets']:
-        current_assets += sum(t.amount for t in transactions if t.account == account)
-
-    non_current_assets = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Assets']['Non-Current Assets']:
-        non_current_assets += sum(t.amount for t in transactions if t.account == account)
-
-    cash_cash_equivalents = sum(t.amount for t in transactions if t.account == 'Bank')
-
-    accounts_receivable = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Assets']['Current Assets']:
-        if account in ('Accounts Receivable', 'Prepaid Expenses', 'Prepaid Insurance', 'Prepaid Rent'):
-            accounts_receivable += sum(t.amount for t in transactions if t.account == account)
-
-    property_plant_equipment = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Assets']['Non-Current Assets']:
-        if account in ('Building', 'Equipment', 'Furniture and Fixtures', 'Land', 'Leasehold Improvements'):
-            property_plant_equipment += sum(t.amount for t in transactions if t.account == account)
-
-    # Liabilities
-    liabilities = 0
-    for category, accounts in ACCOUNT_CLASSIFICATIONS['Liabilities'].items():
-        for account in accounts:
-            liabilities += sum(t.amount for t in transactions if t.account == account)
-
-    current_liabilities = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Current Liabilities']:
-        current_liabilities += sum(t.amount for t in transactions if t.account == account)
-
-    non_current_liabilities = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Non-Current Liabilities']:
-        non_current_liabilities += sum(t.amount for t in transactions if t.account == account)
-
-    accounts_payable = sum(t.amount for t in transactions if t.account == 'Accounts Payable')
-    mortgage_payable = sum(t.amount for t in transactions if t.account == 'Mortgage Payable')
-
-    # Equity
-    equity = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Equity']:
-        equity += sum(t.amount for t in transactions if t.account == account)
-
-    share_capital = 0
-    for account in ACCOUNT_CLASSIFICATIONS['Equity']:
-        if account in ('Contributed Capital', 'Owner/s Capital', 'Partner Contributions'):
-            share_capital += sum(t.amount for t in transactions if t.account == account)
-
-    # ... (rest of your calculations) ...
-    dividends = sum(transaction.amount for transaction in transactions if transaction.account == 'Distributions')
-
-    # You'll need a function to calculate retained earnings (replace this)
-    retained_earnings = calculate_retained_earnings(transactions)  
-
-    liabilities_equity = liabilities + equity
+    statement = balance_sheet_statement(owner.id, start_date, end_date)
 
     # --- Prepare the context for the template ---
-    balance_sheet_data = {
-        'assets': format_currency(assets, current_user.currency.symbol),
-        'current_assets': format_currency(current_assets, current_user.currency.symbol),
-        'non_current_assets': format_currency(non_current_assets, current_user.currency.symbol),
-        'cash_cash_equivalents': format_currency(cash_cash_equivalents, current_user.currency.symbol),
-        'accounts_receivable': format_currency(accounts_receivable, current_user.currency.symbol),
-        'property_plant_equipment': format_currency(property_plant_equipment, current_user.currency.symbol),
-
-        'liabilities': format_currency(liabilities, current_user.currency.symbol),
-        'current_liabilities': format_currency(current_liabilities, current_user.currency.symbol),
-        'non_current_liabilities': format_currency(non_current_liabilities, current_user.currency.symbol),
-        'accounts_payable': format_currency(accounts_payable, current_user.currency.symbol),
-        'mortgage_payable': format_currency(mortgage_payable, current_user.currency.symbol),
-
-        'equity': format_currency(equity, current_user.currency.symbol),
-        'share_capital': format_currency(share_capital, current_user.currency.symbol),
-        'dividends': format_currency(dividends, current_user.currency.symbol),
-        'retained_earnings': format_currency(retained_earnings, current_user.currency.symbol), 
-        'liabilities_equity': format_currency(liabilities_equity, current_user.currency.symbol), 
-        'currency_symbol': current_user.currency.symbol,
-    }
+    balance_sheet_data = format_balance_sheet(statement['figures'], current_user.currency.symbol)
 
     return render_template('accounting/balance_sheet.html', balance_sheet=balance_sheet_data, datetime=datetime)
 
@@ -616,8 +498,11 @@ def download_income_statement_pdf():
     start_date = request.args.get('start_date', datetime.utcnow().strftime('%Y-%m-%d'))
     end_date = request.args.get('end_date', datetime.utcnow().strftime('%Y-%m-%d'))
 
-    # Generate the income statement data
-    income_statement_data = generate_income_statement_data()  # Assume this function generates the data
+    # Generate the income statement data for the owner and period
+    income_statement_data = generate_income_statement_data(
+        datetime.strptime(start_date, '%Y-%m-%d'),
+        datetime.strptime(end_date, '%Y-%m-%d')
+    )
 
     # Get the currency symbol from the Owner object
     # owner = Owner.query.filter_by(user_id=current_user.id).first()
@@ -627,63 +512,57 @@ def download_income_statement_pdf():
 
 
     # Render the PDF template to a string
+    generated_date = datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S')
     rendered = render_template('accounting/income_statement_pdf.html', 
                                income_statement=income_statement_data, 
                                start_date=start_date, 
                                end_date=end_date,
-                               generated_date=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                               generated_date=generated_date,
                                currency_symbol=currency_symbol)  # Pass the currency symbol
 
-    # Create PDF from HTML
-    pdf = pdfkit.from_string(rendered, 'income_statement.pdf')
-
-    # Send the PDF as a response
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'attachment; filename=income_statement.pdf'
-    return response
+    # Serve the PDF from the artifact cache, or as a render job for pdf-jobs.js (the generated date does not count as a change)
+    return pdf_response(rendered, 'income_statement.pdf', volatile=[generated_date])
 
 @accounting_routes.route('/income_statement/csv', methods=['GET'])
 @login_required
 def download_income_statement_csv():
-    # Generate the income statement data
-    income_statement_data = generate_income_statement_data()
+    # Get date filters from request args
+    start_date = request.args.get('start_date', datetime.utcnow().strftime('%Y-%m-%d'))
+    end_date = request.args.get('end_date', datetime.utcnow().strftime('%Y-%m-%d'))
 
-    # Create a CSV in memory
-    output = io.StringIO()
-    writer = csv.writer(output)
+    # Generate the income statement data for the owner and period
+    income_statement_data = generate_income_statement_data(
+        datetime.strptime(start_date, '%Y-%m-%d'),
+        datetime.strptime(end_date, '%Y-%m-%d')
+    )
 
-    # Write the header
-    writer.writerow(['Category', 'Amount'])
+    def rows():
+        # Write the header
+        yield ['Category', 'Amount']
 
-    # Write revenue categories
-    writer.writerow(['Revenue', ''])  # Add a section header for revenue
-    for category, amount in income_statement_data['revenue_categories'].items():
-        writer.writerow([category, amount])
-    writer.writerow(['Total Revenue', income_statement_data['income']])
+        # Write revenue categories
+        yield ['Revenue', '']  # Add a section header for revenue
+        for category, amount in income_statement_data['revenue_categories'].items():
+            yield [category, amount]
+        yield ['Total Revenue', income_statement_data['income']]
 
-    # Write cost of sales
-    writer.writerow(['Cost of Sales', ''])  # Add a section header for cost of sales
-    writer.writerow(['Total Cost of Sales', income_statement_data['cost_of_sales']])
+        # Write cost of sales
+        yield ['Cost of Sales', '']  # Add a section header for cost of sales
+        yield ['Total Cost of Sales', income_statement_data['cost_of_sales']]
 
-    # Write gross income
-    writer.writerow(['Gross Income', income_statement_data['gross_income']])
+        # Write gross income
+        yield ['Gross Income', income_statement_data['gross_income']]
 
-    # Write overhead expenses
-    writer.writerow(['Overhead Expenses', ''])  # Add a section header for overhead expenses
-    for category, amount in income_statement_data['expense_categories'].items():
-        writer.writerow([category, amount])
-    writer.writerow(['Total Overhead Expenses', income_statement_data['overhead_expenses']])
+        # Write overhead expenses
+        yield ['Overhead Expenses', '']  # Add a section header for overhead expenses
+        for category, amount in income_statement_data['expense_categories'].items():
+            yield [category, amount]
+        yield ['Total Overhead Expenses', income_statement_data['overhead_expenses']]
 
-    # Write net income
-    writer.writerow(['Net Income', income_statement_data['net_income']])
+        # Write net income
+        yield ['Net Income', income_statement_data['net_income']]
 
-    # Prepare the response
-    output.seek(0)
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = 'attachment; filename=income_statement.csv'
-    return response
+    return stream_csv(rows(), 'income_statement.csv')
 
 @accounting_routes.route('/balance_sheet/pdf', methods=['GET'])
 @login_required
@@ -712,14 +591,8 @@ def download_balance_sheet_pdf():
                                generated_date=datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
                                currency_symbol=currency_symbol)
 
-    # Create PDF from HTML
-    pdf = pdfkit.from_string(rendered, 'balance_sheet.pdf')
-
-    # Create a response with the PDF
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = 'attachment; filename=balance_sheet.pdf'
-    return response
+    # Serve the PDF from the artifact cache, or as a render job for pdf-jobs.js
+    return pdf_response(rendered, 'balance_sheet.pdf')
 
 
 @accounting_routes.route('/balance_sheet/csv', methods=['GET'])
@@ -734,64 +607,50 @@ def download_balance_sheet_csv():
     start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.strptime(end_date_str, '%Y-%m-%d')
 
-    # Generate balance sheet data
-    balance_sheet_data = generate_balance_sheet_data(start_date, end_date)
-
-    # Create CSV output
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-        # Generate balance sheet data
-    balance_sheet_data = generate_balance_sheet_data(start_date, end_date)
-
-    # Create CSV output
-    output = io.StringIO()
-    writer = csv.writer(output)
-
-    # Write header
-    writer.writerow(['Category', 'Amount'])
-
-    # --- Write Assets ---
-    writer.writerow(['Assets', ''])
-    writer.writerow(['Current Assets', ''])
-    for account in ACCOUNT_CLASSIFICATIONS['Assets']['Current Assets']:
-        amount = sum(t.amount for t in transactions if t.account == account)
-        writer.writerow([account, format_currency(amount, current_user.currency.symbol)])
-
-    writer.writerow(['Non-Current Assets', ''])
-    for account in ACCOUNT_CLASSIFICATIONS['Assets']['Non-Current Assets']:
-        amount = sum(t.amount for t in transactions if t.account == account)
-        writer.writerow([account, format_currency(amount, current_user.currency.symbol)])
-    writer.writerow(['Total Non-Current Assets', balance_sheet_data['non_current_assets']])
-    writer.writerow(['Total Assets', balance_sheet_data['assets']])
-
-    # --- Write Liabilities ---
-    writer.writerow(['Liabilities', ''])
-    writer.writerow(['Current Liabilities', ''])
-    for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Current Liabilities']:
-        amount = sum(t.amount for t in transactions if t.account == account)
-        writer.writerow([account, format_currency(amount, current_user.currency.symbol)])
-    writer.writerow(['Total Current Liabilities', balance_sheet_data['current_liabilities']])
-
-    writer.writerow(['Non-Current Liabilities', ''])
-    for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Non-Current Liabilities']:
-        amount = sum(t.amount for t in transactions if t.account == account)
-        writer.writerow([account, format_currency(amount, current_user.currency.symbol)])
-    writer.writerow(['Total Non-Current Liabilities', balance_sheet_data['non_current_liabilities']])
-    writer.writerow(['Total Liabilities', balance_sheet_data['liabilities']])
-
-    # --- Write Equity ---
-    writer.writerow(['Equity', ''])
-    for account in ACCOUNT_CLASSIFICATIONS['Equity']:
-        amount = sum(t.amount for t in transactions if t.account == account)
-        writer.writerow([account, format_currency(amount, current_user.currency.symbol)])
-    writer.writerow(['Total Equity', balance_sheet_data['equity']])
-    # Prepare the response
-    output.seek(0)
-    response = make_response(output.getvalue())
-    response.headers['Content-Type'] = 'text/csv'
-    response.headers['Content-Disposition'] = 'attachment; filename=balance_sheet.csv'
-    return response
+    # Generate balance sheet data from the cached per-account aggregate
+    owner = Owner.query.filter_by(user_id=current_user.id).first()
+    statement = balance_sheet_statement(owner.id, start_date, end_date + timedelta(days=1))
+    totals = statement['totals']
+    balance_sheet_data = format_balance_sheet(statement['figures'], current_user.currency.symbol)
+
+    currency_symbol = current_user.currency.symbol
+
+    def rows():
+        # Write header
+        yield ['Category', 'Amount']
+
+        # --- Write Assets ---
+        yield ['Assets', '']
+        yield ['Current Assets', '']
+        for account in ACCOUNT_CLASSIFICATIONS['Assets']['Current Assets']:
+            yield [account, format_currency(totals.account(account), currency_symbol)]
+
+        yield ['Non-Current Assets', '']
+        for account in ACCOUNT_CLASSIFICATIONS['Assets']['Non-Current Assets']:
+            yield [account, format_currency(totals.account(account), currency_symbol)]
+        yield ['Total Non-Current Assets', balance_sheet_data['non_current_assets']]
+        yield ['Total Assets', balance_sheet_data['assets']]
+
+        # --- Write Liabilities ---
+        yield ['Liabilities', '']
+        yield ['Current Liabilities', '']
+        for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Current Liabilities']:
+            yield [account, format_currency(totals.account(account), currency_symbol)]
+        yield ['Total Current Liabilities', balance_sheet_data['current_liabilities']]
+
+        yield ['Non-Current Liabilities', '']
+        for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Non-Current Liabilities']:
+            yield [account, format_currency(totals.account(account), currency_symbol)]
+        yield ['Total Non-Current Liabilities', balance_sheet_data['non_current_liabilities']]
+        yield ['Total Liabilities', balance_sheet_data['liabilities']]
+
+        # --- Write Equity ---
+        yield ['Equity', '']
+        for account in ACCOUNT_CLASSIFICATIONS['Equity']:
+            yield [account, format_currency(totals.account(account), currency_symbol)]
+        yield ['Total Equity', balance_sheet_data['equity']]
+
+    return stream_csv(rows(), 'balance_sheet.csv')
 
 @accounting_routes.route('/accounting/cash_flow_statement', methods=['GET'])
 @login_required
@@ -802,28 +661,17 @@ def cash_flow_statement():
     start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
     end_date = datetime.strptime(end_date_str, '%Y-%m-%d') + timedelta(days=1)  # Include the end date
 
-    # --- Get the owner ---
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
+    # --- Owner and period transactions, shared by every calculation ---
+    context = ReportContext.for_current_user(start_date, end_date)
 
-    # --- Fetch transactions for the period ---
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
+    # --- Calculations (cached until the owner's ledger changes) ---
+    figures = cash_flow_figures(context)
+    net_income = figures['net_income']
+    depreciation_amortisation = figures['depreciation_amortisation']
+    changes_in_operating_assets_liabilities = figures['changes_in_operating_assets_liabilities']
+    cash_from_operations = figures['cash_from_operations']
 
-    # --- Calculations ---
-    net_income = calculate_net_income(start_date, end_date)
-    depreciation_amortisation = calculate_depreciation_amortisation(start_date, end_date)
-    changes_in_operating_assets_liabilities = calculate_changes_in_operating_assets_liabilities(start_date, end_date)
-
-    # Calculate cash from operations using the fetched transactions
-    cash_from_operations = calculate_cash_from_operations(transactions, start_date, end_date)  
-    changes_in_operating_assets_liabilities = calculate_changes_in_operating_assets_liabilities(start_date, end_date) 
-    cash_from_operations = calculate_cash_from_operations(transactions, start_date, end_date)
-
-    investing_activities = calculate_investing_activities(start_date, end_date)
+    investing_activities = figures['investing_activities']
     # cash_from_investing = sum(item['amount'] for item in investing_activities)
     cash_from_investing = sum(float(item['amount']) for item in investing_activities if item['amount'].isdigit())
 
@@ -835,7 +683,7 @@ def cash_flow_statement():
             # Handle non-numeric values (e.g., log an error or skip the item)
             pass
 
-    financing_activities = calculate_financing_activities(start_date, end_date)
+    financing_activities = figures['financing_activities']
     # cash_from_financing = sum(item['amount'] for item in financing_activities)
     cash_from_financing = sum(float(item['amount']) for item in financing_activities if item['amount'].isdigit())
 
@@ -843,7 +691,7 @@ def cash_flow_statement():
     net_cash_flow = cash_from_operations + cash_from_investing + cash_from_financing
 
     # --- Prepare the context for the template ---
-    currency_symbol = current_user.currency.symbol if current_user and current_user.currency else '$'
+    currency_symbol = context.currency_symbol
     cash_flow_statement_data = {
         'net_income': format_currency(net_income, currency_symbol),
         'depreciation_amortisation': format_currency(depreciation_amortisation, currency_symbol),
@@ -873,9 +721,10 @@ def financials():
     properties = Property.query.filter_by(owner_id=owner.id).all() if owner else []
 
     # --- Calculations ---
-    total_assets = calculate_total_assets(start_date, end_date) 
-    net_income = calculate_net_income(start_date, end_date)  
-    cash_flow = calculate_net_cash_flow(start_date, end_date)  
+    context = ReportContext(owner, start_date, end_date, current_user.currency.symbol if current_user.currency else '$')
+    total_assets = calculate_total_assets(context)
+    net_income = calculate_net_income(context)
+    cash_flow = calculate_net_cash_flow(context)
 
     # --- Get the currency symbol ---
     # currency_symbol = current_user.currency.symbol if current_user and current_user.currency else '$'
@@ -895,9 +744,9 @@ def financials():
     )
 
 
-def calculate_retained_earnings(transactions):
+def calculate_retained_earnings(totals):
     """
-    Calculates retained earnings based on transactions.
+    Calculates retained earnings from per-account totals.
     This is a placeholder - you'll need to implement your actual logic.
 
     This might involve:
@@ -906,137 +755,254 @@ def calculate_retained_earnings(transactions):
       - Subtracting dividends.
     """
     # Placeholder implementation:
-    net_income = sum(transaction.amount for transaction in transactions if transaction.main_category == 'Revenue') - \
-                 sum(transaction.amount for transaction in transactions if transaction.main_category == 'Expenses')
-    dividends = sum(transaction.amount for transaction in transactions if transaction.account == 'Distributions')
+    net_income = totals.main_category('Revenue') - totals.main_category('Expenses')
+    dividends = totals.account('Distributions')
     return net_income - dividends 
 
-def generate_income_statement_data():
-    # This function should return the income statement data
-    transactions = db.session.query(Transaction).filter(Transaction.is_reconciled == True).all()
-    
-    # Calculations
-    revenue = sum(transaction.amount for transaction in transactions if transaction.main_category == 'Revenue')
-    cost_of_sales = sum(transaction.amount for transaction in transactions if transaction.sub_category == 'Cost of Sales')
-    gross_income = revenue - cost_of_sales
-
-    overhead_expenses = sum(transaction.amount for transaction in transactions if transaction.main_category == 'Expenses' and transaction.sub_category != 'Cost of Sales')
-    net_income = gross_income - overhead_expenses
-
-    # Prepare the income statement data
-    income_statement_data = {
-        'income': revenue,
-        'cost_of_sales': cost_of_sales,
-        'gross_income': gross_income,
-        'overhead_expenses': overhead_expenses,
-        'net_income': net_income,
-        'revenue_categories': {},  
-        'expense_categories': {}   
+def generate_income_statement_data(start_date, end_date):
+    """
+    Income statement data for the current user's reconciled transactions
+    between start_date and end_date (inclusive), for the PDF/CSV exports.
+    Shares the cached figures behind the HTML statement.
+    """
+    owner = Owner.query.filter_by(user_id=current_user.id).first()
+    figures = income_statement_figures(owner.id, start_date, end_date + timedelta(days=1))
+
+    return {
+        'income': figures['revenue'],
+        'cost_of_sales': figures['cost_of_sales'],
+        'gross_income': figures['gross_income'],
+        'overhead_expenses': figures['overhead_expenses'],
+        'net_income': figures['net_income'],
+        'revenue_categories': figures['revenue_categories'],
+        'expense_categories': figures['expense_categories']
     }
 
-    # Populate revenue categories
-    revenue_categories = {
-        'Rental Income': 0,
-        'Other Income': 0
-    }
-    
-    for transaction in transactions:
-        if transaction.main_category == 'Expenses' and transaction.sub_category != 'Cost of Sales':
+def format_currency(amount, currency_symbol):
+    return f"{currency_symbol}{amount:,.2f}"
 
-            if transaction.sub_category in revenue_categories:
-                revenue_categories[transaction.sub_category] += transaction.amount
+# --- Statement cache ---
 
-    income_statement_data['revenue_categories'] = revenue_categories
+def cached_statement(owner_id, statement, start_date, end_date, compute, variant=None):
+    """
+    Statement figures for an owner and period, computed once and shared by
+    the HTML page and its PDF/CSV exports. Keys carry the owner's ledger
+    version, so writing any of their transactions invalidates them.
+    Without a cache every worker shares, figures are computed each time.
+    """
+    if not workers_share_cache(current_app.config):
+        return compute()
+    key = 'statement:{}:{}:{}:{}:{}:{}'.format(
+        owner_id, statement, start_date.isoformat(), end_date.isoformat(), variant or '', ledger_version(owner_id)
+    )
+    figures = cache.get(key)
+    if figures is None:
+        figures = compute()
+        cache.set(key, figures, timeout=current_app.config.get('STATEMENT_CACHE_TIMEOUT', 3600))
+    return figures
 
-    # Populate expense categories
-    expense_categories = {}
-    for transaction in transactions:
-        if transaction.main_category == 'Expenses':
-            category = transaction.sub_category
-            expense_categories.setdefault(category, 0)
-            expense_categories[category] += transaction.amount
+def income_statement_figures(owner_id, start_date, end_date):
+    """
+    Raw income statement lines for [start_date, end_date).
+    """
+    def compute():
+        totals = account_totals(owner_id, start_date, end_date)
 
-    income_statement_data['expense_categories'] = expense_categories
+        revenue = totals.main_category('Revenue')
+        cost_of_sales = totals.sub_category('Cost of Sales')
 
-    return income_statement_data
+        # Revenue Categorization
+        revenue_by_sub_category = totals.sub_categories_of('Revenue')
+        revenue_categories = {
+            'Rental Income': revenue_by_sub_category.get('Rental Income', 0),
+            'Other Income': revenue_by_sub_category.get('Other Income', 0)
+        }
 
-def format_currency(amount, currency_symbol):
-    return f"{currency_symbol}{amount:,.2f}"
+        # Expense Categorization (excluding 'Cost of Sales' from overhead expenses)
+        expense_categories = {
+            category: amount
+            for category, amount in totals.sub_categories_of('Expenses').items()
+            if category != 'Cost of Sales'
+        }
+        overhead_expenses = sum(expense_categories.values())
+
+        return {
+            'revenue': revenue,
+            'revenue_categories': revenue_categories,
+            'cost_of_sales': cost_of_sales,
+            'gross_income': revenue - cost_of_sales,
+            'expense_categories': expense_categories,
+            'overhead_expenses': overhead_expenses,
+            'net_income': revenue - cost_of_sales - overhead_expenses,
+        }
 
-def generate_balance_sheet_data(start_date, end_date):
+    return cached_statement(owner_id, 'income_statement', start_date, end_date, compute)
+
+def balance_sheet_statement(owner_id, start_date, end_date):
     """
-    Generates the balance sheet data.
+    Balance sheet figures for [start_date, end_date) and the per-account
+    totals behind them (used for the CSV account lines).
     """
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date + timedelta(days=1)  # Include end_date
-    ).all()
+    def compute():
+        totals = account_totals(owner_id, start_date, end_date)
+        return {'figures': balance_sheet_figures(totals), 'totals': totals}
+
+    return cached_statement(owner_id, 'balance_sheet', start_date, end_date, compute)
+
+def cash_flow_figures(context):
+    """Cash flow statement lines for a report context"""
+    def compute():
+        changes_in_operating_assets_liabilities = calculate_changes_in_operating_assets_liabilities(context)
+        return {
+            'net_income': calculate_net_income(context),
+            'depreciation_amortisation': calculate_depreciation_amortisation(context),
+            'changes_in_operating_assets_liabilities': changes_in_operating_assets_liabilities,
+            'cash_from_operations': calculate_cash_from_operations(context, changes_in_operating_assets_liabilities),
+            'investing_activities': calculate_investing_activities(context),
+            'financing_activities': calculate_financing_activities(context),
+        }
 
+    # Activity lines are formatted with the user's currency symbol
+    return cached_statement(
+        context.owner.id, 'cash_flow', context.start_date, context.end_date, compute, variant=context.currency_symbol
+    )
 
-    # Assets
-    assets = sum(transaction.amount for transaction in transactions if transaction.main_category == 'Assets')
-    current_assets = sum(transaction.amount for transaction in transactions if transaction.sub_category == 'Current Assets')
-    non_current_assets = sum(transaction.amount for transaction in transactions if transaction.sub_category == 'Non-Current Assets')
-    cash_cash_equivalents = sum(transaction.amount for transaction in transactions if transaction.account == 'Bank')  
+def balance_sheet_figures(totals):
+    """
+    Derives every balance sheet line from per-account totals.
+    """
+    assets_classification = ACCOUNT_CLASSIFICATIONS['Assets']
+    liabilities_classification = ACCOUNT_CLASSIFICATIONS['Liabilities']
 
-    accounts_receivable = sum(transaction.amount for transaction in transactions if transaction.account in (
+    # Assets
+    current_assets = totals.accounts(assets_classification['Current Assets'])
+    non_current_assets = totals.accounts(assets_classification['Non-Current Assets'])
+    assets = current_assets + non_current_assets
+    cash_cash_equivalents = totals.account('Bank')
+    accounts_receivable = totals.accounts((
         'Accounts Receivable', 'Prepaid Expenses', 'Prepaid Insurance', 'Prepaid Rent'
     ))
-    property_plant_equipment = sum(transaction.amount for transaction in transactions if transaction.account in (
-        'Building', 'Equipment', 'Furniture and Fixtures', 'Land'
+    property_plant_equipment = totals.accounts((
+        'Building', 'Equipment', 'Furniture and Fixtures', 'Land', 'Leasehold Improvements'
     ))
 
     # Liabilities
-    liabilities = sum(transaction.amount for transaction in transactions if transaction.main_category == 'Liabilities')
-    current_liabilities = sum(transaction.amount for transaction in transactions if transaction.sub_category == 'Current Liabilities')
-    non_current_liabilities = sum(transaction.amount for transaction in transactions if transaction.sub_category == 'Non-Current Liabilities')
-    accounts_payable = sum(transaction.amount for t in transactions if t.account == 'Accounts Payable') 
-    mortgage_payable = sum(transaction.amount for t in transactions if t.account == 'Mortgage Payable')
-
-    # Equity 
-    equity = sum(transaction.amount for t in transactions if t.main_category == 'Equity')
-    share_capital = sum(t.amount for t in transactions if t.account in (
+    current_liabilities = totals.accounts(liabilities_classification['Current Liabilities'])
+    non_current_liabilities = totals.accounts(liabilities_classification['Non-Current Liabilities'])
+    liabilities = current_liabilities + non_current_liabilities
+    accounts_payable = totals.account('Accounts Payable')
+    mortgage_payable = totals.account('Mortgage Payable')
+
+    # Equity
+    equity = totals.accounts(ACCOUNT_CLASSIFICATIONS['Equity'])
+    share_capital = totals.accounts((
         'Contributed Capital', 'Owner/s Capital', 'Partner Contributions'
     ))
-    dividends = sum(t.amount for t in transactions if t.account == 'Distributions')
-
-    # You'll need a function to calculate retained earnings (replace this)
-    retained_earnings = calculate_retained_earnings(transactions)  
-
-    liabilities_equity = liabilities + equity
-
-    # --- Prepare the data dictionary ---
-    balance_sheet_data = {
-        'assets': format_currency(assets, current_user.currency.symbol),
-        'current_assets': format_currency(current_assets, current_user.currency.symbol),
-        'non_current_assets': format_currency(non_current_assets, current_user.currency.symbol),
-        'cash_cash_equivalents': format_currency(cash_cash_equivalents, current_user.currency.symbol),
-        'accounts_receivable': format_currency(accounts_receivable, current_user.currency.symbol),
-        'property_plant_equipment': format_currency(property_plant_equipment, current_user.currency.symbol),
-
-        'liabilities': format_currency(liabilities, current_user.currency.symbol),
-        'current_liabilities': format_currency(current_liabilities, current_user.currency.symbol),
-        'non_current_liabilities': format_currency(non_current_liabilities, current_user.currency.symbol),
-        'accounts_payable': format_currency(accounts_payable, current_user.currency.symbol),
-        'mortgage_payable': format_currency(mortgage_payable, current_user.currency.symbol),
-
-        'equity': format_currency(equity, current_user.currency.symbol),
-        'share_capital': format_currency(share_capital, current_user.currency.symbol),
-        'dividends': format_currency(dividends, current_user.currency.symbol),
-        'retained_earnings': format_currency(retained_earnings, current_user.currency.symbol), 
-        'liabilities_equity': format_currency(liabilities_equity, current_user.currency.symbol), 
-        'currency_symbol': current_user.currency.symbol,
+    dividends = totals.account('Distributions')
+    retained_earnings = calculate_retained_earnings(totals)
+
+    return {
+        'assets': assets,
+        'current_assets': current_assets,
+        'non_current_assets': non_current_assets,
+        'cash_cash_equivalents': cash_cash_equivalents,
+        'accounts_receivable': accounts_receivable,
+        'property_plant_equipment': property_plant_equipment,
+
+        'liabilities': liabilities,
+        'current_liabilities': current_liabilities,
+        'non_current_liabilities': non_current_liabilities,
+        'accounts_payable': accounts_payable,
+        'mortgage_payable': mortgage_payable,
+
+        'equity': equity,
+        'share_capital': share_capital,
+        'dividends': dividends,
+        'retained_earnings': retained_earnings,
+        'liabilities_equity': liabilities + equity,
     }
 
+def format_balance_sheet(figures, currency_symbol):
+    """Formats balance sheet figures for templates and exports."""
+    balance_sheet_data = {key: format_currency(value, currency_symbol) for key, value in figures.items()}
+    balance_sheet_data['currency_symbol'] = currency_symbol
     return balance_sheet_data
 
-def calculate_cash_from_operations(transactions, start_date, end_date):
+def generate_balance_sheet_data(start_date, end_date):
+    """
+    Generates the balance sheet data.
+    """
+    owner = Owner.query.filter_by(user_id=current_user.id).first()
+    statement = balance_sheet_statement(owner.id, start_date, end_date + timedelta(days=1))
+    return format_balance_sheet(statement['figures'], current_user.currency.symbol)
+
+class ReportContext:
+    """
+    The owner, period and reconciled transactions behind one financial
+    statement, resolved once per request and passed to every calculate_*
+    helper instead of each helper re-querying them.
+    """
+
+    def __init__(self, owner, start_date, end_date, currency_symbol='$'):
+        self.owner = owner
+        self.start_date = start_date
+        self.end_date = end_date
+        self.currency_symbol = currency_symbol
+
+    @classmethod
+    def for_current_user(cls, start_date, end_date):
+        """Context for the logged in user's owner record"""
+        owner = Owner.query.filter_by(user_id=current_user.id).first()
+        currency_symbol = current_user.currency.symbol if current_user.currency else '$'
+        return cls(owner, start_date, end_date, currency_symbol)
+
+    @cached_property
+    def transactions(self):
+        """Reconciled transactions dated in [start_date, end_date)"""
+        return Transaction.query.filter(
+            Transaction.owner_id == self.owner.id,
+            Transaction.is_reconciled == True,
+            Transaction.transaction_date >= self.start_date,
+            Transaction.transaction_date < self.end_date
+        ).all()
+
+    @cached_property
+    def account_sums(self):
+        sums = defaultdict(Decimal)
+        for t in self.transactions:
+            sums[t.account] += t.amount
+        return sums
+
+    def account_total(self, account):
+        """Period total for one account"""
+        return self.account_sums.get(account, Decimal('0'))
+
+    @cached_property
+    def revenue_by_property(self):
+        """Period revenue per property"""
+        revenue = defaultdict(Decimal)
+        for t in self.transactions:
+            if t.main_category == 'Revenue':
+                revenue[t.property_id] += t.amount
+        return revenue
+
+    @cached_property
+    def rental_income_tax_rates(self):
+        """rental_income_tax_rate per property with period revenue, fetched in one query"""
+        property_ids = [property_id for property_id in self.revenue_by_property if property_id is not None]
+        if not property_ids:
+            return {}
+        return dict(
+            db.session.query(Property.id, Property.rental_income_tax_rate)
+            .filter(Property.id.in_(property_ids), Property.rental_income_tax_rate.isnot(None))
+            .all()
+        )
+
+def calculate_cash_from_operations(context, changes_in_operating_assets_liabilities=None):
     """
     Calculates cash flow from operating activities.
     """
+    transactions = context.transactions
     operating_transactions = []
 
     # Include revenue transactions
@@ -1050,7 +1016,8 @@ def calculate_cash_from_operations(transactions, start_date, end_date):
         for account in accounts:
             operating_transactions.extend([t for t in transactions if t.account == account and t.amount < 0 and t.is_reconciled == True])
 
-    changes_in_operating_assets_liabilities = calculate_changes_in_operating_assets_liabilities(start_date, end_date)  
+    if changes_in_operating_assets_liabilities is None:
+        changes_in_operating_assets_liabilities = calculate_changes_in_operating_assets_liabilities(context)
 
     # Calculate net cash from operating activities
     net_cash_from_operating_activities = (
@@ -1060,46 +1027,29 @@ def calculate_cash_from_operations(transactions, start_date, end_date):
 
     return net_cash_from_operating_activities
 
-def calculate_cash_from_investing(transactions):
+def calculate_cash_from_investing(context):
     """
     Calculates cash flow from investing activities.
     """
-    investing_transactions = []
-    for account in ACCOUNT_CLASSIFICATIONS['Assets']['Non-Current Assets']:
-        investing_transactions.extend([t for t in transactions if t.account == account])
-
-    net_cash_from_investing_activities = sum(t.amount for t in investing_transactions)
-
-    return net_cash_from_investing_activities
+    return sum(
+        (context.account_total(account) for account in ACCOUNT_CLASSIFICATIONS['Assets']['Non-Current Assets']),
+        Decimal('0')
+    )
 
 
-def calculate_cash_from_financing(transactions):
+def calculate_cash_from_financing(context):
     """
     Calculates cash flow from financing activities.
     """
+    financing_accounts = (
+        ACCOUNT_CLASSIFICATIONS['Liabilities']['Current Liabilities']
+        + ACCOUNT_CLASSIFICATIONS['Liabilities']['Non-Current Liabilities']
+        + ACCOUNT_CLASSIFICATIONS['Equity']
+    )
+    return sum((context.account_total(account) for account in financing_accounts), Decimal('0'))
 
-    financing_transactions = []
-    for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Current Liabilities']:
-        financing_transactions.extend([t for t in transactions if t.account == account])
-    for account in ACCOUNT_CLASSIFICATIONS['Liabilities']['Non-Current Liabilities']:
-        financing_transactions.extend([t for t in transactions if t.account == account])
-    for account in ACCOUNT_CLASSIFICATIONS['Equity']:
-        financing_transactions.extend([t for t in transactions if t.account == account])
-
-    net_cash_from_financing_activities = sum(t.amount for t in financing_transactions)
-
-    return net_cash_from_financing_activities
-
-def calculate_investing_activities(start_date, end_date):
+def calculate_investing_activities(context):
     """Calculates cash flow from investing activities."""
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
-
     activities = []
     # Example investing activities (replace with your actual accounts)
     accounts_to_check = {
@@ -1107,22 +1057,14 @@ def calculate_investing_activities(start_date, end_date):
         "Sale of Property": "Proceeds from Sale of Property, Plant, and Equipment",
     }
     for account, label in accounts_to_check.items():
-        amount = sum(t.amount for t in transactions if t.account == account)
-        activities.append({'label': label, 'amount': format_currency(amount, current_user.currency.symbol)})
+        amount = context.account_total(account)
+        activities.append({'label': label, 'amount': format_currency(amount, context.currency_symbol)})
 
     return activities
 
 
-def calculate_financing_activities(start_date, end_date):
+def calculate_financing_activities(context):
     """Calculates cash flow from financing activities."""
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
-
     activities = []
     # Example financing activities (replace with your actual accounts)
     accounts_to_check = {
@@ -1132,48 +1074,33 @@ def calculate_financing_activities(start_date, end_date):
         "Distributions": "Payment of Dividends",
     }
     for account, label in accounts_to_check.items():
-        amount = sum(t.amount for t in transactions if t.account == account)
-        activities.append({'label': label, 'amount': format_currency(amount, current_user.currency.symbol)})
+        amount = context.account_total(account)
+        activities.append({'label': label, 'amount': format_currency(amount, context.currency_symbol)})
 
     return activities
 
-def calculate_total_assets(start_date, end_date):
+def calculate_total_assets(context):
     """Calculates total assets from the balance sheet."""
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,  
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
-
     assets = 0
     for category, accounts in ACCOUNT_CLASSIFICATIONS['Assets'].items():
         for account in accounts:
-            assets += sum(t.amount for t in transactions if t.account == account)
+            assets += context.account_total(account)
 
     return assets
 
-def calculate_net_income(start_date, end_date):
+def calculate_net_income(context):
     """Calculates net income from the income statement."""
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
+    transactions = context.transactions
 
     revenue = sum(t.amount for t in transactions if t.main_category == 'Revenue')
     
-    # Calculate total tax on rental income
+    # Calculate total tax on rental income per property
     total_rental_income_tax = 0
-    for t in transactions:
-        if t.main_category == 'Revenue':
-            property = Property.query.get(t.property_id)
-            if property and property.rental_income_tax_rate:
-                tax_rate = property.rental_income_tax_rate / 100  # Convert to decimal
-                total_rental_income_tax += t.amount * tax_rate
+    tax_rates = context.rental_income_tax_rates
+    for property_id, property_revenue in context.revenue_by_property.items():
+        if tax_rates.get(property_id):
+            tax_rate = Decimal(str(tax_rates[property_id])) / 100  # Float column, convert to decimal
+            total_rental_income_tax += property_revenue * tax_rate
 
     revenue_after_tax = revenue - total_rental_income_tax  
 
@@ -1185,55 +1112,29 @@ def calculate_net_income(start_date, end_date):
     return net_income
 
 
-def calculate_net_cash_flow(start_date, end_date):
+def calculate_net_cash_flow(context):
     """Calculates net cash flow from the cash flow statement."""
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
-
-    depreciation_amortisation = calculate_depreciation_amortisation(start_date, end_date)
+    depreciation_amortisation = calculate_depreciation_amortisation(context)
 
     return (
-        calculate_cash_from_operations(transactions, start_date, end_date)  # Pass start_date and end_date here
-        + calculate_cash_from_investing(transactions)
-        + calculate_cash_from_financing(transactions)
+        calculate_cash_from_operations(context)
+        + calculate_cash_from_investing(context)
+        + calculate_cash_from_financing(context)
         + depreciation_amortisation
     )
 
-def calculate_depreciation_amortisation(start_date, end_date):
+def calculate_depreciation_amortisation(context):
     """Calculates depreciation and amortization."""
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
-
     depreciation_amortisation = 0
     for category, accounts in ACCOUNT_CLASSIFICATIONS['Expenses'].items():
         if category == 'Depreciation & Amortization':  # Check if the category is Depreciation & Amortization
             for account in accounts:
-                depreciation_amortisation += sum(t.amount for t in transactions if t.account == account and t.amount < 0)
+                depreciation_amortisation += sum(t.amount for t in context.transactions if t.account == account and t.amount < 0)
 
     return depreciation_amortisation
 
-def calculate_changes_in_operating_assets_liabilities(start_date, end_date):
+def calculate_changes_in_operating_assets_liabilities(context):
     """Calculates changes in operating assets and liabilities."""
-    owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date
-    ).all()
-
-    # changes_in_operating_assets_liabilities = calculate_changes_in_operating_assets_liabilities(start_date, end_date)
-
     changes = []
     accounts_to_check = {
         "Accounts Receivable": "Increase (Decrease) in Accounts Receivable",
@@ -1242,9 +1143,12 @@ def calculate_changes_in_operating_assets_liabilities(start_date, end_date):
         "Accrued Expenses": "Increase (Decrease) in Accrued Expenses",
     }
 
+    # Opening and closing balances for every account in one pass
+    balances = account_balances(context.owner.id, accounts_to_check, [context.start_date, context.end_date])
+
     for account, label in accounts_to_check.items():
-        beginning_balance = calculate_beginning_balance(account, start_date)
-        ending_balance = calculate_ending_balance(account, end_date)
+        beginning_balance = balances[account][context.start_date]
+        ending_balance = balances[account][context.end_date]
         change = ending_balance - beginning_balance
         changes.append({'label': label, 'amount': change}) 
 
@@ -1254,24 +1158,12 @@ def calculate_changes_in_operating_assets_liabilities(start_date, end_date):
 def calculate_beginning_balance(account, start_date):
     """Calculates the beginning balance of an account."""
     owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.account == account,
-        Transaction.transaction_date < start_date
-    ).all()
-    return sum(t.amount for t in transactions)
+    return account_balances(owner.id, [account], [start_date])[account][start_date]
 
 def calculate_ending_balance(account, end_date):
     """Calculates the ending balance of an account."""
     owner = Owner.query.filter_by(user_id=current_user.id).first()
-    transactions = Transaction.query.filter(
-        Transaction.owner_id == owner.id,
-        Transaction.is_reconciled == True,
-        Transaction.account == account,
-        Transaction.transaction_date < end_date
-    ).all()
-    return sum(t.amount for t in transactions)
+    return account_balances(owner.id, [account], [end_date])[account][end_date]
 
 def calculate_property_tax(property):
     """Calculates property tax for a given property."""
@@ -1343,26 +1235,27 @@ def get_property_tax():
 
         params = {k: v for k, v in params.items() if v is not None}
 
-        response = requests.get(
-            app.config['API_NINJA_API_URL'],
+        response = http_client.get(
+            'api_ninjas',
+            current_app.config['API_NINJA_API_URL'],
             params=params,
-            headers={'X-Api-Key': app.config['API_NINJA_API_KEY']}
+            headers={'X-Api-Key': current_app.config['API_NINJA_API_KEY']}
         )
         response.raise_for_status()
 
         data = response.json()
 
         if not isinstance(data, dict) or 'result' not in data:
-            app.logger.error(f"Unexpected API response format: {data}")
+            current_app.logger.error(f"Unexpected API response format: {data}")
             return jsonify({"error": "Invalid data received from the API."}), 500
 
         return jsonify(data)
 
     except requests.exceptions.HTTPError as e:
-        app.logger.error(f"API request failed with HTTP error: {e}")
+        current_app.logger.error(f"API request failed with HTTP error: {e}")
         return jsonify({"error": "Failed to fetch property tax data. Please check your input and try again."}), e.response.status_code
     except requests.exceptions.RequestException as e:
-        app.logger.error(f"API request failed: {e}")
+        current_app.logger.error(f"API request failed: {e}")
         return jsonify({"error": "An error occurred while processing your request. Please try again later."}), 500
 
 def generate_invoice_pdf(invoice_data):
@@ -2,8 +2,10 @@ from flask import Blueprint, jsonify, request, current_app, g, render_template
 from models import State, Country, Budget, Owner, Transaction, Banks, Property
 from flask_login import login_required, current_user
 from datetime import datetime, timedelta
-from sqlalchemy import extract, func
+from sqlalchemy import func
 from extensions import db
+from ledger import ledger_total, ledger_totals, period_end
+from search_index import AMENITIES, SORTS, properties_in_view, properties_near, search_listings, search_properties
 
 api_routes = Blueprint('api_routes', __name__)
 
@@ -88,53 +90,34 @@ def monthly_financials():
         if not owner:
             return jsonify({'error': 'Owner not found'}), 404
 
-        # Base query for owner's transactions in the past 365 days
-        base_query = Transaction.query.filter(
-            Transaction.owner_id == owner.id,
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,
-            Transaction.is_reconciled == True  # Only include reconciled transactions
-        )
-
         # Initialize monthly data
         months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
         monthly_income = [0] * 12
         monthly_expenses = [0] * 12
         monthly_cashflow = [0] * 12
 
-        # Get monthly income (Revenue transactions)
-        income_results = db.session.query(
-            extract('month', Transaction.transaction_date).label('month'),
-            func.sum(Transaction.amount).label('total')
-        ).filter(
-            Transaction.owner_id == owner.id,
-            Transaction.main_category == 'Revenue',
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,
-            Transaction.is_reconciled == True  # Only include reconciled transactions
-        ).group_by(
-            extract('month', Transaction.transaction_date)
-        ).all()
+        # Monthly totals come from the ledger rollup (reconciled transactions only)
+        ledger_end = period_end(end_date, inclusive=True)
 
-        # Get monthly expenses (Expenses transactions)
-        expense_results = db.session.query(
-            extract('month', Transaction.transaction_date).label('month'),
-            func.sum(Transaction.amount).label('total')
-        ).filter(
-            Transaction.owner_id == owner.id,
-            Transaction.sub_category == 'Cost of Sales',
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,
-            Transaction.is_reconciled == True  # Only include reconciled transactions
-        ).group_by(
-            extract('month', Transaction.transaction_date)
-        ).all()
+        # Get monthly income (Revenue transactions)
+        income_results = ledger_totals(
+            owner.id, start_date, ledger_end,
+            group_by=('month',),
+            main_category='Revenue'
+        ).items()
+
+        # Get monthly expenses (Cost of Sales transactions)
+        expense_results = ledger_totals(
+            owner.id, start_date, ledger_end,
+            group_by=('month',),
+            sub_category='Cost of Sales'
+        ).items()
 
         # Populate monthly arrays
-        for month, total in income_results:
+        for (month,), total in income_results:
             monthly_income[int(month) - 1] = float(total or 0)
 
-        for month, total in expense_results:
+        for (month,), total in expense_results:
             monthly_expenses[int(month) - 1] = float(total or 0)
 
         # Calculate monthly cashflow
@@ -179,20 +162,16 @@ def expenses_summary():
         if not owner:
             return jsonify({'error': 'Owner not found'}), 404
 
-        # Query to sum expenses for the specified date range
-        expenses_data = db.session.query(
-            Transaction.sub_category,
-            func.sum(Transaction.amount).label('total_amount')
-        ).filter(
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,
-            Transaction.main_category == 'Expenses',
-            Transaction.is_reconciled == True,  # Only include reconciled transactions
-            Transaction.property_id.in_([p.id for p in owner.properties])  # Limit to properties owned by the current user
-        ).group_by(Transaction.sub_category).all()
+        # Sum reconciled expenses for the specified date range from the ledger rollup
+        expenses_data = ledger_totals(
+            owner.id, start_date, period_end(end_date, inclusive=True),
+            group_by=('sub_category',),
+            main_category='Expenses',
+            property_id=[p.id for p in owner.properties]  # Limit to properties owned by the current user
+        )
 
         # Convert the results to a dictionary for easier access
-        summary_dict = {sub_category: float(total_amount) for sub_category, total_amount in expenses_data}
+        summary_dict = {sub_category: float(total_amount) for (sub_category,), total_amount in expenses_data.items()}
 
         return jsonify(summary_dict)  # Return the summary as JSON
     except Exception as e:
@@ -245,20 +224,16 @@ def income_summary():
         if not owner:
             return jsonify({'error': 'Owner not found'}), 404
 
-        # Query to sum income for the specified date range
-        income_data = db.session.query(
-            Transaction.sub_category,
-            func.sum(Transaction.amount).label('total_amount')
-        ).filter(
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,
-            Transaction.main_category == 'Revenue',
-            Transaction.is_reconciled == True,  # Only include reconciled transactions
-            Transaction.property_id.in_([p.id for p in owner.properties])  # Limit to properties owned by the current user
-        ).group_by(Transaction.sub_category).all()
+        # Sum reconciled income for the specified date range from the ledger rollup
+        income_data = ledger_totals(
+            owner.id, start_date, period_end(end_date, inclusive=True),
+            group_by=('sub_category',),
+            main_category='Revenue',
+            property_id=[p.id for p in owner.properties]  # Limit to properties owned by the current user
+        )
 
         # Convert the results to a dictionary for easier access
-        summary_dict = {sub_category: float(total_amount) for sub_category, total_amount in income_data}
+        summary_dict = {sub_category: float(total_amount) for (sub_category,), total_amount in income_data.items()}
 
         return jsonify(summary_dict)  # Return the summary as JSON
     except Exception as e:
@@ -370,6 +345,103 @@ def get_property_owner(property_id):
         current_app.logger.error(f"Error fetching property owner: {str(e)}")
         return jsonify({'error': 'Failed to retrieve property owner'}), 500
 
+@api_routes.route('/api/search/properties', methods=['GET'])
+@login_required
+def property_autocomplete():
+    """Autocomplete over the current owner's properties, from the in-memory search index"""
+    try:
+        query = request.args.get('q', '').strip()
+        limit = max(min(request.args.get('limit', 10, type=int), 50), 1)
+        owner = Owner.query.filter_by(user_id=current_user.id).first()
+        if not owner or not query:
+            return jsonify([])
+
+        return jsonify([
+            dict(match, score=score)
+            for score, match in search_properties(query, owner_id=owner.id, limit=limit)
+        ])
+    except Exception as e:
+        current_app.logger.error(f"Error searching properties: {str(e)}")
+        return jsonify({'error': 'Failed to search properties'}), 500
+
+@api_routes.route('/api/search/nearby', methods=['GET'])
+@login_required
+def listings_nearby():
+    """Listed properties within radius_km of lat/lng, nearest first"""
+    lat = request.args.get('lat', type=float)
+    lng = request.args.get('lng', type=float)
+    radius_km = request.args.get('radius_km', 10.0, type=float)
+    limit = max(min(request.args.get('limit', 100, type=int), 500), 1)
+    if lat is None or lng is None or not -90 <= lat <= 90 or not -180 <= lng <= 180 or not 0 < radius_km <= 500:
+        return jsonify({'error': 'lat, lng and a radius_km up to 500 are required'}), 400
+
+    try:
+        matches, total = properties_near(lat, lng, radius_km, limit=limit)
+        return jsonify({'total': total, 'results': matches})
+    except Exception as e:
+        current_app.logger.error(f"Error searching nearby listings: {str(e)}")
+        return jsonify({'error': 'Failed to search nearby listings'}), 500
+
+@api_routes.route('/api/search/map', methods=['GET'])
+@login_required
+def listings_in_view():
+    """Listed properties inside a map viewport (south, west, north, east), nearest the centre first"""
+    bounds = [request.args.get(name, type=float) for name in ('south', 'west', 'north', 'east')]
+    limit = max(min(request.args.get('limit', 200, type=int), 1000), 1)
+    if any(value is None for value in bounds):
+        return jsonify({'error': 'south, west, north and east are required'}), 400
+    south, west, north, east = bounds
+    if not -90 <= south <= north <= 90 or not -180 <= west <= 180 or not -180 <= east <= 180:
+        return jsonify({'error': 'Invalid viewport'}), 400
+
+    try:
+        matches, total = properties_in_view(
+            south, west, north, east, limit=limit,
+            lat=request.args.get('lat', type=float),
+            lng=request.args.get('lng', type=float)
+        )
+        return jsonify({'total': total, 'results': matches})
+    except Exception as e:
+        current_app.logger.error(f"Error searching listings in view: {str(e)}")
+        return jsonify({'error': 'Failed to search listings in view'}), 500
+
+@api_routes.route('/api/search/listings', methods=['GET'])
+@login_required
+def listing_search():
+    """
+    Faceted search over listed properties, e.g.
+    ?bedrooms=3&amenities=swimming_pool,pet_friendly&max_rent=15000&available_by=2026-03-01
+    """
+    amenities = [name for name in request.args.get('amenities', '').split(',') if name]
+    unknown = [name for name in amenities if name not in AMENITIES]
+    sort = request.args.get('sort', 'newest')
+    available_by = request.args.get('available_by')
+    try:
+        available_by = datetime.strptime(available_by, '%Y-%m-%d').date() if available_by else None
+    except ValueError:
+        return jsonify({'error': 'available_by must be YYYY-MM-DD'}), 400
+    if unknown or sort not in SORTS:
+        return jsonify({'error': f"Unknown amenities or sort: {', '.join(unknown) or sort}"}), 400
+
+    try:
+        return jsonify(search_listings(
+            amenities=amenities,
+            minimums={
+                'bedroom': request.args.get('bedrooms', type=int),
+                'bathroom': request.args.get('bathrooms', type=int),
+                'garage': request.args.get('garages', type=int)
+            },
+            min_rent=request.args.get('min_rent', type=float),
+            max_rent=request.args.get('max_rent', type=float),
+            available_by=available_by,
+            sort=sort,
+            page=max(request.args.get('page', 1, type=int), 1),
+            per_page=min(max(request.args.get('per_page', 20, type=int), 1), 100)
+        ))
+    except Exception as e:
+        current_app.logger.error(f"Error searching listings: {str(e)}")
+        return jsonify({'error': 'Failed to search listings'}), 500
+
 @api_routes.route('/api/occupancy-level')
 @login_required
 def occupancy_level():
@@ -382,26 +454,17 @@ def occupancy_level():
         if not owner:
             return jsonify({'error': 'Owner not found'}), 404
 
+        # Properties with transactions in the date range, from the ledger rollup
+        active_property_ids = transacting_property_ids(owner.id, start_date, end_date)
+
         occupied_count = db.session.query(func.count(Property.id)).filter(
             Property.status == 'occupied',
-            Property.id.in_(
-                db.session.query(Transaction.property_id).filter(
-                    Transaction.owner_id == owner.id,  # Limit to properties owned by the current user
-                    Transaction.transaction_date >= start_date,
-                    Transaction.transaction_date <= end_date  # Apply date filter
-                )
-            )
+            Property.id.in_(active_property_ids)
         ).scalar()
 
         listed_count = db.session.query(func.count(Property.id)).filter(
             Property.status == 'listed',
-            Property.id.in_(
-                db.session.query(Transaction.property_id).filter(
-                    Transaction.owner_id == owner.id,  # Limit to properties owned by the current user
-                    Transaction.transaction_date >= start_date,
-                    Transaction.transaction_date <= end_date  # Apply date filter
-                )
-            )
+            Property.id.in_(active_property_ids)
         ).scalar()
 
         # Calculate occupancy level
@@ -431,21 +494,21 @@ def operating_expenses_ratio():
         if not owner:
             return jsonify({'error': 'Owner not found'}), 404
 
+        ledger_end = period_end(end_date, inclusive=True)
+
         # Calculate total operating expenses
-        operating_expenses = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.sub_category == 'Operating Expenses',
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,  # Apply date filter
-            Transaction.owner_id == owner.id
-        ).scalar() or 0  # Default to 0 if no expenses
+        operating_expenses = ledger_total(
+            owner.id, start_date, ledger_end,
+            reconciled_only=False,
+            sub_category='Operating Expenses'
+        )
 
         # Calculate total revenue
-        revenue = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.main_category == 'Revenue',
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,  # Apply date filter
-            Transaction.owner_id == owner.id
-        ).scalar() or 0  # Default to 0 if no revenue
+        revenue = ledger_total(
+            owner.id, start_date, ledger_end,
+            reconciled_only=False,
+            main_category='Revenue'
+        )
 
         # Avoid division by zero
         if revenue == 0:
@@ -462,6 +525,15 @@ def operating_expenses_ratio():
         return jsonify({'error': str(e)}), 500
 
 
+def transacting_property_ids(owner_id, start_date, end_date):
+    """IDs of the owner's properties with any transaction between start_date and end_date (inclusive)"""
+    property_totals = ledger_totals(
+        owner_id, start_date, period_end(end_date, inclusive=True),
+        group_by=('property_id',),
+        reconciled_only=False
+    )
+    return [property_id for (property_id,) in property_totals if property_id is not None]
+
 def transaction_data_filter():
     filter_type = request.args.get('filter', 'current_period')  # Default to 'current_period'
     
@@ -503,21 +575,15 @@ def dashboard_data():
         if not owner:
             return jsonify({'error': 'Owner not found'}), 404
 
-        # Calculate total income
-        total_income = db.session.query(func.sum(Transaction.amount)).filter(
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,
-            Transaction.main_category == 'Revenue',
-            Transaction.owner_id == owner.id
-        ).scalar() or 0  # Default to 0 if no income
-
-        # Calculate total expenses
-        total_expenses = db.session.query(func.sum(Transaction.amount)).filter(
-            Transaction.transaction_date >= start_date,
-            Transaction.transaction_date <= end_date,
-            Transaction.main_category == 'Expenses',
-            Transaction.owner_id == owner.id
-        ).scalar() or 0  # Default to 0 if no expenses
+        # Income and expense totals by main category from the ledger rollup
+        category_totals = ledger_totals(
+            owner.id, start_date, period_end(end_date, inclusive=True),
+            group_by=('main_category',),
+            reconciled_only=False,
+            main_category=['Revenue', 'Expenses']
+        )
+        total_income = category_totals.get(('Revenue',), 0)  # Default to 0 if no income
+        total_expenses = category_totals.get(('Expenses',), 0)  # Default to 0 if no expenses
 
         # Calculate budget summary
         budget_data = db.session.query(
@@ -532,26 +598,16 @@ def dashboard_data():
         budget_summary = {budget_type: float(total_budget) for budget_type, total_budget in budget_data}
 
         # Calculate occupancy level
+        active_property_ids = transacting_property_ids(owner.id, start_date, end_date)
+
         occupied_count = db.session.query(func.count(Property.id)).filter(
             Property.status == 'occupied',
-            Property.id.in_(
-                db.session.query(Transaction.property_id).filter(
-                    Transaction.owner_id == owner.id,
-                    Transaction.transaction_date >= start_date,
-                    Transaction.transaction_date <= end_date
-                )
-            )
+            Property.id.in_(active_property_ids)
         ).scalar() or 0
 
         listed_count = db.session.query(func.count(Property.id)).filter(
             Property.status == 'listed',
-            Property.id.in_(
-                db.session.query(Transaction.property_id).filter(
-                    Transaction.owner_id == owner.id,
-                    Transaction.transaction_date >= start_date,
-                    Transaction.transaction_date <= end_date
-                )
-            )
+            Property.id.in_(active_property_ids)
         ).scalar() or 0
 
         occupancy_ratio = occupied_count / listed_count if listed_count > 0 else 0
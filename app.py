@@ -1,6 +1,5 @@
 import logging
 from datetime import datetime, time, timedelta
-from functools import cache
 import os
 import threading
 from flask import Flask, current_app, g, jsonify, request, render_template
@@ -9,7 +8,7 @@ from flask_login import current_user, LoginManager
 from models import RentalAgreement, User, Message
 from property import property_routes
 from auth import auth_routes
-from extensions import db, mail, migrate
+from extensions import cache, db, mail, migrate
 from accounting import accounting_routes
 from listings import listing_routes
 from flask_wtf.csrf import CSRFProtect
@@ -21,11 +20,14 @@ from profiles import profile_routes
 from contextlib import contextmanager
 from cachetools import TTLCache
 from sqlalchemy.pool import QueuePool
-from flask_caching import Cache
 from transaction import transaction_routes
 from sqlalchemy.orm import Session
 from api import api_routes
 from messaging import message_routes
+from ledger import rebuild_ledger_rollup_command
+from pdf_renderer import pdf_routes
+from property_photos import backfill_property_photos_command
+from images import photo_srcset, photo_url
 from openai import classify_transaction_with_azure
 import pdfkit
 
@@ -69,7 +71,10 @@ def create_app():
     mail.init_app(app)
     migrate.init_app(app, db)
     csrf = CSRFProtect(app)
-    cache = Cache(app, config={'CACHE_TYPE': 'simple'})
+    cache.init_app(app)
+    
+    # Responsive photo helpers for templates
+    app.jinja_env.globals.update(photo_url=photo_url, photo_srcset=photo_srcset)
     
     # Configure CORS
     CORS(app, resources={r"/api/*": {"origins": ["https://propves.com"]}})
@@ -165,6 +170,11 @@ Environment: {app.config.get('ENV', 'production')}
     app.register_blueprint(api_routes)
     app.register_blueprint(listing_routes)
     app.register_blueprint(message_routes)
+    app.register_blueprint(pdf_routes)
+
+    # CLI commands
+    app.cli.add_command(rebuild_ledger_rollup_command)
+    app.cli.add_command(backfill_property_photos_command)
     
     # Ensure upload directories exist
     upload_folder = os.path.join(app.root_path, 'uploads')
@@ -0,0 +1,224 @@
+# classifier.py
+"""
+Account classification for uploaded line items.
+
+Descriptions are normalised ("Water & Sewer 03/2024" -> "water and sewer")
+and resolved by three local tiers before any network call:
+
+1. An in-process TTLCache of recent answers, per (owner, description).
+2. The classification_cache table, where an owner's own corrections take
+   precedence over answers shared by every owner.
+3. The keyword matcher in account_rules.py, when it is confident enough.
+
+Only what is left reaches the Azure LLM, all of a document's in one batch through
+classify_transactions_with_azure. Answers in the chart of accounts are stored
+for everyone; anything else is UNCATEGORIZED and asked about again next time.
+Corrections made on the transactions overview are recorded against the
+owner, so the next upload of the same statement classifies without the LLM.
+
+Hit counts are buffered in memory and written in one batch every
+CLASSIFICATION_HIT_FLUSH lookups, so cached lookups never wait on a write.
+"""
+import re
+import threading
+from collections import Counter
+from datetime import datetime
+from cachetools import TTLCache
+from flask import current_app
+from sqlalchemy import insert, or_, update
+from sqlalchemy.exc import IntegrityError
+from account_rules import LEDGER_ACCOUNTS, match_account
+from extensions import db
+from models import ClassificationCache
+from openai import classify_transactions_with_azure
+
+UNCATEGORIZED = 'Uncategorized'
+LOOKUP_CHUNK = 500  # Keys per IN (...) lookup, well under the MSSQL parameter limit
+
+_NOISE = re.compile(r'[^a-z0-9]+')
+_KEY_LENGTH = ClassificationCache.description_key.type.length
+
+_lock = threading.Lock()
+_recent = None
+_pending_hits = Counter()
+
+
+def normalize_description(description):
+    """Cache key for a line item: lower case, '&' as 'and', no punctuation or bare numbers."""
+    words = _NOISE.sub(' ', (description or '').lower().replace('&', ' and ')).split()
+    return ' '.join(word for word in words if not word.isdigit())[:_KEY_LENGTH]
+
+def _recent_cache():
+    global _recent
+    if _recent is None:
+        with _lock:
+            if _recent is None:
+                _recent = TTLCache(
+                    maxsize=current_app.config.get('CLASSIFICATION_CACHE_SIZE', 4096),
+                    ttl=current_app.config.get('CLASSIFICATION_CACHE_TTL', 300)
+                )
+    return _recent
+
+def _count_hits(entry_ids):
+    """Buffers hits and writes the buffer once it is large enough."""
+    with _lock:
+        _pending_hits.update(entry_ids)
+        if sum(_pending_hits.values()) < current_app.config.get('CLASSIFICATION_HIT_FLUSH', 50):
+            return
+        hits = dict(_pending_hits)
+        _pending_hits.clear()
+    _write_hits(hits)
+
+def _write_hits(hits):
+    try:
+        now = datetime.utcnow()
+        with db.engine.begin() as connection:
+            for entry_id, count in hits.items():
+                connection.execute(
+                    update(ClassificationCache)
+                    .where(ClassificationCache.id == entry_id)
+                    .values(hit_count=ClassificationCache.hit_count + count, last_hit_at=now)
+                )
+    except Exception as e:
+        current_app.logger.warning(f"Could not record classification cache hits: {str(e)}")
+
+def flush_hit_counts():
+    """Writes any buffered hit counts."""
+    with _lock:
+        hits = dict(_pending_hits)
+        _pending_hits.clear()
+    if hits:
+        _write_hits(hits)
+
+def _lookup(keys, owner_id):
+    """Cached (entry_id, account) for each normalised key found in either tier."""
+    recent = _recent_cache()
+    found = {}
+    with _lock:
+        for key in keys:
+            entry = recent.get((owner_id, key))
+            if entry is not None:
+                found[key] = entry
+
+    missing = [key for key in keys if key not in found]
+    if missing:
+        scope = ClassificationCache.owner_id.is_(None)
+        if owner_id is not None:
+            scope = or_(scope, ClassificationCache.owner_id == owner_id)
+        loaded = {}
+        for start in range(0, len(missing), LOOKUP_CHUNK):
+            rows = db.session.query(
+                ClassificationCache.id, ClassificationCache.description_key,
+                ClassificationCache.account, ClassificationCache.owner_id
+            ).filter(ClassificationCache.description_key.in_(missing[start:start + LOOKUP_CHUNK]), scope)
+            for row in rows:
+                # The owner's own correction wins over the shared answer
+                if row.description_key not in loaded or row.owner_id is not None:
+                    loaded[row.description_key] = (row.id, row.account)
+        with _lock:
+            for key, entry in loaded.items():
+                recent[(owner_id, key)] = entry
+        found.update(loaded)
+
+    if found:
+        _count_hits(entry_id for entry_id, _ in found.values())
+    return found
+
+def cached_account(description, owner_id=None):
+    """Account from the cache tiers for a description, or None on a miss."""
+    key = normalize_description(description)
+    if not key:
+        return None
+    entry = _lookup([key], owner_id).get(key)
+    return entry[1] if entry else None
+
+def _store(key, account):
+    """Saves an LLM answer as a shared entry, outside the caller's session."""
+    if account not in LEDGER_ACCOUNTS:
+        return None
+    try:
+        with db.engine.begin() as connection:
+            result = connection.execute(insert(ClassificationCache).values(
+                description_key=key,
+                owner_id=None,
+                account=account,
+                source='llm',
+                hit_count=0,
+                created_at=datetime.utcnow()
+            ))
+        return result.inserted_primary_key[0]
+    except IntegrityError:
+        return None  # Another worker classified the same description first
+    except Exception as e:
+        current_app.logger.warning(f"Could not store classification for '{key}': {str(e)}")
+        return None
+
+def classify_descriptions(descriptions, owner_id=None):
+    """
+    Accounts for many line items, in order. Cached descriptions and
+    confident rule matches are answered locally; the rest go to the Azure
+    LLM together, a chunk per request, and each distinct description is
+    asked about once. Without an Azure key the best rule match is used
+    regardless of confidence. Items nothing classifies come back as
+    UNCATEGORIZED.
+    """
+    keys = [normalize_description(description) for description in descriptions]
+    found = _lookup(list(dict.fromkeys(key for key in keys if key)), owner_id)
+
+    # Confident local rule matches next, then one question per distinct remaining description
+    threshold = current_app.config.get('CLASSIFICATION_RULE_CONFIDENCE', 0.75)
+    offline = not current_app.config.get('AZURE_API_KEY')
+    answers, questions = {}, {}
+    for description, key in zip(descriptions, keys):
+        answer_key = key or description
+        if key in found or answer_key in answers or answer_key in questions:
+            continue
+        account, confidence = match_account(description)
+        if account and (confidence >= threshold or offline):
+            answers[answer_key] = account
+        elif offline:
+            answers[answer_key] = UNCATEGORIZED
+        else:
+            questions[answer_key] = description
+
+    if questions:
+        accounts = classify_transactions_with_azure(list(questions.values()))
+        recent = _recent_cache()
+        for (key, description), account in zip(questions.items(), accounts):
+            # Journal entries cannot be generated for accounts outside the chart
+            account = account if account in LEDGER_ACCOUNTS else UNCATEGORIZED
+            answers[key] = account
+            if account != UNCATEGORIZED and key == normalize_description(description):
+                entry_id = _store(key, account)
+                if entry_id is not None:
+                    with _lock:
+                        recent[(owner_id, key)] = (entry_id, account)
+
+    return [
+        found[key][1] if key in found else answers[key or description]
+        for description, key in zip(descriptions, keys)
+    ]
+
+def classify_description(description, owner_id=None):
+    """Account for a single line item; see classify_descriptions."""
+    return classify_descriptions([description], owner_id)[0]
+
+def record_correction(description, account, owner_id):
+    """
+    Remembers an owner's account for a description. The row is added to the
+    current session, so it commits (or rolls back) with the edit it came from.
+    """
+    key = normalize_description(description)
+    if not key or not account:
+        return
+
+    entry = ClassificationCache.query.filter_by(description_key=key, owner_id=owner_id).first()
+    if entry is None:
+        entry = ClassificationCache(description_key=key, owner_id=owner_id, hit_count=0)
+        db.session.add(entry)
+    entry.account = account
+    entry.source = 'owner'
+
+    recent = _recent_cache()
+    with _lock:
+        recent.pop((owner_id, key), None)
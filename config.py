@@ -1,5 +1,6 @@
 #config.py
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Load environment variables from a .env file
@@ -73,8 +74,40 @@ class Config:
     ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
     MAX_CONTENT_LENGTH = 16 * 1024 * 1024  # 16MB max file size
     
+    # Cache configuration (Flask-Caching). Ledger versions, job records and
+    # search change logs live here, so every worker must see the same cache:
+    # setting CACHE_REDIS_URL selects RedisCache. SimpleCache is per process
+    # and only fit for a single worker; with more, gunicorn.conf.py clears
+    # WORKERS_SHARE_CACHE and the features relying on it are turned down.
+    CACHE_REDIS_URL = os.environ.get('CACHE_REDIS_URL')
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'RedisCache' if CACHE_REDIS_URL else 'SimpleCache')
+    CACHE_DEFAULT_TIMEOUT = 300
+    STATEMENT_CACHE_TIMEOUT = int(os.environ.get('STATEMENT_CACHE_TIMEOUT', 3600))
+
+    # Background jobs, PDF rendering, photo and document ingestion (see jobs.py, pdf_renderer.py, images.py, transaction.py)
+    JOB_RESULT_TIMEOUT = int(os.environ.get('JOB_RESULT_TIMEOUT', 600))
+    PDF_RENDER_WORKERS = int(os.environ.get('PDF_RENDER_WORKERS', 2))
+    PDF_CACHE_DIR = os.environ.get('PDF_CACHE_DIR', os.path.join(tempfile.gettempdir(), 'propves-pdf-cache'))
+    PDF_CACHE_MAX_BYTES = int(os.environ.get('PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024))
+    PDF_TEMPLATE_VERSION = os.environ.get('PDF_TEMPLATE_VERSION', '1')  # Bump when PDF templates or styles change
+    PHOTO_INGEST_WORKERS = int(os.environ.get('PHOTO_INGEST_WORKERS', 2))
+    PHOTO_STAGING_DIR = os.environ.get('PHOTO_STAGING_DIR', os.path.join(tempfile.gettempdir(), 'propves-photo-staging'))
+    INGEST_WORKERS = int(os.environ.get('INGEST_WORKERS', 2))  # Statement uploads parsed, classified and journalled at once
+
+    # In-process search indexes (see search_index.py)
+    SEARCH_INDEX_MAX_AGE = int(os.environ.get('SEARCH_INDEX_MAX_AGE', 3600))  # Seconds before a full rebuild
+    SEARCH_CHANGE_TIMEOUT = int(os.environ.get('SEARCH_CHANGE_TIMEOUT', 3600))  # How long other workers can replay a change
+    SEARCH_INDEX_UNSHARED_MAX_AGE = int(os.environ.get('SEARCH_INDEX_UNSHARED_MAX_AGE', 60))  # Rebuild interval without a shared change log
+
+    # Line-item classification cache and keyword rules (see classifier.py, account_rules.py)
+    CLASSIFICATION_CACHE_SIZE = int(os.environ.get('CLASSIFICATION_CACHE_SIZE', 4096))
+    CLASSIFICATION_CACHE_TTL = int(os.environ.get('CLASSIFICATION_CACHE_TTL', 300))  # Seconds before re-reading the table
+    CLASSIFICATION_HIT_FLUSH = int(os.environ.get('CLASSIFICATION_HIT_FLUSH', 50))  # Buffered hits per write
+    CLASSIFICATION_RULE_CONFIDENCE = float(os.environ.get('CLASSIFICATION_RULE_CONFIDENCE', 0.75))  # Keyword matches below this go to the LLM
+
     # Azure OpenAI Configuration
     AZURE_API_KEY = os.environ.get("AZURE_API_KEY")
     AZURE_API_ENDPOINT = os.environ.get("AZURE_API_ENDPOINT")
     AZURE_DEPLOYMENT_NAME = os.environ.get("AZURE_DEPLOYMENT_NAME")
-    AZURE_MODEL_NAME = os.environ.get("AZURE_MODEL_NAME")
\ No newline at end of file
+    AZURE_MODEL_NAME = os.environ.get("AZURE_MODEL_NAME")
+    AZURE_BATCH_TOKEN_BUDGET = int(os.environ.get("AZURE_BATCH_TOKEN_BUDGET", 3000))  # Prompt + answer tokens per batch classification request
\ No newline at end of file
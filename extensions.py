@@ -2,9 +2,29 @@ from flask_sqlalchemy import SQLAlchemy
 from flask_mail import Mail
 from flask_login import LoginManager
 from flask_migrate import Migrate
+from flask_caching import Cache
 
 
 db = SQLAlchemy()
 mail = Mail()
 login_manager = LoginManager()
-migrate = Migrate()
\ No newline at end of file
+migrate = Migrate()
+cache = Cache()
+
+
+# Flask-Caching backends whose entries every worker process sees
+SHARED_CACHE_TYPES = frozenset((
+    'RedisCache', 'RedisSentinelCache', 'RedisClusterCache', 'MemcachedCache', 'SASLMemcachedCache'
+))
+
+def cache_is_shared(config):
+    """Whether the configured cache is shared between processes rather than per process."""
+    return config.get('CACHE_TYPE', 'SimpleCache').rsplit('.', 1)[-1] in SHARED_CACHE_TYPES
+
+def workers_share_cache(config):
+    """
+    Whether every worker sees what this one caches: true for a shared cache
+    or a single worker. gunicorn.conf.py turns it off for several workers
+    over a per-process cache.
+    """
+    return config.get('WORKERS_SHARE_CACHE', True)
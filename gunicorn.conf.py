@@ -43,3 +43,27 @@ secure_scheme_headers = {
     'X-FORWARDED-PROTO': 'https',
     'X-FORWARDED-SSL': 'on'
 }
+
+# Hooks
+def on_starting(server):
+    """
+    Several workers over a per-process cache cannot see each other's ledger
+    versions, job records or search change logs. Rather than fail to boot,
+    the app is told so (WORKERS_SHARE_CACHE) and turns those features down;
+    set CACHE_REDIS_URL to get them back.
+    """
+    if server.cfg.workers > 1:
+        from extensions import cache_is_shared
+        config = server.app.wsgi().config  # Loaded here, so the workers inherit the setting
+        if not cache_is_shared(config):
+            config['WORKERS_SHARE_CACHE'] = False
+            server.log.warning(
+                f"{server.cfg.workers} workers over a per-process cache ({config.get('CACHE_TYPE')}): "
+                "statement caching and background job polling are off, and search indexes "
+                "rebuild every SEARCH_INDEX_UNSHARED_MAX_AGE seconds. Set CACHE_REDIS_URL to enable them."
+            )
+
+def post_worker_init(worker):
+    """Builds the in-memory search indexes in the background as each worker starts."""
+    from search_index import warm_indexes
+    warm_indexes(worker.wsgi)
@@ -0,0 +1,232 @@
+# http_client.py
+"""
+Shared outbound HTTP for third-party integrations.
+
+Each named service gets one requests.Session per process, with its own
+connection pool. Repeat calls reuse kept-alive TCP and TLS connections
+instead of handshaking every time. The services are Azure OpenAI, Paystack
+and API Ninjas.
+
+- Every call has a (connect, read) timeout.
+- Connection errors and 429/5xx answers are retried with exponential
+  backoff. Read and status retries apply only to idempotent methods,
+  unless the service allows retrying POST.
+- A circuit breaker per service fails fast while the service is down, so
+  workers do not pile up waiting on it.
+
+fan_out() sends many requests to one service concurrently. It uses httpx
+on an asyncio loop, for example to classify line items one by one.
+
+Failures are raised as requests exceptions, so callers keep their
+existing except clauses. CircuitOpenError is a ConnectionError. As in
+jobs.py, sessions and breakers are created lazily in each worker process,
+never in the gunicorn master.
+"""
+import asyncio
+import os
+import threading
+import time
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+IDEMPOTENT_METHODS = frozenset(Retry.DEFAULT_ALLOWED_METHODS)
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised without calling a service whose circuit is open."""
+
+
+class Service:
+    """Connection, retry and circuit settings for one outbound integration."""
+
+    def __init__(self, name, timeout=(3.05, 15), retries=2, backoff=0.5, retry_post=False,
+                 pool_size=10, failure_threshold=5, reset_after=30):
+        self.name = name
+        self.timeout = timeout  # (connect, read) seconds
+        self.retries = retries
+        self.backoff = backoff
+        self.retry_post = retry_post
+        self.pool_size = pool_size
+        self.failure_threshold = failure_threshold  # Consecutive failures that open the circuit
+        self.reset_after = reset_after  # Seconds before a trial request is let through
+
+    def retries_method(self, method):
+        return method.upper() in IDEMPOTENT_METHODS or (self.retry_post and method.upper() == 'POST')
+
+    def retry(self):
+        methods = IDEMPOTENT_METHODS | {'POST'} if self.retry_post else IDEMPOTENT_METHODS
+        return Retry(
+            total=self.retries,
+            connect=self.retries,
+            read=self.retries,
+            status=self.retries,
+            backoff_factor=self.backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=methods,
+            raise_on_status=False,  # Hand the last answer back to the caller
+            respect_retry_after_header=True
+        )
+
+
+SERVICES = {
+    # Completions can take a while to generate; a classification retried is harmless
+    'azure_openai': Service('azure_openai', timeout=(3.05, 60), retry_post=True),
+    # Initialising a payment twice could charge twice, so POSTs are not retried
+    'paystack': Service('paystack', timeout=(3.05, 20)),
+    'api_ninjas': Service('api_ninjas', timeout=(3.05, 10)),
+}
+
+
+class CircuitBreaker:
+    """
+    Opens after failure_threshold consecutive failures and rejects calls for
+    reset_after seconds. Then it lets a single trial call through, which
+    either closes it again or re-opens it.
+    """
+
+    def __init__(self, failure_threshold, reset_after):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at = None
+        self._trial = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._trial or time.monotonic() - self._opened_at < self.reset_after:
+                return False
+            self._trial = True
+            return True
+
+    def record(self, ok):
+        with self._lock:
+            self._trial = False
+            if ok:
+                self._failures = 0
+                self._opened_at = None
+                return
+            self._failures += 1
+            if self._failures >= self.failure_threshold or self._opened_at is not None:
+                self._opened_at = time.monotonic()
+
+
+_sessions = {}
+_breakers = {}
+_lock = threading.Lock()
+
+
+def get_session(name):
+    """The pooled, retrying session for a service in this process."""
+    key = (os.getpid(), name)
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            service = SERVICES[name]
+            adapter = HTTPAdapter(
+                pool_connections=service.pool_size,
+                pool_maxsize=service.pool_size,
+                max_retries=service.retry()
+            )
+            session = requests.Session()
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[key] = session
+        return session
+
+def _breaker(name):
+    key = (os.getpid(), name)
+    with _lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            service = SERVICES[name]
+            breaker = CircuitBreaker(service.failure_threshold, service.reset_after)
+            _breakers[key] = breaker
+        return breaker
+
+def _reject(service):
+    return CircuitOpenError(f"{service.name} is failing; calls are paused for up to {service.reset_after}s")
+
+def request(name, method, url, **kwargs):
+    """
+    Sends one request to a service and returns the requests.Response;
+    callers still check raise_for_status(). Connection failures, timeouts
+    and 5xx answers left after the retries count against the circuit.
+    """
+    service = SERVICES[name]
+    breaker = _breaker(name)
+    if not breaker.allow():
+        raise _reject(service)
+
+    kwargs.setdefault('timeout', service.timeout)
+    ok = False
+    try:
+        response = get_session(name).request(method, url, **kwargs)
+        ok = response.status_code < 500
+        return response
+    finally:
+        breaker.record(ok)
+
+def get(name, url, **kwargs):
+    return request(name, 'GET', url, **kwargs)
+
+def post(name, url, **kwargs):
+    return request(name, 'POST', url, **kwargs)
+
+
+# --- Concurrent fan-out ---
+
+async def _send(client, service, breaker, call):
+    call = dict(call)
+    method = call.pop('method', 'GET')
+    url = call.pop('url')
+    attempts = service.retries + 1 if service.retries_method(method) else 1
+
+    if not breaker.allow():
+        raise _reject(service)
+    ok = False
+    try:
+        for attempt in range(attempts):
+            last = attempt + 1 == attempts
+            try:
+                response = await client.request(method, url, **call)
+            except httpx.TimeoutException as e:
+                if last:
+                    raise requests.exceptions.Timeout(str(e)) from e
+            except httpx.TransportError as e:
+                if last:
+                    raise requests.exceptions.ConnectionError(str(e)) from e
+            else:
+                if last or response.status_code not in RETRY_STATUSES:
+                    ok = response.status_code < 500
+                    return response
+            await asyncio.sleep(service.backoff * 2 ** attempt)
+    finally:
+        breaker.record(ok)
+
+def fan_out(name, calls, concurrency=8):
+    """
+    Sends calls (dicts of method, url and httpx request arguments such as
+    headers, params or json) to one service concurrently, at most
+    `concurrency` at a time. Returns, in order, an httpx.Response or the
+    exception each call ended with.
+    """
+    service = SERVICES[name]
+    breaker = _breaker(name)
+
+    async def run():
+        limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+        timeout = httpx.Timeout(service.timeout[1], connect=service.timeout[0])
+        semaphore = asyncio.Semaphore(concurrency)
+        async with httpx.AsyncClient(limits=limits, timeout=timeout) as client:
+            async def bounded(call):
+                async with semaphore:
+                    return await _send(client, service, breaker, call)
+            return await asyncio.gather(*(bounded(call) for call in calls), return_exceptions=True)
+
+    return asyncio.run(run())
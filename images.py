@@ -0,0 +1,227 @@
+# images.py
+"""
+Property photo processing.
+
+Uploads are decoded once with Pillow, rotated per their EXIF orientation and
+re-encoded into thumb/card/full variants in WebP and JPEG. Metadata (EXIF,
+GPS) is not carried over. Templates choose a size through photo_url() and
+photo_srcset() instead of serving the original upload.
+
+Files are stored under the SHA-256 of the uploaded bytes, so repeated uploads
+and duplicated properties share one copy. Photo rows carrying the same
+content_hash are its references; property_photos.py removes the files once
+the last of them is deleted. Both sides hold blob_lock() for the hash while
+they decide, so a new reference always commits before or after a removal,
+never in between.
+
+Upload routes only write the raw bytes to PHOTO_STAGING_DIR and queue an
+ingestion job on the 'photos' pool (see jobs.py), which processes the file
+and creates the Photo row, so bulk uploads do not hold a request worker.
+"""
+import fcntl
+import hashlib
+import os
+import secrets
+from contextlib import contextmanager
+from flask import current_app, url_for
+from flask_login import current_user
+from PIL import Image, ImageOps
+from extensions import db
+from jobs import submit_job
+from models import Photo
+
+# Longest edge in pixels for each variant
+VARIANTS = {
+    'thumb': 320,
+    'card': 800,
+    'full': 1920,
+}
+FORMATS = {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+}
+PHOTO_FOLDER = 'uploads/property_photos'
+BLOB_FOLDER = f'{PHOTO_FOLDER}/blobs'  # Files named by the SHA-256 of the uploaded bytes
+
+
+def _prepare(source):
+    image = Image.open(source)
+    image = ImageOps.exif_transpose(image)  # Apply orientation before the EXIF is dropped
+    if image.mode not in ('RGB', 'L'):
+        # Flatten transparency onto white for JPEG
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        rgba = image.convert('RGBA')
+        background.paste(rgba, mask=rgba.split()[-1])
+        image = background
+    return image.convert('RGB')
+
+def process_image(source, static_folder, folder, basename):
+    """
+    Writes every variant of the image in source (a path or file object)
+    under static_folder/folder and returns their static-relative paths:
+
+        {'thumb': {'webp': ..., 'jpeg': ..., 'width': ..., 'height': ...}, ...}
+    """
+    image = _prepare(source)
+    target = os.path.join(static_folder, folder)
+    os.makedirs(target, exist_ok=True)
+
+    variants = {}
+    for name, longest_edge in VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((longest_edge, longest_edge), Image.LANCZOS)
+        variant = {'width': resized.width, 'height': resized.height}
+        for extension, options in FORMATS.items():
+            filename = f'{basename}_{name}.{extension}'
+            # Write beside the target and rename, so a concurrent ingest of the same blob never sees a partial file
+            temp_path = os.path.join(target, f'.{secrets.token_hex(8)}.part')
+            resized.save(temp_path, **options)
+            os.replace(temp_path, os.path.join(target, filename))
+            variant[extension] = f'{folder}/{filename}'
+        variants[name] = variant
+    return variants
+
+def file_hash(path):
+    """SHA-256 of a file's bytes, as hex."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def variant_paths(photo):
+    """Every file a photo occupies, relative to the static folder."""
+    paths = [
+        variant[extension]
+        for variant in (photo.variants or {}).values()
+        for extension in FORMATS
+        if variant.get(extension)
+    ]
+    if photo.file_path and photo.file_path not in paths:
+        paths.append(photo.file_path)  # Photos uploaded before variants existed
+    return paths
+
+@contextmanager
+def blob_lock(content_hash):
+    """
+    Exclusive lock on a content hash across this host's worker processes.
+    Hashes share 256 lock files by their first two hex digits.
+    """
+    lock_dir = os.path.join(current_app.config['PHOTO_STAGING_DIR'], 'locks')
+    os.makedirs(lock_dir, exist_ok=True)
+    with open(os.path.join(lock_dir, f'{content_hash[:2]}.lock'), 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)  # Released when the file closes
+        yield
+
+def store_photo(path, static_folder, digest=None):
+    """
+    Stores the image at path by content and returns (content_hash,
+    file_path, variants), where file_path is the full-size JPEG used by
+    existing image links. Bytes already stored for another Photo are linked
+    rather than processed and written again. Call it under blob_lock(), held
+    until the new Photo row commits.
+    """
+    digest = digest or file_hash(path)
+    existing = Photo.query.filter(Photo.content_hash == digest, Photo.variants.isnot(None)).first()
+    if existing and all(os.path.exists(os.path.join(static_folder, p)) for p in variant_paths(existing)):
+        return digest, existing.file_path, existing.variants
+
+    variants = process_image(path, static_folder, f'{BLOB_FOLDER}/{digest[:2]}', digest)
+    return digest, variants['full']['jpeg'], variants
+
+def link_photo(photo, static_folder):
+    """
+    Column values for a new Photo sharing photo's stored files. Photos saved
+    before content hashing get their hash filled in, so both rows count as
+    references to the same files.
+    """
+    path = os.path.join(static_folder, photo.file_path)
+    if photo.content_hash is None and os.path.exists(path):
+        photo.content_hash = file_hash(path)
+    return {'content_hash': photo.content_hash, 'file_path': photo.file_path, 'variants': photo.variants}
+
+def remove_files(paths, static_folder):
+    """Deletes the given static-relative files and any folder they leave empty."""
+    for path in paths:
+        full_path = os.path.join(static_folder, path)
+        try:
+            os.remove(full_path)
+        except FileNotFoundError:
+            pass
+        try:
+            os.rmdir(os.path.dirname(full_path))
+        except OSError:
+            pass  # Not empty
+
+
+# --- Ingestion ---
+
+def stage_upload(upload):
+    """Writes an upload's raw bytes to the staging directory and returns the path."""
+    staging_dir = current_app.config['PHOTO_STAGING_DIR']
+    os.makedirs(staging_dir, exist_ok=True)
+    path = os.path.join(staging_dir, f'{secrets.token_hex(16)}.upload')
+    upload.save(path)
+    return path
+
+def ingest_staged_photo(staged_path, property_id, filename, is_thumbnail, order, static_folder):
+    """Job body: turns a staged upload into variants and a Photo row."""
+    try:
+        digest = file_hash(staged_path)
+        # Held until the row commits, so the last other reference cannot remove the files meanwhile
+        with blob_lock(digest):
+            digest, file_path, variants = store_photo(staged_path, static_folder, digest)
+            photo = Photo(
+                property_id=property_id,
+                content_hash=digest,
+                file_path=file_path,
+                filename=filename,
+                is_thumbnail=is_thumbnail,
+                order=order,
+                variants=variants
+            )
+            db.session.add(photo)
+            db.session.commit()
+
+            # The lock only covers this host, so files that went missing regardless are written again
+            if not all(os.path.exists(os.path.join(static_folder, p)) for p in variant_paths(photo)):
+                process_image(staged_path, static_folder, f'{BLOB_FOLDER}/{digest[:2]}', digest)
+        return {'photo_id': photo.id, 'property_id': property_id}
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        try:
+            os.remove(staged_path)
+        except FileNotFoundError:
+            pass
+
+def submit_photo(upload, property_id, filename, is_thumbnail=False, order=0):
+    """Stages an upload and queues its ingestion; returns the job id."""
+    staged_path = stage_upload(upload)
+    return submit_job(
+        'photos', ingest_staged_photo,
+        staged_path, property_id, filename, is_thumbnail, order, current_app.static_folder,
+        max_workers=current_app.config.get('PHOTO_INGEST_WORKERS', 2),
+        user_id=current_user.get_id(),
+        meta={'property_id': property_id, 'filename': filename}
+    )
+
+
+# --- Template helpers ---
+
+def photo_url(photo, size='card', extension='jpeg'):
+    """URL of one variant, falling back to the stored file for unprocessed photos."""
+    variant = (photo.variants or {}).get(size)
+    path = variant.get(extension) if variant else None
+    return url_for('static', filename=path or photo.file_path)
+
+def photo_srcset(photo, extension='webp'):
+    """srcset listing every variant of a photo with its width, or '' for unprocessed photos."""
+    if not photo.variants:
+        return ''
+    return ', '.join(
+        f"{url_for('static', filename=variant[extension])} {variant['width']}w"
+        for variant in sorted(photo.variants.values(), key=lambda variant: variant['width'])
+        if variant.get(extension)
+    )
@@ -0,0 +1,109 @@
+# jobs.py
+"""
+Background jobs run on small per-process thread pools.
+
+Job status and results are kept in extensions.cache, so a job submitted by
+one gunicorn worker can be polled and downloaded through any other. That
+holds only for a shared cache such as RedisCache; with several workers over
+the per-process SimpleCache, extensions.workers_share_cache() is false and
+routes finish the work before responding instead of handing out ids to
+poll. Pools are created lazily in each worker process, never in the
+gunicorn master (preload_app=True forks after import).
+"""
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from flask import current_app
+from extensions import cache
+
+_executors = {}
+_futures = {}
+_lock = threading.Lock()
+_local = threading.local()  # The job running on this thread, for report_progress
+
+
+def get_executor(name, max_workers):
+    """The named thread pool for this process, created on first use."""
+    key = (os.getpid(), name)
+    with _lock:
+        executor = _executors.get(key)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f'{name}-job')
+            _executors[key] = executor
+        return executor
+
+def _job_key(job_id):
+    return f'job:{job_id}'
+
+def _store(job_id, record):
+    timeout = current_app.config.get('JOB_RESULT_TIMEOUT', 600)
+    cache.set(_job_key(job_id), record, timeout=timeout)
+
+def submit_job(pool, func, *args, max_workers=2, user_id=None, meta=None, **kwargs):
+    """
+    Runs func(*args, **kwargs) on the named pool inside an application
+    context and returns the new job's id.
+    """
+    app = current_app._get_current_object()
+    job_id = uuid.uuid4().hex
+    record = {'id': job_id, 'pool': pool, 'status': 'pending', 'user_id': user_id, 'meta': meta or {}}
+    _store(job_id, record)
+
+    def run():
+        with app.app_context():
+            running = dict(record, status='running')
+            _store(job_id, running)
+            _local.job = (job_id, running)
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                app.logger.error(f"Job {job_id} on {pool} failed: {str(e)}")
+                _store(job_id, dict(running, status='failed', error=str(e)))
+                raise
+            finally:
+                _local.job = None
+            _store(job_id, dict(running, status='done', result=result))
+            return result
+
+    future = get_executor(pool, max_workers).submit(run)
+    with _lock:
+        _futures[job_id] = future
+    future.add_done_callback(lambda _: _forget(job_id))
+    return job_id
+
+def report_progress(**progress):
+    """
+    Called from inside a running job: merges progress fields (such as the
+    current stage) into its record, where status endpoints can poll them.
+    Does nothing outside a job.
+    """
+    job = getattr(_local, 'job', None)
+    if job is None:
+        return
+    job_id, record = job
+    record['progress'] = dict(record.get('progress') or {}, **progress)
+    _store(job_id, record)
+
+def _forget(job_id):
+    with _lock:
+        _futures.pop(job_id, None)
+
+def get_job(job_id):
+    """The job's record (status, meta, progress and result when done), or None once expired."""
+    return cache.get(_job_key(job_id))
+
+def wait_for_job(job_id, timeout):
+    """
+    Waits up to timeout seconds for a job submitted by this process and
+    returns its record. Jobs running elsewhere are returned as they stand.
+    """
+    with _lock:
+        future = _futures.get(job_id)
+    if future is not None:
+        try:
+            future.result(timeout=timeout)
+        except Exception:
+            # Timeouts leave the job running; failures are in its record
+            pass
+    return get_job(job_id)
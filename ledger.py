@@ -0,0 +1,507 @@
+# ledger.py
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from uuid import uuid4
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import and_, case, event, extract, func, inspect, insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from extensions import cache, db
+from models import LedgerRollup, Property, Transaction
+
+# Columns that make up a ledger_rollup row, in Transaction attribute terms
+ROLLUP_KEY = ('owner_id', 'property_id', 'account', 'main_category', 'sub_category', 'year', 'month', 'is_reconciled')
+TRACKED_ATTRIBUTES = ('owner_id', 'property_id', 'account', 'main_category', 'sub_category',
+                      'transaction_date', 'is_reconciled', 'amount')
+
+
+class AccountTotals:
+    """
+    Summed transaction amounts for one owner and period, grouped by
+    (account, sub_category, main_category) in a single database query.
+
+    Reports derive every line from this small aggregate instead of walking
+    the full list of transactions once per account.
+    """
+
+    def __init__(self, rows):
+        self.rows = []
+        self._accounts = defaultdict(Decimal)
+        self._sub_categories = defaultdict(Decimal)
+        self._main_categories = defaultdict(Decimal)
+        self._categories = defaultdict(Decimal)
+
+        for account, sub_category, main_category, total in rows:
+            total = Decimal(str(total or 0))
+            self.rows.append((account, sub_category, main_category, total))
+            self._accounts[account] += total
+            self._sub_categories[sub_category] += total
+            self._main_categories[main_category] += total
+            self._categories[(main_category, sub_category)] += total
+
+    def account(self, name):
+        """Total for a single account"""
+        return self._accounts.get(name, Decimal('0'))
+
+    def accounts(self, names):
+        """Total across several accounts"""
+        return sum((self.account(name) for name in names), Decimal('0'))
+
+    def sub_category(self, name):
+        """Total for every account in a sub-category"""
+        return self._sub_categories.get(name, Decimal('0'))
+
+    def main_category(self, name):
+        """Total for every account in a main category"""
+        return self._main_categories.get(name, Decimal('0'))
+
+    def sub_categories_of(self, main_category):
+        """Sub-category totals within a main category, e.g. expense lines"""
+        return {
+            sub_category: total
+            for (main, sub_category), total in self._categories.items()
+            if main == main_category
+        }
+
+
+def account_totals(owner_id, start_date, end_date, reconciled_only=True):
+    """
+    Aggregates an owner's transactions in [start_date, end_date) per account.
+    """
+    totals = ledger_totals(
+        owner_id, start_date, end_date,
+        group_by=('account', 'sub_category', 'main_category'),
+        reconciled_only=reconciled_only
+    )
+    return AccountTotals(key + (total,) for key, total in totals.items())
+
+
+# --- Period queries ---
+
+def period_start(value):
+    """First transaction date included by a `transaction_date >= value` filter."""
+    if isinstance(value, datetime):
+        return value.date() + timedelta(days=1) if value.time() != time(0) else value.date()
+    return value
+
+def period_end(value, inclusive=False):
+    """
+    First transaction date excluded by a `transaction_date < value` filter,
+    or by `transaction_date <= value` when inclusive is set.
+    """
+    if isinstance(value, datetime):
+        if inclusive or value.time() != time(0):
+            return value.date() + timedelta(days=1)
+        return value.date()
+    return value + timedelta(days=1) if inclusive else value
+
+def _month_index(value):
+    return value.year * 12 + value.month - 1
+
+def _next_month(value):
+    return date(value.year + 1, 1, 1) if value.month == 12 else date(value.year, value.month + 1, 1)
+
+def _apply_filters(query, model, filters):
+    for name, value in filters.items():
+        column = getattr(model, name)
+        if isinstance(value, (list, tuple, set)):
+            query = query.filter(column.in_(list(value)))
+        else:
+            query = query.filter(column == value)
+    return query
+
+def _transaction_column(name):
+    if name in ('year', 'month'):
+        return extract(name, Transaction.transaction_date)
+    return getattr(Transaction, name)
+
+def _normalise_key(group_by, row):
+    return tuple(
+        int(value) if name in ('year', 'month') and value is not None else value
+        for name, value in zip(group_by, row)
+    )
+
+def ledger_totals(owner_id, start_date, end_date, group_by=(), reconciled_only=True, **filters):
+    """
+    Summed amounts of an owner's transactions dated in [start_date, end_date),
+    grouped by any of the ROLLUP_KEY columns.
+
+    Whole calendar months are read from ledger_rollup; only the partial months
+    at either end of the range touch the transaction table, so the cost no
+    longer grows with the number of transactions. Keyword filters match a
+    column to a value, or to any of a list of values.
+
+    Returns a dict keyed by a tuple of the group_by values.
+    """
+    start_date = period_start(start_date)
+    end_date = period_end(end_date)
+    totals = defaultdict(Decimal)
+    if start_date >= end_date:
+        return totals
+
+    if reconciled_only:
+        filters = dict(filters, is_reconciled=True)
+
+    first_full_month = start_date if start_date.day == 1 else _next_month(start_date)
+    end_month = end_date.replace(day=1)
+
+    raw_ranges = []
+    if first_full_month < end_month:
+        # Whole months come from the rollup
+        month_index = LedgerRollup.year * 12 + LedgerRollup.month - 1
+        query = db.session.query(
+            *[getattr(LedgerRollup, name) for name in group_by],
+            func.sum(LedgerRollup.amount)
+        ).filter(
+            LedgerRollup.owner_id == owner_id,
+            LedgerRollup.transaction_count > 0,
+            month_index >= _month_index(first_full_month),
+            month_index < _month_index(end_month)
+        )
+        query = _apply_filters(query, LedgerRollup, filters)
+        if group_by:
+            query = query.group_by(*[getattr(LedgerRollup, name) for name in group_by])
+        for row in query.all():
+            if row[-1] is not None:
+                totals[_normalise_key(group_by, row[:-1])] += Decimal(str(row[-1]))
+
+        if start_date < first_full_month:
+            raw_ranges.append((start_date, first_full_month))
+        if end_month < end_date:
+            raw_ranges.append((end_month, end_date))
+    else:
+        raw_ranges.append((start_date, end_date))
+
+    # Partial months come straight from the transaction table
+    for range_start, range_end in raw_ranges:
+        columns = [_transaction_column(name) for name in group_by]
+        query = db.session.query(
+            *columns,
+            func.sum(Transaction.amount)
+        ).filter(
+            Transaction.owner_id == owner_id,
+            Transaction.transaction_date >= range_start,
+            Transaction.transaction_date < range_end
+        )
+        query = _apply_filters(query, Transaction, filters)
+        if group_by:
+            query = query.group_by(*columns)
+        for row in query.all():
+            if row[-1] is not None:
+                totals[_normalise_key(group_by, row[:-1])] += Decimal(str(row[-1]))
+
+    return totals
+
+def ledger_total(owner_id, start_date, end_date, reconciled_only=True, **filters):
+    """Single summed amount for an owner's transactions in [start_date, end_date)."""
+    totals = ledger_totals(owner_id, start_date, end_date, reconciled_only=reconciled_only, **filters)
+    return totals.get((), Decimal('0'))
+
+def ledger_count(start_date=None, end_date=None, **filters):
+    """
+    Approximate number of transactions dated in [start_date, end_date) and
+    matching the keyword filters (owner_id, property_id, account, ...),
+    summed from ledger_rollup without touching the transaction table.
+    Months at either end are counted whole, so a range that starts or ends
+    mid-month can over-count; use it for "about N" totals only.
+    """
+    query = db.session.query(func.sum(LedgerRollup.transaction_count))
+    month_index = LedgerRollup.year * 12 + LedgerRollup.month - 1
+    if start_date is not None:
+        query = query.filter(month_index >= _month_index(period_start(start_date)))
+    if end_date is not None:
+        query = query.filter(month_index <= _month_index(period_end(end_date) - timedelta(days=1)))
+    query = _apply_filters(query, LedgerRollup, filters)
+    return int(query.scalar() or 0)
+
+
+def account_balances(owner_id, accounts, dates, reconciled_only=True):
+    """
+    Balances of several accounts as at several dates, each balance being the
+    sum of the account's transactions dated before that date.
+
+    Every (account, date) pair is a conditional sum over the same grouped
+    query: whole months are summed from ledger_rollup and the days before a
+    mid-month date from the transaction table, so the work is two queries no
+    matter how many accounts or dates are requested.
+
+    Returns {account: {date: balance}} using the dates as passed in.
+    """
+    accounts = list(accounts)
+    dates = list(dates)
+    balances = {account: {as_at: Decimal('0') for as_at in dates} for account in accounts}
+    if not accounts or not dates:
+        return balances
+
+    bounds = [period_end(as_at) for as_at in dates]
+    filters = {'account': accounts}
+    if reconciled_only:
+        filters['is_reconciled'] = True
+
+    # Whole months before each date come from the rollup
+    month_index = LedgerRollup.year * 12 + LedgerRollup.month - 1
+    month_bounds = [_month_index(bound) for bound in bounds]
+    query = db.session.query(
+        LedgerRollup.account,
+        *[func.sum(case((month_index < bound, LedgerRollup.amount), else_=0)) for bound in month_bounds]
+    ).filter(
+        LedgerRollup.owner_id == owner_id,
+        LedgerRollup.transaction_count > 0,
+        month_index < max(month_bounds)
+    )
+    query = _apply_filters(query, LedgerRollup, filters).group_by(LedgerRollup.account)
+    for account, *sums in query.all():
+        for as_at, total in zip(dates, sums):
+            balances[account][as_at] += Decimal(str(total or 0))
+
+    # Days between the start of the month and a mid-month date come from transactions
+    partial = [(as_at, bound.replace(day=1), bound) for as_at, bound in zip(dates, bounds) if bound.day != 1]
+    if partial:
+        query = db.session.query(
+            Transaction.account,
+            *[
+                func.sum(case(
+                    (and_(Transaction.transaction_date >= month_start, Transaction.transaction_date < bound), Transaction.amount),
+                    else_=0
+                ))
+                for _, month_start, bound in partial
+            ]
+        ).filter(
+            Transaction.owner_id == owner_id,
+            Transaction.transaction_date >= min(month_start for _, month_start, _ in partial),
+            Transaction.transaction_date < max(bound for _, _, bound in partial)
+        )
+        query = _apply_filters(query, Transaction, filters).group_by(Transaction.account)
+        for account, *sums in query.all():
+            for (as_at, _, _), total in zip(partial, sums):
+                balances[account][as_at] += Decimal(str(total or 0))
+
+    return balances
+
+
+# --- Rollup maintenance ---
+
+def _attribute_value(state, name, committed):
+    """Current attribute value, or the value as last flushed when committed is set."""
+    if committed:
+        history = state.attrs[name].load_history()
+        if history.deleted:
+            return history.deleted[0]
+        if history.unchanged:
+            return history.unchanged[0]
+        return None
+    return getattr(state.obj(), name)
+
+def _rollup_key(state, committed=False):
+    values = {name: _attribute_value(state, name, committed) for name in TRACKED_ATTRIBUTES}
+    transaction_date = values['transaction_date']
+    if transaction_date is None or values['account'] is None or values['main_category'] is None:
+        return None, None
+
+    key = (
+        values['owner_id'],
+        values['property_id'],
+        values['account'],
+        values['main_category'],
+        values['sub_category'],
+        transaction_date.year,
+        transaction_date.month,
+        bool(values['is_reconciled'])
+    )
+    return key, Decimal(str(values['amount'] or 0))
+
+def _collect_rollup_deltas(session):
+    deltas = defaultdict(lambda: [Decimal('0'), 0])
+
+    def add(key, amount, count):
+        if key is not None:
+            deltas[key][0] += amount
+            deltas[key][1] += count
+
+    for obj in session.new:
+        if isinstance(obj, Transaction):
+            key, amount = _rollup_key(inspect(obj))
+            add(key, amount, 1)
+
+    for obj in session.deleted:
+        if isinstance(obj, Transaction):
+            key, amount = _rollup_key(inspect(obj), committed=True)
+            add(key, -amount, -1)
+
+    for obj in session.dirty:
+        if not isinstance(obj, Transaction):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[name].history.has_changes() for name in TRACKED_ATTRIBUTES):
+            continue
+        old_key, old_amount = _rollup_key(state, committed=True)
+        new_key, new_amount = _rollup_key(state)
+        add(old_key, -old_amount, -1)
+        add(new_key, new_amount, 1)
+
+    return {key: delta for key, delta in deltas.items() if delta[0] or delta[1]}
+
+def _rate_change_owner_ids(session):
+    """
+    Owners whose statements move with a pending Property change: the income
+    statement taxes each property's revenue at its rental_income_tax_rate.
+    """
+    owner_ids = set()
+    for obj in session.deleted:
+        if isinstance(obj, Property) and obj.rental_income_tax_rate is not None:
+            owner_ids.add(obj.owner_id)
+    for obj in session.dirty:
+        if not isinstance(obj, Property):
+            continue
+        state = inspect(obj)
+        if not any(state.attrs[name].history.has_changes() for name in ('rental_income_tax_rate', 'owner_id')):
+            continue
+        owner_history = state.attrs.owner_id.history
+        owner_ids.update(owner_history.deleted or ())
+        owner_ids.update(owner_history.unchanged or ())
+        owner_ids.update(owner_history.added or ())
+    owner_ids.discard(None)
+    return owner_ids
+
+def _key_order(key):
+    # Rows are touched in one order by every writer, so two commits cannot deadlock on them
+    return tuple((value is None, value) for value in key)
+
+def apply_rollup_deltas(connection, deltas):
+    """
+    Adds amount/count deltas to ledger_rollup rows, creating missing rows.
+
+    On MSSQL the UPDATE holds UPDLOCK and SERIALIZABLE range locks until the
+    transaction ends, so two writers cannot both find a row missing and both
+    insert it. Elsewhere, losing that race raises IntegrityError on the
+    unique key, and the UPDATE is simply retried against the winner's row.
+    """
+    table = LedgerRollup.__table__
+    for key in sorted(deltas, key=_key_order):
+        amount, count = deltas[key]
+        match = [table.c[name] == value for name, value in zip(ROLLUP_KEY, key)]
+        update = table.update().where(*match).values(
+            amount=table.c.amount + amount,
+            transaction_count=table.c.transaction_count + count
+        ).with_hint('WITH (UPDLOCK, SERIALIZABLE)', dialect_name='mssql')
+
+        if connection.execute(update).rowcount:
+            continue
+        try:
+            with connection.begin_nested():
+                connection.execute(
+                    table.insert().values(**dict(zip(ROLLUP_KEY, key)), amount=amount, transaction_count=count)
+                )
+        except IntegrityError:
+            connection.execute(update)
+
+# --- Ledger versions ---
+
+def _version_key(owner_id):
+    return f'ledger-version:{owner_id}'
+
+def _version(owner_id):
+    version = cache.get(_version_key(owner_id))
+    if version is None:
+        # A missing (never set or evicted) version starts afresh, so entries
+        # cached under an earlier version can never match again
+        version = uuid4().hex
+        cache.set(_version_key(owner_id), version, timeout=0)
+    return version
+
+def ledger_version(owner_id):
+    """
+    Version of an owner's ledger, changed whenever their transactions are
+    written or a property's rental_income_tax_rate moves. Cached reports include it in their key, so any write makes the
+    owner's previous entries unreachable.
+    """
+    return f"{_version('all')}.{_version(owner_id)}"
+
+def bump_ledger_version(owner_ids=None):
+    """Moves the ledger version of the given owners, or of every owner when None."""
+    try:
+        for owner_id in (['all'] if owner_ids is None else owner_ids):
+            cache.set(_version_key(owner_id), uuid4().hex, timeout=0)
+    except Exception as e:
+        current_app.logger.warning(f"Could not bump ledger version: {str(e)}")
+
+@event.listens_for(Session, 'before_flush')
+def collect_ledger_rollup_deltas(session, flush_context, instances):
+    """Records how pending Transaction changes move ledger_rollup totals, and which owners' tax rates change."""
+    # Collected before the flush, while previous values can still be loaded
+    session.info['ledger_rollup_deltas'] = _collect_rollup_deltas(session)
+    session.info['ledger_rate_owner_ids'] = _rate_change_owner_ids(session)
+
+@event.listens_for(Session, 'after_flush')
+def update_ledger_rollup(session, flush_context):
+    """Keeps ledger_rollup in step with Transaction inserts, updates and deletes, and bumps the owners' versions."""
+    deltas = session.info.pop('ledger_rollup_deltas', None)
+    owner_ids = session.info.pop('ledger_rate_owner_ids', None) or set()
+    if deltas:
+        apply_rollup_deltas(session.connection(), deltas)
+        owner_ids |= {key[0] for key in deltas}
+    if owner_ids:
+        session.info.setdefault('ledger_owner_ids', set()).update(owner_ids)
+        bump_ledger_version(owner_ids)
+
+@event.listens_for(Session, 'after_commit')
+@event.listens_for(Session, 'after_rollback')
+def bump_ledger_version_on_end(session):
+    """
+    Bumps the versions of owners written in this transaction again once it
+    ends, so reports cached between the flush and the commit (or computed
+    from rows a rollback discarded) are not served.
+    """
+    owner_ids = session.info.pop('ledger_owner_ids', None)
+    if owner_ids:
+        bump_ledger_version(owner_ids)
+
+def rebuild_ledger_rollup(owner_id=None):
+    """Recomputes ledger_rollup from the transaction table."""
+    delete = LedgerRollup.__table__.delete()
+    if owner_id is not None:
+        delete = delete.where(LedgerRollup.owner_id == owner_id)
+    db.session.execute(delete)
+
+    year = extract('year', Transaction.transaction_date)
+    month = extract('month', Transaction.transaction_date)
+    source = select(
+        Transaction.owner_id,
+        Transaction.property_id,
+        Transaction.account,
+        Transaction.main_category,
+        Transaction.sub_category,
+        year,
+        month,
+        func.coalesce(Transaction.is_reconciled, False),
+        func.sum(Transaction.amount),
+        func.count(Transaction.id)
+    ).group_by(
+        Transaction.owner_id,
+        Transaction.property_id,
+        Transaction.account,
+        Transaction.main_category,
+        Transaction.sub_category,
+        year,
+        month,
+        func.coalesce(Transaction.is_reconciled, False)
+    )
+    if owner_id is not None:
+        source = source.where(Transaction.owner_id == owner_id)
+
+    db.session.execute(
+        insert(LedgerRollup).from_select(list(ROLLUP_KEY) + ['amount', 'transaction_count'], source)
+    )
+    db.session.commit()
+    bump_ledger_version(None if owner_id is None else [owner_id])
+
+@click.command('rebuild-ledger-rollup')
+@click.option('--owner-id', type=int, default=None, help='Only rebuild rows for this owner.')
+@with_appcontext
+def rebuild_ledger_rollup_command(owner_id):
+    """Rebuild the per-owner, per-account, per-month ledger rollup."""
+    rebuild_ledger_rollup(owner_id)
+    click.echo('Ledger rollup rebuilt' + (f' for owner {owner_id}' if owner_id else ''))
@@ -218,6 +218,8 @@ class Photo(db.Model):
     is_thumbnail = db.Column(db.Boolean, default=False)
     order = db.Column(db.Integer, default=0)
     date_added = db.Column(db.DateTime, default=datetime.utcnow)
+    content_hash = db.Column(db.String(64), nullable=True, index=True)  # SHA-256 of the uploaded bytes; rows sharing it share files
+    variants = db.Column(JSONEncodedDict, nullable=True)  # Resized files per size/format, see images.py
     
     # Relationships
     property = db.relationship('Property', back_populates='photos')
@@ -425,7 +427,13 @@ class Transaction(db.Model):
     is_portfolio = db.Column(db.Boolean, default=False)
     is_property_tax = db.Column(db.Boolean, default=False)
 
-    owner = relationship('Owner', back_populates='transactions') 
+    owner = relationship('Owner', back_populates='transactions')
+
+    __table_args__ = (
+        # Keyset pagination seeks on (transaction_date, id) within an owner or property
+        db.Index('ix_transaction_owner_date', 'owner_id', 'transaction_date', 'id'),
+        db.Index('ix_transaction_property_date', 'property_id', 'transaction_date', 'id'),
+    )
 
     def to_dict(self):
         return {
@@ -450,6 +458,57 @@ class Transaction(db.Model):
             'is_portfolio': self.is_portfolio
         }
 
+class LedgerRollup(db.Model):
+    __tablename__ = 'ledger_rollup'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    # Rollup key (maintained from Transaction by ledger.py session events)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'), nullable=True)
+    property_id = db.Column(db.Integer, db.ForeignKey('property.id'), nullable=True)
+    account = db.Column(db.String(50), nullable=False)
+    main_category = db.Column(db.String(50), nullable=False)
+    sub_category = db.Column(db.String(50), nullable=True)
+    year = db.Column(db.Integer, nullable=False)
+    month = db.Column(db.Integer, nullable=False)
+    is_reconciled = db.Column(db.Boolean, nullable=False, default=False)
+
+    # Aggregates
+    amount = db.Column(db.Numeric(14, 2), nullable=False, default=0)
+    transaction_count = db.Column(db.Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        db.UniqueConstraint('owner_id', 'property_id', 'account', 'main_category', 'sub_category',
+                            'year', 'month', 'is_reconciled', name='uq_ledger_rollup_key'),
+        db.Index('ix_ledger_rollup_owner_period', 'owner_id', 'year', 'month'),
+    )
+
+    def __repr__(self):
+        return f'<LedgerRollup owner={self.owner_id} {self.account} {self.year}-{self.month:02d}: {self.amount}>'
+
+class ClassificationCache(db.Model):
+    __tablename__ = 'classification_cache'
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+
+    # Normalised line-item description (see classifier.normalize_description);
+    # owner_id is NULL for entries shared by every owner
+    description_key = db.Column(db.String(200), nullable=False)
+    owner_id = db.Column(db.Integer, db.ForeignKey('owner.id'), nullable=True)
+
+    account = db.Column(db.String(50), nullable=False)
+    source = db.Column(db.String(20), nullable=False, default='llm')  # llm or owner
+    hit_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    last_hit_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.UniqueConstraint('description_key', 'owner_id', name='uq_classification_cache_key'),
+    )
+
+    def __repr__(self):
+        return f'<ClassificationCache {self.description_key!r} -> {self.account} ({self.source})>'
+
 class Records(db.Model):
     __tablename__ = 'records'
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
@@ -636,6 +695,10 @@ class Property(db.Model):
     tax_exemptions = db.Column(db.String(255), nullable=True)  
     rental_income_tax_rate = db.Column(db.Float, nullable=True) 
 
+    # Photo summary, kept in step with the photo table (see property_photos.py)
+    thumbnail_photo_id = db.Column(db.Integer, nullable=True)
+    photo_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+
     
     # Relationships
     state = db.relationship('State', backref='properties')
@@ -647,6 +710,11 @@ class Property(db.Model):
                            back_populates='property',
                            cascade="all, delete-orphan")
     listings = db.relationship('Listing', back_populates='property')
+    thumbnail_photo = db.relationship('Photo',
+                           primaryjoin='foreign(Property.thumbnail_photo_id) == Photo.id',
+                           viewonly=True,
+                           uselist=False,
+                           lazy='joined')
     budget = db.relationship('Budget', 
                            back_populates='property',
                            uselist=False, 
@@ -659,13 +727,7 @@ class Property(db.Model):
     @property
     def thumbnail(self):
         """Get the thumbnail photo for this property"""
-        return (Photo.query.filter_by(property_id=self.id, is_thumbnail=True).first() 
-                or (self.photos[0] if self.photos else None))
-
-    @property
-    def photo_count(self):
-        """Get the number of photos for this property"""
-        return Photo.query.filter_by(property_id=self.id).count()
+        return self.thumbnail_photo
     
     def full_address(self):
         """Return the complete address of the property."""
@@ -698,21 +760,17 @@ class Property(db.Model):
         }
 
     @classmethod
-    def autocomplete_search(cls, query, limit=10):
+    def autocomplete_search(cls, query, limit=10, owner_id=None):
         """
         Search for properties by title, description, or address
-        Returns properties that match the search query
+        Returns the best matching properties, using the in-memory search index
         """
-        search = f"%{query}%"
-        return cls.query.filter(
-            db.or_(
-                cls.title.ilike(search),
-                cls.description.ilike(search),
-                cls.street_address.ilike(search),
-                cls.city.ilike(search),
-                cls.suburb.ilike(search)
-            )
-        ).limit(limit).all()
+        from search_index import search_properties
+        ids = [match['id'] for _, match in search_properties(query, owner_id=owner_id, limit=limit)]
+        if not ids:
+            return []
+        properties = {prop.id: prop for prop in cls.query.filter(cls.id.in_(ids)).all()}
+        return [properties[id] for id in ids if id in properties]
 
 class City(db.Model):
     __tablename__ = 'city'
@@ -1,44 +1,55 @@
 
 # openai.py 
+import json
 import openai
 import os
+import re
+import httpx
 import requests
 from flask import current_app, jsonify
 from config import Config
+from account_rules import LEDGER_ACCOUNTS
+import http_client
 
 # Azure OpenAI API settings
 azure_api_key = Config.AZURE_API_KEY
 azure_api_endpoint = Config.AZURE_API_ENDPOINT
 azure_deployment_name = Config.AZURE_DEPLOYMENT_NAME
 
-# Function to call Azure OpenAI's GPT model to classify transactions
-def classify_transaction_with_azure(item_name):
-    """
-    Uses Azure's OpenAI GPT API to classify transaction items (expenses, assets, liabilities, etc.)
-    into appropriate accounting categories.
-    """
-    url = f"{azure_api_key}openai/deployments/{azure_deployment_name}/completions?api-version=2023-10-01-preview"
+def _completions_url():
+    return f"{azure_api_endpoint}openai/deployments/{azure_deployment_name}/completions?api-version=2023-10-01-preview"
 
-    headers = {
+def _headers():
+    return {
         "Content-Type": "application/json",
         "Authorization": f"Bearer {azure_api_key}"
     }
 
+def _item_payload(item_name):
     # The prompt we will use for classification
     prompt = f"Classify the following transaction item into an accounting category: {item_name}. The categories are: 'Assets', 'Liabilities', 'Equity', 'Revenue', 'Expenses'. Please return the most appropriate account from the chart of accounts."
 
-    payload = {
+    return {
         "model": "gpt-4",  # Choose the GPT model available in your Azure OpenAI subscription
         "max_tokens": 50,
         "temperature": 0.2,
         "prompt": prompt
     }
 
+def _completion_text(body):
+    return body.get("choices", [{}])[0].get("text", "").strip()
+
+# Function to call Azure OpenAI's GPT model to classify transactions
+def classify_transaction_with_azure(item_name):
+    """
+    Uses Azure's OpenAI GPT API to classify transaction items (expenses, assets, liabilities, etc.)
+    into appropriate accounting categories.
+    """
     try:
         # Send request to Azure OpenAI API
-        response = requests.post(url, headers=headers, json=payload)
+        response = http_client.post('azure_openai', _completions_url(), headers=_headers(), json=_item_payload(item_name))
         response.raise_for_status()
-        classification = response.json().get("choices", [{}])[0].get("text", "").strip()
+        classification = _completion_text(response.json())
 
         if classification:
             current_app.logger.debug(f"Azure LLM classified '{item_name}' as: {classification}")
@@ -50,3 +61,124 @@ def classify_transaction_with_azure(item_name):
         current_app.logger.error(f"Error calling Azure LLM API: {str(e)}")
         return "Uncategorized"  # Default classification in case of an error
 
+def classify_each_with_azure(item_names):
+    """
+    classify_transaction_with_azure for several items, with the requests
+    sent concurrently rather than one after another.
+    """
+    responses = http_client.fan_out('azure_openai', [
+        {'method': 'POST', 'url': _completions_url(), 'headers': _headers(), 'json': _item_payload(name)}
+        for name in item_names
+    ])
+
+    accounts = []
+    for name, response in zip(item_names, responses):
+        try:
+            if isinstance(response, Exception):
+                raise response
+            response.raise_for_status()
+            classification = _completion_text(response.json())
+        except (requests.exceptions.RequestException, httpx.HTTPError, ValueError) as e:
+            current_app.logger.error(f"Error calling Azure LLM API for '{name}': {str(e)}")
+            classification = ""
+        accounts.append(classification or "Uncategorized")
+    return accounts
+
+
+# Rough prompt size: about four characters per token for English text
+CHARS_PER_TOKEN = 4
+TOKENS_PER_ANSWER = 20  # Completion tokens reserved for each item's account name
+
+def _estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def _batch_prompt(item_names):
+    # Only accounts that journal entries can be generated for are offered
+    lines = '\n'.join(f"{number}. {name}" for number, name in enumerate(item_names, 1))
+    return (
+        "Classify each of the following transaction items into an account from this chart of accounts: "
+        f"{', '.join(sorted(LEDGER_ACCOUNTS))}.\n\n"
+        f"{lines}\n\n"
+        "Reply with a JSON object only, mapping each item number to its account name exactly as listed, "
+        'for example {"1": "Utilities", "2": "Maintenance and Repairs"}.'
+    )
+
+def chunk_items(item_names, token_budget):
+    """Splits item names into consecutive chunks whose prompts fit within token_budget."""
+    overhead = _estimate_tokens(_batch_prompt([]))
+    chunk, used = [], overhead
+    for name in item_names:
+        cost = _estimate_tokens(f"{len(chunk) + 1}. {name}\n") + TOKENS_PER_ANSWER
+        if chunk and used + cost > token_budget:
+            yield chunk
+            chunk, used = [], overhead
+        chunk.append(name)
+        used += cost
+    if chunk:
+        yield chunk
+
+def parse_batch_classification(text, count):
+    """
+    Accounts by item position from a batch reply, or None if the reply is
+    not the JSON object asked for. Items the reply skipped are None, and
+    answers outside the chart of accounts are "Uncategorized".
+    """
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if not match:
+        return None
+    try:
+        answers = json.loads(match.group(0))
+    except ValueError:
+        return None
+    if not isinstance(answers, dict):
+        return None
+
+    accounts = [None] * count
+    for number, account in answers.items():
+        try:
+            index = int(number) - 1
+        except (TypeError, ValueError):
+            continue
+        if 0 <= index < count and isinstance(account, str) and account.strip():
+            account = account.strip()
+            accounts[index] = account if account in LEDGER_ACCOUNTS else "Uncategorized"
+    return accounts
+
+def classify_transactions_with_azure(item_names):
+    """
+    Classifies many transaction items with one Azure OpenAI request per
+    chunk of items (chunks are sized to AZURE_BATCH_TOKEN_BUDGET), returning
+    accounts in the same order as item_names. Items a reply could not be
+    parsed for are classified individually, concurrently, with
+    classify_each_with_azure.
+    """
+    token_budget = current_app.config.get('AZURE_BATCH_TOKEN_BUDGET', 3000)
+    accounts = []
+    for chunk in chunk_items(item_names, token_budget):
+        payload = {
+            "model": "gpt-4",
+            "max_tokens": TOKENS_PER_ANSWER * len(chunk) + 20,
+            "temperature": 0.2,
+            "prompt": _batch_prompt(chunk)
+        }
+
+        try:
+            response = http_client.post('azure_openai', _completions_url(), headers=_headers(), json=payload)
+            response.raise_for_status()
+            text = _completion_text(response.json())
+        except requests.exceptions.RequestException as e:
+            current_app.logger.error(f"Error calling Azure LLM API for {len(chunk)} items: {str(e)}")
+            accounts.extend(["Uncategorized"] * len(chunk))
+            continue
+
+        parsed = parse_batch_classification(text, len(chunk))
+        if parsed is None:
+            current_app.logger.warning(f"Unparseable batch classification, classifying {len(chunk)} items one by one")
+            parsed = [None] * len(chunk)
+
+        # Items the reply did not answer are asked about individually, all at once
+        unanswered = [name for name, account in zip(chunk, parsed) if not account]
+        fallback = iter(classify_each_with_azure(unanswered) if unanswered else [])
+        accounts.extend(account if account else next(fallback) for account in parsed)
+
+    return accounts
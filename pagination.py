@@ -0,0 +1,134 @@
+# pagination.py
+"""
+Keyset (seek) pagination.
+
+A page is addressed by an opaque cursor holding the sort values of the row
+at its edge instead of by a page number. The next page is read with
+`WHERE (date, id) < (cursor date, cursor id) ORDER BY date DESC, id DESC`,
+which the database answers by seeking into an index, so a page deep in the
+ledger costs the same as the first one and no COUNT(*) is needed to draw
+the navigation.
+
+The ordering must end in a unique column (normally the primary key) so
+that no two rows share a position and none are skipped or repeated
+between pages.
+"""
+import base64
+import json
+from datetime import date, datetime
+from decimal import Decimal, InvalidOperation
+from sqlalchemy import and_, or_
+
+
+class KeysetPage:
+    """One page of rows with the cursors of the pages either side of it."""
+
+    def __init__(self, items, per_page, next_cursor=None, prev_cursor=None, total=None):
+        self.items = items
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.total = total  # Approximate, when the caller supplies one
+
+    @property
+    def has_next(self):
+        return self.next_cursor is not None
+
+    @property
+    def has_prev(self):
+        return self.prev_cursor is not None
+
+    def to_dict(self):
+        return {
+            'per_page': self.per_page,
+            'next_cursor': self.next_cursor,
+            'prev_cursor': self.prev_cursor,
+            'has_next': self.has_next,
+            'has_prev': self.has_prev,
+            'approximate_total': self.total
+        }
+
+
+def _dump(value):
+    if isinstance(value, (date, datetime)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return str(value)
+    return value
+
+def _load(column, value):
+    if value is None:
+        return None
+    python_type = column.type.python_type
+    if python_type is datetime:
+        return datetime.fromisoformat(value)
+    if python_type is date:
+        return date.fromisoformat(value)
+    if python_type is Decimal:
+        return Decimal(value)
+    return python_type(value)
+
+def encode_cursor(values):
+    """Opaque, URL-safe token for a row's sort values."""
+    raw = json.dumps([_dump(value) for value in values], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(token, columns):
+    """Sort values from a cursor token, or None if it is missing or malformed."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(columns):
+            return None
+        return [_load(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError, InvalidOperation):
+        return None
+
+def _seek(columns, values, descending):
+    """Rows strictly after values in the given ordering: (a, b) < (x, y) spelt without row values for MSSQL."""
+    clauses = []
+    for index, (column, value) in enumerate(zip(columns, values)):
+        beyond = column < value if descending else column > value
+        clauses.append(and_(*[c == v for c, v in zip(columns[:index], values[:index])], beyond))
+    return or_(*clauses)
+
+def keyset_paginate(query, columns, after=None, before=None, per_page=20, descending=True):
+    """
+    Reads one page of query ordered by columns, the last of which must be
+    unique. after/before are cursor tokens from a previous page's
+    next_cursor/prev_cursor; with neither, the first page is returned.
+    """
+    columns = list(columns)
+    before_values = decode_cursor(before, columns)
+    after_values = None if before_values else decode_cursor(after, columns)
+
+    if before_values:
+        # Walk backwards from the cursor and flip the rows back into page order
+        query = query.filter(_seek(columns, before_values, not descending))
+        ordering = [column.asc() if descending else column.desc() for column in columns]
+    else:
+        if after_values:
+            query = query.filter(_seek(columns, after_values, descending))
+        ordering = [column.desc() if descending else column.asc() for column in columns]
+
+    rows = query.order_by(None).order_by(*ordering).limit(per_page + 1).all()
+    has_more = len(rows) > per_page
+    rows = rows[:per_page]
+    if before_values:
+        rows.reverse()
+
+    def cursor(row):
+        return encode_cursor([getattr(row, column.key) for column in columns])
+
+    next_cursor = prev_cursor = None
+    if rows:
+        if before_values:
+            next_cursor = cursor(rows[-1])
+            prev_cursor = cursor(rows[0]) if has_more else None
+        else:
+            next_cursor = cursor(rows[-1]) if has_more else None
+            prev_cursor = cursor(rows[0]) if after_values else None
+
+    return KeysetPage(rows, per_page, next_cursor=next_cursor, prev_cursor=prev_cursor)
@@ -3,6 +3,7 @@ from flask import current_app
 import requests
 from datetime import datetime
 import uuid
+import http_client
 
 def get_paystack_headers(secret_key):
     """Generate headers for Paystack API requests"""
@@ -30,7 +31,8 @@ def initialize_payment(amount, email, callback_url=None, reference=None):
             "callback_url": callback_url
         }
         
-        response = requests.post(
+        response = http_client.post(
+            'paystack',
             url,
             headers=get_paystack_headers(secret_key),
             json=data
@@ -48,7 +50,8 @@ def verify_payment(reference):
         url = f"https://api.paystack.co/transaction/verify/{reference}"
         secret_key = current_app.config['PAYSTACK_SECRET_KEY']
         
-        response = requests.get(
+        response = http_client.get(
+            'paystack',
             url,
             headers=get_paystack_headers(secret_key)
         )
@@ -0,0 +1,252 @@
+# pdf_renderer.py
+"""
+PDF rendering on a bounded background pool.
+
+Rendered PDFs are kept in a content-addressed disk cache keyed by a hash of
+the HTML and PDF_TEMPLATE_VERSION, so unchanged documents are served (or
+answered with 304 Not Modified) without running wkhtmltopdf again.
+
+Download links (static/js/pdf-jobs.js) ask for a job: wkhtmltopdf runs on
+the 'pdf' job pool (PDF_RENDER_WORKERS per process), the browser polls it
+and then downloads the file from the disk cache, so no web worker waits on
+a render. Job records hold the cache key, never the PDF. Clients without
+the script, and workers that do not share a cache, render in the request.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from flask import Blueprint, abort, current_app, jsonify, make_response, request, url_for
+from flask_login import current_user, login_required
+import pdfkit
+from extensions import workers_share_cache
+from jobs import get_job, submit_job
+
+pdf_routes = Blueprint('pdf_routes', __name__, url_prefix='/pdf')
+
+
+# --- Artifact cache ---
+
+class PdfArtifactCache:
+    """
+    PDFs stored on local disk under their content hash, evicting the least
+    recently used files once the directory grows past max_bytes.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._size = None
+        self._lock = threading.Lock()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f'{key}.pdf')
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                pdf = f.read()
+            os.utime(path)  # Mark as recently used
+            return pdf
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, pdf):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write beside the target and rename, so readers never see a partial file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.part')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(pdf)
+        os.replace(temp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += len(pdf)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith('.pdf'):
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    yield path, stat.st_size, stat.st_mtime
+
+    def _evict(self):
+        # Rescan, since other processes share the directory
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        self._size = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if self._size <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                self._size -= size
+            except FileNotFoundError:
+                pass
+
+_artifact_caches = {}
+
+def artifact_cache(directory=None, max_bytes=None):
+    """The process-wide artifact cache for a directory (defaults from config)."""
+    directory = directory or current_app.config['PDF_CACHE_DIR']
+    max_bytes = max_bytes or current_app.config.get('PDF_CACHE_MAX_BYTES', 512 * 1024 * 1024)
+    cache = _artifact_caches.get(directory)
+    if cache is None:
+        cache = _artifact_caches.setdefault(directory, PdfArtifactCache(directory, max_bytes))
+    return cache
+
+def pdf_cache_key(html, options=None, volatile=()):
+    """
+    Content hash identifying a rendered PDF. Strings listed in volatile, such
+    as a "generated on" timestamp, are left out so they do not defeat the cache.
+    """
+    for value in volatile:
+        if value:
+            html = html.replace(value, '')
+    digest = hashlib.sha256()
+    digest.update(str(current_app.config.get('PDF_TEMPLATE_VERSION', '1')).encode())
+    digest.update(json.dumps(options or {}, sort_keys=True).encode())
+    digest.update(html.encode('utf-8'))
+    return digest.hexdigest()
+
+
+# --- Rendering ---
+
+def render_pdf(html, options=None):
+    """Renders HTML to PDF bytes in memory."""
+    return pdfkit.from_string(html, False, options=options)
+
+def render_to_cache(html, options, key):
+    """Renders in the calling thread, keeps the PDF in the artifact cache and returns it."""
+    pdf = render_pdf(html, options)
+    try:
+        artifact_cache().put(key, pdf)
+    except OSError as e:
+        current_app.logger.warning(f"Could not cache PDF {key}: {str(e)}")
+    return pdf
+
+def render_and_store(html, options, key, directory, max_bytes):
+    """
+    Pool job: renders into the artifact cache and returns the key, which the
+    download route reads the file back by. Failing to store fails the job.
+    """
+    artifact_cache(directory, max_bytes).put(key, render_pdf(html, options))
+    return key
+
+def submit_pdf(html, key, filename, as_attachment=True, options=None):
+    """Queues html for rendering into the artifact cache under key and returns the job id."""
+    return submit_job(
+        'pdf', render_and_store, html, options, key,
+        current_app.config['PDF_CACHE_DIR'], current_app.config.get('PDF_CACHE_MAX_BYTES'),
+        max_workers=current_app.config.get('PDF_RENDER_WORKERS', 2),
+        user_id=current_user.get_id(),
+        meta={'filename': filename, 'as_attachment': as_attachment, 'etag': key}
+    )
+
+def render_pdf_now(html, options=None):
+    """The PDF for html, from the artifact cache or rendered into it, for callers that must have the file."""
+    key = pdf_cache_key(html, options)
+    pdf = artifact_cache().get(key)
+    if pdf is None:
+        pdf = render_to_cache(html, options, key)
+    return pdf
+
+def pdf_file_response(pdf, filename, as_attachment=True, etag=None):
+    response = make_response(pdf)
+    response.headers['Content-Type'] = 'application/pdf'
+    disposition = 'attachment' if as_attachment else 'inline'
+    response.headers['Content-Disposition'] = f'{disposition}; filename={filename}'
+    if etag:
+        response.set_etag(etag)
+        response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _not_modified(etag):
+    response = make_response('', 304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _job_response(job_id, status_code=202):
+    response = jsonify({
+        'job_id': job_id,
+        'status': (get_job(job_id) or {}).get('status', 'pending'),
+        'status_url': url_for('pdf_routes.pdf_job_status', job_id=job_id),
+        'download_url': url_for('pdf_routes.download_pdf_job', job_id=job_id)
+    })
+    response.status_code = status_code
+    response.headers['Location'] = url_for('pdf_routes.pdf_job_status', job_id=job_id)
+    return response
+
+def pdf_response(html, filename, as_attachment=True, options=None, volatile=()):
+    """
+    Serves html as a PDF. Unchanged documents are answered from the
+    artifact cache, or with 304 when the client's ETag matches.
+
+    Otherwise clients asking for a job (?async=1 or an Accept:
+    application/json header) get a 202 with status/download URLs at once,
+    and html is rendered on the PDF pool. Everyone else, and every client
+    when workers do not share a cache to poll jobs through, gets the file
+    rendered in the request.
+    """
+    key = pdf_cache_key(html, options, volatile)
+    if key in request.if_none_match:
+        return _not_modified(key)
+
+    pdf = artifact_cache().get(key)
+    if pdf is not None:
+        return pdf_file_response(pdf, filename, as_attachment, etag=key)
+
+    wants_job = request.args.get('async') == '1' or request.accept_mimetypes.best == 'application/json'
+    if wants_job and workers_share_cache(current_app.config):
+        return _job_response(submit_pdf(html, key, filename, as_attachment, options))
+
+    return pdf_file_response(render_to_cache(html, options, key), filename, as_attachment, etag=key)
+
+
+def _owned_job(job_id):
+    job = get_job(job_id)
+    if job is None or job['user_id'] != current_user.get_id():
+        abort(404)
+    return job
+
+@pdf_routes.route('/jobs/<job_id>', methods=['GET'])
+@login_required
+def pdf_job_status(job_id):
+    """Polls a PDF job"""
+    job = get_job(job_id)
+    if job is None or job['user_id'] != current_user.get_id():
+        return jsonify({'job_id': job_id, 'error': 'Job not found or expired'}), 404
+    payload = {'job_id': job_id, 'status': job['status'], 'filename': job['meta'].get('filename')}
+    if job['status'] == 'done':
+        payload['download_url'] = url_for('pdf_routes.download_pdf_job', job_id=job_id)
+    if job['status'] == 'failed':
+        payload['error'] = 'PDF rendering failed'
+    return jsonify(payload)
+
+@pdf_routes.route('/jobs/<job_id>/download', methods=['GET'])
+@login_required
+def download_pdf_job(job_id):
+    """Downloads a finished PDF job"""
+    job = _owned_job(job_id)
+    etag = job['meta'].get('etag')
+    if etag and etag in request.if_none_match:
+        return _not_modified(etag)
+    if job['status'] != 'done':
+        return _job_response(job_id)
+    pdf = artifact_cache().get(job['result'])
+    if pdf is None:
+        # Evicted since the job finished; the page link renders it again
+        return jsonify({'job_id': job_id, 'error': 'PDF expired'}), 404
+    return pdf_file_response(pdf, job['meta']['filename'], job['meta'].get('as_attachment', True), etag=etag)
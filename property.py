@@ -7,14 +7,32 @@ import os
 from werkzeug.utils import secure_filename
 from datetime import datetime
 import os
-import shutil
+from sqlalchemy import func, select
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import aliased
 from flask_wtf import FlaskForm
 import traceback
 from utils import allowed_file 
+from images import link_photo, submit_photo
+from jobs import get_job
 
 property_routes = Blueprint('property_routes', __name__)
 
+def latest_per_property(model, property_ids):
+    """
+    The most recently created row of model for each of property_ids, using
+    ROW_NUMBER() over property_id instead of one query per property.
+    """
+    ranked = select(
+        model,
+        func.row_number().over(
+            partition_by=model.property_id,
+            order_by=(model.date_created.desc(), model.id.desc())
+        ).label('row_number')
+    ).where(model.property_id.in_(property_ids)).subquery()
+    latest = aliased(model, ranked)
+    return db.session.query(latest).filter(ranked.c.row_number == 1).all()
+
 @property_routes.route('/property/new', methods=['GET'])
 @login_required
 def new_property():
@@ -63,66 +81,56 @@ def property_list():
         abort(403)
 
     properties_data = []
+    # The thumbnail is joined in through Property.thumbnail_photo
     properties = Property.query.filter_by(owner_id=current_user_owner.id).all()
 
+    # Latest listing and rental agreement per property, one windowed query each
+    owner_property_ids = select(Property.id).where(Property.owner_id == current_user_owner.id)
+    latest_listings = {
+        listing.property_id: listing
+        for listing in latest_per_property(Listing, owner_property_ids)
+    }
+    latest_agreements = {
+        agreement.property_id: agreement
+        for agreement in latest_per_property(RentalAgreement, owner_property_ids)
+    }
+
+    status_changed = False
     for property in properties:
-        try:
-            # Get latest listing
-            latest_listing = db.session.query(Listing).filter(
-                Listing.property_id == property.id
-            ).order_by(
-                Listing.date_created.desc()
-            ).first()
-
-            # Get latest rental agreement
-            latest_agreement = db.session.query(
-                RentalAgreement.status,
-                RentalAgreement.date_created
-            ).filter(
-                RentalAgreement.property_id == property.id
-            ).order_by(
-                RentalAgreement.date_created.desc()
-            ).first()
-
-            # Determine status based on conditions
-            if latest_agreement and latest_agreement.status == 'accepted':
-                listing_status = 'Occupied'
-                if latest_listing and latest_listing.status:
-                    latest_listing.status = False  # Ensure listing is inactive if property is occupied
-                    db.session.commit()
-            elif latest_listing:
-                if latest_listing.status is True:
-                    if latest_agreement and latest_agreement.status == 'pending':
-                        listing_status = 'Pending'  # Active enquiry
-                    else:
-                        listing_status = 'Listed'  # Available to tenants
+        latest_listing = latest_listings.get(property.id)
+        latest_agreement = latest_agreements.get(property.id)
+
+        # Determine status based on conditions
+        if latest_agreement and latest_agreement.status == 'accepted':
+            listing_status = 'Occupied'
+            if latest_listing and latest_listing.status:
+                latest_listing.status = False  # Ensure listing is inactive if property is occupied
+                status_changed = True
+        elif latest_listing:
+            if latest_listing.status is True:
+                if latest_agreement and latest_agreement.status == 'pending':
+                    listing_status = 'Pending'  # Active enquiry
                 else:
-                    listing_status = 'Unlisted'  # Not available
+                    listing_status = 'Listed'  # Available to tenants
             else:
-                listing_status = 'Unlisted'  # No listing exists
-
-            # Get thumbnail
-            thumbnail = None
-            if property.photos:
-                thumbnail = next((photo for photo in property.photos if photo.is_thumbnail), 
-                               property.photos[0] if property.photos else None)
+                listing_status = 'Unlisted'  # Not available
+        else:
+            listing_status = 'Unlisted'  # No listing exists
 
-            properties_data.append({
-                'property': property,
-                'thumbnail': thumbnail,
-                'listing_status': listing_status,
-                'listing': latest_listing
-            })
+        properties_data.append({
+            'property': property,
+            'thumbnail': property.thumbnail,
+            'listing_status': listing_status,
+            'listing': latest_listing
+        })
 
-        except Exception as e:
-            current_app.logger.error(f"Error processing property {property.id}: {str(e)}")
-            db.session.rollback()  
-            properties_data.append({
-                'property': property,
-                'thumbnail': property.thumbnail,
-                'listing_status': 'Error',
-                'listing': None
-            })
+    # Deactivate listings of occupied properties in one commit
+    if status_changed:
+        try:
+            db.session.commit()
+        except SQLAlchemyError as e:
+            current_app.logger.error(f"Error updating listing statuses: {str(e)}")
+            db.session.rollback()
 
     form = FlaskForm()  # Create an empty form for CSRF protection
     return render_template('property/property_list.html', properties=properties_data, form=form, listing=None, rental_agreements=[])
@@ -414,6 +422,8 @@ def edit_photos(property_id):
 
     if form.validate_on_submit():
         try:
+            uploads = []  # (file, original filename, is_thumbnail), processed in the background
+
             # Handle thumbnail upload
             if form.thumbnail.data:
                 current_app.logger.info("Processing thumbnail upload...")
@@ -423,88 +433,29 @@ def edit_photos(property_id):
                 if old_thumbnail:
                     current_app.logger.info(f"Removing old thumbnail: {old_thumbnail.file_path}")
                     try:
-                        old_path = os.path.join(current_app.static_folder, old_thumbnail.file_path)
-                        if os.path.exists(old_path):
-                            os.remove(old_path)
-                        db.session.delete(old_thumbnail)
+                        db.session.delete(old_thumbnail)  # Files go with the last reference, see property_photos.py
                         current_app.logger.info("Old thumbnail removed successfully")
                     except Exception as e:
                         current_app.logger.error(f"Error removing old thumbnail: {str(e)}")
 
-                # Process new thumbnail
-                original_filename = secure_filename(form.thumbnail.data.filename)
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                filename = f"{timestamp}_{original_filename}"
-                
-                # Create paths
-                relative_path = f"uploads/property_photos/{property.id}/{filename}"
-                upload_path = os.path.join(current_app.static_folder, 'uploads/property_photos', str(property.id))
-                full_path = os.path.join(upload_path, filename)
-                
-                # Ensure directory exists
-                os.makedirs(upload_path, exist_ok=True)
-                
-                # Save file
-                try:
-                    form.thumbnail.data.save(full_path)
-                    current_app.logger.info(f"Thumbnail saved to: {full_path}")
-                except Exception as e:
-                    current_app.logger.error(f"Error saving thumbnail file: {str(e)}")
-                    raise
-
-                # Create database record
-                try:
-                    thumbnail = Photo(
-                        file_path=relative_path,
-                        filename=original_filename,  # Add the original filename
-                        property_id=property.id,
-                        is_thumbnail=True,
-                        order=0
-                    )
-                    db.session.add(thumbnail)
-                    current_app.logger.info("Thumbnail record added to session")
-                except Exception as e:
-                    current_app.logger.error(f"Error creating thumbnail record: {str(e)}")
-                    raise
+                # Queue new thumbnail
+                uploads.append((form.thumbnail.data, secure_filename(form.thumbnail.data.filename), True))
 
             # Handle regular photos
             if form.photos.data:
                 for photo in form.photos.data:
                     if photo.filename:
-                        current_app.logger.info(f"Processing regular photo: {photo.filename}")
-                        
-                        original_filename = secure_filename(photo.filename)
-                        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-                        filename = f"{timestamp}_{original_filename}"
-                        
-                        relative_path = f"uploads/property_photos/{property.id}/{filename}"
-                        upload_path = os.path.join(current_app.static_folder, 'uploads/property_photos', str(property.id))
-                        full_path = os.path.join(upload_path, filename)
-                        
-                        os.makedirs(upload_path, exist_ok=True)
-                        
-                        try:
-                            photo.save(full_path)
-                            current_app.logger.info(f"Photo saved to: {full_path}")
-                            
-                            photo_record = Photo(
-                                file_path=relative_path,
-                                filename=original_filename,  # Add the original filename
-                                property_id=property.id,
-                                is_thumbnail=False,
-                                order=0
-                            )
-                            db.session.add(photo_record)
-                            current_app.logger.info("Photo record added to session")
-                        except Exception as e:
-                            current_app.logger.error(f"Error processing photo: {str(e)}")
-                            raise
+                        current_app.logger.info(f"Queueing regular photo: {photo.filename}")
+                        uploads.append((photo, secure_filename(photo.filename), False))
 
             # Commit all changes
             try:
                 db.session.commit()
                 current_app.logger.info("All changes committed successfully")
-                flash('Photos uploaded successfully!', 'success')
+                # Queue only after the old thumbnail is gone, so the new one cannot be removed with it
+                for upload, original_filename, is_thumbnail in uploads:
+                    submit_photo(upload, property.id, original_filename, is_thumbnail=is_thumbnail)
+                flash('Photos uploaded and are being processed.', 'success')
                 return redirect(url_for('property_routes.manage_property', property_id=property.id))
             except Exception as e:
                 db.session.rollback()
@@ -545,13 +496,7 @@ def delete_photo(photo_id):
             flash('You do not have permission to delete this photo.', 'error')
             return redirect(url_for('property_routes.manage', property_id=property.id))
 
-        # Delete the photo file
-        if photo.filename:
-            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], photo.filename)
-            if os.path.exists(file_path):
-                os.remove(file_path)
-
-        # Delete from database
+        # Delete from database; the files are removed with the last reference on commit
         db.session.delete(photo)
         db.session.commit()
 
@@ -702,30 +647,14 @@ def duplicate_property(property_id):
         db.session.add(new_property)
         db.session.flush()  # Get the new ID
         
-        # Copy photos
+        # Link photos to the original's stored files
         for photo in original.photos:
-            # Create new filename with new property ID
-            original_filename = photo.filename
-            new_filename = f"{datetime.now().strftime('%Y%m%d_%H%M%S')}_{original_filename}"
-            
-            # Copy the physical file
-            original_path = os.path.join(current_app.root_path, 'static', photo.file_path)
-            new_relative_path = f"uploads/property_photos/{new_property.id}/{new_filename}"
-            new_path = os.path.join(current_app.root_path, 'static', new_relative_path)
-            
-            # Create directory if it doesn't exist
-            os.makedirs(os.path.dirname(new_path), exist_ok=True)
-            
-            # Copy the file
-            shutil.copy2(original_path, new_path)
-            
-            # Create new photo record
             new_photo = Photo(
                 property_id=new_property.id,
-                file_path=new_relative_path,
-                filename=new_filename,
+                filename=photo.filename,
                 is_thumbnail=photo.is_thumbnail,
-                order=photo.order
+                order=photo.order,
+                **link_photo(photo, current_app.static_folder)
             )
             db.session.add(new_photo)
         
@@ -766,22 +695,11 @@ def delete_property(property_id):
             return jsonify({'error': 'Cannot delete an occupied property'}), 400
 
         try:
-            # Delete associated photos
+            # Delete associated photos; files still linked from other properties are kept
             if property.photos:
                 for photo in property.photos:
-                    try:
-                        file_path = os.path.join(current_app.static_folder, photo.file_path)
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                    except Exception as e:
-                        current_app.logger.error(f"Error deleting photo file: {str(e)}")
                     db.session.delete(photo)
 
-            # Delete the photos directory if it exists
-            photo_dir = os.path.join(current_app.static_folder, f'uploads/property_photos/{property_id}')
-            if os.path.exists(photo_dir):
-                shutil.rmtree(photo_dir)
-
             # Delete associated listings
             Listing.query.filter_by(property_id=property_id).delete()
 
@@ -835,39 +753,26 @@ def upload_photos(property_id):
         existing_photos = Photo.query.filter_by(property_id=property_id).all()
         has_thumbnail = any(photo.is_thumbnail for photo in existing_photos)
 
+        # Stage the raw files and queue processing; Photo rows are created by the jobs
+        job_ids = []
         for index, photo in enumerate(photos):
             if photo and allowed_file(photo.filename):
                 filename = secure_filename(photo.filename)
-                # Set the upload path to static/uploads/property_photos
-                upload_folder = os.path.join(current_app.static_folder, 'uploads', 'property_photos')
-                filepath = os.path.join(upload_folder, filename)
-                
-                # Log the file path before saving
-                current_app.logger.info(f"Saving photo to: {filepath}")
-                
-                # Ensure the upload directory exists
-                os.makedirs(upload_folder, exist_ok=True)
-                
-                # Save the photo
-                photo.save(filepath)
-                
-                # Create photo record in database
-                new_photo = Photo(
-                    property_id=property_id,
-                    file_path=os.path.join('uploads', 'property_photos', filename),
-                    filename=filename,
-                    is_thumbnail=False  # Set the uploaded photo's is_thumbnail to False
-                )
                 
                 # If there are no existing thumbnails, set the first uploaded photo as thumbnail
-                if not has_thumbnail and index == 0:
-                    new_photo.is_thumbnail = True
-                
-                db.session.add(new_photo)
+                is_thumbnail = not has_thumbnail and index == 0
+                job_ids.append(submit_photo(photo, property_id, filename, is_thumbnail=is_thumbnail))
         
-        db.session.commit()
-        flash('Photos uploaded successfully', 'success')
-        current_app.logger.info('Photos uploaded successfully')
+        current_app.logger.info(f"Queued {len(job_ids)} photos for property {property_id}")
+        
+        if request.args.get('async') == '1' or request.accept_mimetypes.best == 'application/json':
+            return jsonify({
+                'jobs': [
+                    {'job_id': job_id, 'status_url': url_for('property_routes.photo_job_status', job_id=job_id)}
+                    for job_id in job_ids
+                ]
+            }), 202
+        flash('Photos uploaded and are being processed', 'success')
     except Exception as e:
         current_app.logger.error(f"Error during photo upload: {str(e)}")
         db.session.rollback()  # Rollback the session in case of error
@@ -875,6 +780,20 @@ def upload_photos(property_id):
     
     return redirect(request.referrer)
 
+@property_routes.route('/property/photo_jobs/<job_id>', methods=['GET'])
+@login_required
+def photo_job_status(job_id):
+    """Polls a photo ingestion job"""
+    job = get_job(job_id)
+    if job is None or job['user_id'] != current_user.get_id():
+        return jsonify({'job_id': job_id, 'error': 'Job not found or expired'}), 404
+    payload = {'job_id': job_id, 'status': job['status'], 'filename': job['meta'].get('filename')}
+    if job['status'] == 'done':
+        payload['photo_id'] = job['result']['photo_id']
+    if job['status'] == 'failed':
+        payload['error'] = 'Photo processing failed'
+    return jsonify(payload)
+
 
 @property_routes.route('/property/create_listing/<int:property_id>', methods=['GET', 'POST'])
 @login_required
@@ -944,13 +863,7 @@ def delete_photos():
                 flash('You do not have permission to delete this photo.', 'error')
                 return redirect(url_for('property_routes.manage_property', property_id=property.id))
 
-            # Delete the photo file
-            if photo.filename:
-                file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], photo.filename)
-                if os.path.exists(file_path):
-                    os.remove(file_path)
-
-            # Delete from database
+            # Delete from database; the files are removed with the last reference on commit
             db.session.delete(photo)
 
         db.session.commit()
@@ -0,0 +1,139 @@
+# property_photos.py
+import click
+from flask.cli import with_appcontext
+from sqlalchemy import case, event, func, inspect, select
+from sqlalchemy.orm import Session
+from flask import current_app
+from extensions import db
+from images import blob_lock, remove_files, variant_paths
+from models import Photo, Property
+
+# Properties whose photos change in a flush are re-summarised once the flush
+# has written them, replacing the per-access COUNT and thumbnail queries.
+#
+# Photo rows sharing a content_hash are references to the same stored files
+# (see images.py). Files of deleted photos are removed after commit, and only
+# when no remaining row references them, checked under images.blob_lock() so
+# an ingest linking the same files cannot commit in between.
+
+
+def refresh_photo_summary(connection, property_ids=None):
+    """
+    Recomputes photo_count and thumbnail_photo_id for the given properties,
+    or for every property when property_ids is None. The thumbnail is the
+    photo flagged is_thumbnail, falling back to the first photo.
+    """
+    photo = Photo.__table__
+    prop = Property.__table__
+
+    photo_count = select(func.count(photo.c.id)).where(
+        photo.c.property_id == prop.c.id
+    ).scalar_subquery()
+    thumbnail_photo_id = select(photo.c.id).where(
+        photo.c.property_id == prop.c.id
+    ).order_by(
+        case((photo.c.is_thumbnail == True, 0), else_=1),
+        photo.c.order,
+        photo.c.id
+    ).limit(1).scalar_subquery()
+
+    update = prop.update().values(photo_count=photo_count, thumbnail_photo_id=thumbnail_photo_id)
+    if property_ids is not None:
+        update = update.where(prop.c.id.in_(list(property_ids)))
+    connection.execute(update)
+
+def _previous_property_id(photo):
+    history = inspect(photo).attrs.property_id.load_history()
+    if history.deleted:
+        return history.deleted[0]
+    if history.unchanged:
+        return history.unchanged[0]
+    return None
+
+SUMMARY_ATTRIBUTES = ('property_id', 'is_thumbnail', 'order')
+
+@event.listens_for(Session, 'before_flush')
+def collect_photo_changes(session, flush_context, instances):
+    """Notes which properties a flush's Photo inserts, updates and deletes touch."""
+    previous_ids = set()
+    pending = []
+    for obj in session.deleted:
+        if isinstance(obj, Photo):
+            previous_ids.add(_previous_property_id(obj))
+    for obj in session.dirty:
+        if isinstance(obj, Photo):
+            state = inspect(obj)
+            if any(state.attrs[name].history.has_changes() for name in SUMMARY_ATTRIBUTES):
+                previous_ids.add(_previous_property_id(obj))
+                pending.append(obj)
+    for obj in session.new:
+        if isinstance(obj, Photo):
+            pending.append(obj)
+
+    if previous_ids or pending:
+        changes = session.info.setdefault('photo_changes', (set(), []))
+        changes[0].update(previous_ids)
+        changes[1].extend(pending)
+
+    released = [
+        (obj.content_hash, variant_paths(obj))
+        for obj in session.deleted if isinstance(obj, Photo)
+    ]
+    if released:
+        session.info.setdefault('released_photos', []).extend(released)
+
+@event.listens_for(Session, 'after_flush_postexec')
+def update_photo_summary(session, flush_context):
+    """Rewrites photo_count/thumbnail_photo_id of properties whose photos changed."""
+    changes = session.info.pop('photo_changes', None)
+    if not changes:
+        return
+    previous_ids, pending = changes
+    # New photos only know their property_id once flushed
+    property_ids = {pid for pid in previous_ids | {photo.property_id for photo in pending} if pid is not None}
+    if not property_ids:
+        return
+
+    refresh_photo_summary(session.connection(), property_ids)
+
+    # Loaded properties pick up the new summary on next access
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Property) and obj.id in property_ids:
+            session.expire(obj, ['photo_count', 'thumbnail_photo_id', 'thumbnail_photo'])
+
+@event.listens_for(Session, 'after_commit')
+def remove_released_photo_files(session):
+    """Deletes the files of committed photo deletes that no remaining photo references."""
+    released = session.info.pop('released_photos', None)
+    if not released:
+        return
+
+    static_folder = current_app.static_folder
+    for content_hash, paths in released:
+        try:
+            if content_hash is None:
+                remove_files(paths, static_folder)
+                continue
+            with blob_lock(content_hash):
+                # The session cannot emit SQL after commit
+                with db.engine.connect() as connection:
+                    referenced = connection.scalar(
+                        select(Photo.id).where(Photo.content_hash == content_hash).limit(1)
+                    )
+                if referenced is None:
+                    remove_files(paths, static_folder)
+        except OSError as e:
+            current_app.logger.error(f"Error deleting photo files {paths}: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def keep_released_photo_files(session):
+    """Rolled back deletes leave their files in place."""
+    session.info.pop('released_photos', None)
+
+@click.command('backfill-property-photos')
+@with_appcontext
+def backfill_property_photos_command():
+    """Recompute photo_count and thumbnail_photo_id for every property."""
+    refresh_photo_summary(db.session.connection())
+    db.session.commit()
+    click.echo('Property photo summaries backfilled')
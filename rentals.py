@@ -1,14 +1,14 @@
-from flask import Blueprint, abort, current_app, render_template, redirect, send_file, url_for, flash, request, make_response
+from flask import Blueprint, abort, current_app, render_template, redirect, send_file, url_for, flash, request
 from flask_login import login_required, current_user
 from forms import GenerateLeaseForm
 from models import Listing, Message, RentalAgreement, Enquiry, Property, Owner, User, RentalUpdates
 from extensions import db, mail
 from datetime import datetime, timedelta
 from flask_mail import Message
-import pdfkit
 import os
 from PyPDF2 import PdfReader
 import uuid
+from pdf_renderer import pdf_response, render_pdf_now
 
 rental_routes = Blueprint('rental_routes', __name__)
 
@@ -297,17 +297,8 @@ def view_rental_agreement_pdf(agreement_id):
     # Render the HTML template to a string
     rendered = render_template('rental/rental_agreement_pdf.html', agreement=agreement, owner=owner, apartment=apartment)
 
-    # Create a PDF from the rendered HTML
-    pdf_file_path = f'temp_rental_agreement_{agreement_id}.pdf'
-    pdfkit.from_string(rendered, pdf_file_path)
-
-    # Return the PDF file for preview
-    response = send_file(pdf_file_path, as_attachment=False, mimetype='application/pdf')
-
-    # Clean up the temporary file after sending
-    os.remove(pdf_file_path)
-
-    return response
+    # Serve the PDF for preview from the artifact cache, or as a render job for pdf-jobs.js
+    return pdf_response(rendered, f'rental_agreement_{agreement_id}.pdf', as_attachment=False)
 
 @rental_routes.route('/rental_agreement/<int:agreement_id>/download', methods=['GET'])
 @login_required
@@ -329,15 +320,8 @@ def download_rental_agreement(agreement_id):
     # Render the HTML template to a string
     rendered = render_template('rental/rental_agreement_pdf.html', agreement=agreement, owner=owner, apartment=apartment)
 
-    # Create a PDF from the rendered HTML
-    pdf = pdfkit.from_string(rendered, False)
-
-    # Create a response with the PDF
-    response = make_response(pdf)
-    response.headers['Content-Type'] = 'application/pdf'
-    response.headers['Content-Disposition'] = f'attachment; filename=rental_agreement_{agreement_id}.pdf'
-
-    return response
+    # Serve the PDF from the artifact cache, or as a render job for pdf-jobs.js
+    return pdf_response(rendered, f'rental_agreement_{agreement_id}.pdf')
 
 @rental_routes.route('/send_rental_agreement/<int:agreement_id>', methods=['POST'])
 @login_required
@@ -405,10 +389,12 @@ def finalize_agreement(agreement_id):
     if agreement.status == 'signed_by_owner':
         # Generate the final signed PDF
         rendered = render_template('rental/rental_agreement_pdf.html', agreement=agreement)
-        final_pdf = pdfkit.from_string(rendered, False)
+        final_pdf = render_pdf_now(rendered)
 
-        # Save the final signed PDF
-        final_pdf_path = f'final_signed_agreement_{agreement_id}.pdf'
+        # Save the final signed PDF with the other uploaded documents
+        agreements_folder = os.path.join(current_app.config['UPLOAD_FOLDER_DOCUMENTS'], 'agreements')
+        os.makedirs(agreements_folder, exist_ok=True)
+        final_pdf_path = os.path.join(agreements_folder, f'final_signed_agreement_{agreement_id}.pdf')
         with open(final_pdf_path, 'wb') as f:
             f.write(final_pdf)
 
@@ -446,5 +432,5 @@ def manage_agreements():
 
 def generate_pdf():
     html_content = '<h1>Rental Agreement</h1><p>This is your rental agreement.</p>'
-    pdfkit.from_string(html_content, 'rental_agreement.pdf')
+    return render_pdf_now(html_content)
 
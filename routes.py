@@ -6,6 +6,7 @@ from sqlalchemy import func
 # from investment_analyses import oer_analysis
 from models import MaintainanceReport, Property, Listing, RentalAgreement, Transaction, User, db, Message, Owner, BankingDetails
 from datetime import datetime, timedelta, date
+from ledger import ledger_total
 from sqlalchemy.orm import joinedload
 
 main = Blueprint('main', __name__)
@@ -46,21 +47,10 @@ def index():
         )  # Limit to current user's properties
     ).count()
 
-    total_income = db.session.query(db.func.sum(Transaction.amount)).filter(
-        Transaction.main_category == 'Revenue',
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date,
-        Transaction.is_reconciled == True,
-        Transaction.owner.has(user_id=current_user.id)  
-    ).scalar() or 0  
-
-    total_operating_expenses = db.session.query(db.func.sum(Transaction.amount)).filter(
-        Transaction.sub_category == 'Cost of Sales',
-        Transaction.transaction_date >= start_date,
-        Transaction.transaction_date < end_date,
-        Transaction.is_reconciled == True,
-        Transaction.owner.has(user_id=current_user.id) 
-    ).scalar() or 0
+    # Income and operating expense totals come from the ledger rollup
+    owner = Owner.query.filter_by(user_id=current_user.id).first()
+    total_income = ledger_total(owner.id, start_date, end_date, main_category='Revenue') if owner else 0
+    total_operating_expenses = ledger_total(owner.id, start_date, end_date, sub_category='Cost of Sales') if owner else 0
 
     terminated_rental_agreements = db.session.query(RentalAgreement).filter(
         RentalAgreement.status == 'no_renewal',
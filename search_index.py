@@ -0,0 +1,982 @@
+# search_index.py
+"""
+In-process search indexes over properties and listings: text autocomplete,
+a spatial grid of listed properties and faceted listing search.
+
+Each worker process keeps its own copy of every index, built from the database
+on first use (gunicorn builds them right after forking, see gunicorn.conf.py)
+and kept current as rows change:
+
+- After a commit, this process re-reads the changed rows and applies them to
+  its indexes straight away (session events at the bottom of this module).
+- The changed keys are also appended to a per-index log in the shared cache
+  (see extensions.cache). Other processes replay the log before their next
+  search. If entries are missing, they rebuild from the database instead.
+  They also rebuild every SEARCH_INDEX_MAX_AGE seconds regardless.
+
+Only the first build of an index blocks a search. Later rebuilds run on a
+background thread while searches keep using the current copy, and the new
+copy is swapped in once it has caught up with changes made meanwhile.
+"""
+import bisect
+import heapq
+import math
+import os
+import re
+import threading
+import time
+import unicodedata
+from datetime import date, datetime
+from flask import current_app
+from sqlalchemy import and_, event, func, inspect, select
+from sqlalchemy.orm import Session
+from extensions import cache, cache_is_shared, db, workers_share_cache
+from models import Listing, Property
+
+_registry = {}
+_indexes = {}
+_rebuilding = {}  # (pid, name) -> keys changed in this process while the index is rebuilt
+_lock = threading.Lock()
+_build_lock = threading.Lock()
+
+
+def register(cls):
+    """Class decorator adding an index to the registry by its name."""
+    _registry[cls.name] = cls
+    return cls
+
+class SearchIndex:
+    """
+    Base class for an in-memory index. Subclasses say which models feed it
+    and how to load rows, then maintain their own structures through add()
+    and discard().
+    """
+    name = None
+    watched = ()  # Model classes whose changes can affect the index
+    fields = None  # Attributes whose updates matter; None means any
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.seq = 0
+        self.built_at = None
+
+    @classmethod
+    def keys_for(cls, obj):
+        """Index keys affected by a change to obj; called on the class by the session events."""
+        return {obj.id}
+
+    def key(self, row):
+        return row.id
+
+    def load(self, connection, keys=None):
+        """Rows for the given keys, or for everything when keys is None."""
+        raise NotImplementedError
+
+    def add(self, row):
+        raise NotImplementedError
+
+    def discard(self, key):
+        raise NotImplementedError
+
+    def clear(self):
+        raise NotImplementedError
+
+    def build(self, connection):
+        with self.lock:
+            self.clear()
+            for row in self.load(connection):
+                self.add(row)
+            self.built_at = time.monotonic()
+
+    def refresh(self, connection, keys):
+        """Re-reads the given keys; keys whose rows are gone are dropped."""
+        rows = {self.key(row): row for row in self.load(connection, keys)}
+        with self.lock:
+            for key in keys:
+                self.discard(key)
+                if key in rows:
+                    self.add(rows[key])
+
+
+# --- Change log ---
+
+def _seq_key(name):
+    return f'search:{name}:seq'
+
+def _change_key(name, seq):
+    return f'search:{name}:change:{seq}'
+
+def _current_seq(name):
+    return cache.get(_seq_key(name)) or 0
+
+def _publish(name, keys):
+    """
+    Appends changed keys to the shared log and returns their sequence
+    number. A per-process cache has no other readers, so nothing is logged.
+    """
+    if not cache_is_shared(current_app.config):
+        return None
+    # The counter never expires, or every index would see the log reset and
+    # rebuild; incrementing keeps the key's lifetime on Redis and memcached
+    cache.add(_seq_key(name), 0, timeout=0)
+    seq = cache.inc(_seq_key(name))
+    if seq is None:
+        return None
+    timeout = current_app.config.get('SEARCH_CHANGE_TIMEOUT', 3600)
+    cache.set(_change_key(name, seq), sorted(keys), timeout=timeout)
+    return seq
+
+def _build(cls):
+    index = cls()
+    index.seq = _current_seq(cls.name)  # Taken first, so changes made while loading are replayed
+    with db.engine.connect() as connection:
+        index.build(connection)
+    current_app.logger.info(f"Built search index {cls.name}")
+    return index
+
+def _sync(index):
+    """Brings index up to date with changes committed by other processes."""
+    max_age = current_app.config.get('SEARCH_INDEX_MAX_AGE', 3600)
+    if not workers_share_cache(current_app.config):
+        # Other workers' changes never reach the log, so rebuilds are the only way to see them
+        max_age = min(max_age, current_app.config.get('SEARCH_INDEX_UNSHARED_MAX_AGE', 60))
+    current = _current_seq(index.name)
+    if current == index.seq and time.monotonic() - index.built_at < max_age:
+        return index
+
+    if current < index.seq or current - index.seq > 1000 or time.monotonic() - index.built_at >= max_age:
+        return None  # Log was reset, too far behind, or index too old
+
+    keys = set()
+    for seq in range(index.seq + 1, current + 1):
+        changed = cache.get(_change_key(index.name, seq))
+        if changed is None:
+            return None
+        keys.update(changed)
+    with db.engine.connect() as connection:
+        index.refresh(connection, keys)
+    index.seq = current
+    return index
+
+def _rebuild(key, name):
+    """
+    Builds a fresh copy of an index on a background thread and swaps it in
+    once the keys this process changed while it loaded are re-read.
+    """
+    with _lock:
+        if key in _rebuilding:
+            return
+        _rebuilding[key] = set()
+    app = current_app._get_current_object()
+
+    def run():
+        with app.app_context():
+            try:
+                index = _build(_registry[name])
+                while True:
+                    with _lock:
+                        changed = _rebuilding[key]
+                        if not changed:
+                            _indexes[key] = index
+                            break
+                        _rebuilding[key] = set()
+                    with db.engine.connect() as connection:
+                        index.refresh(connection, changed)
+            except Exception as e:
+                app.logger.error(f"Error rebuilding search index {name}: {str(e)}")
+            finally:
+                with _lock:
+                    _rebuilding.pop(key, None)
+
+    threading.Thread(target=run, name=f'search-index-{name}', daemon=True).start()
+
+def get_index(name):
+    """
+    This process's copy of the named index, brought up to date as needed.
+    Only the first build waits; a stale copy is served while it is rebuilt.
+    """
+    key = (os.getpid(), name)
+    index = _indexes.get(key)
+    if index is None:
+        with _build_lock:
+            index = _indexes.get(key)
+            if index is None:
+                index = _indexes[key] = _build(_registry[name])
+        return index
+    if _sync(index) is None:
+        _rebuild(key, name)
+    return index
+
+def warm_indexes(app):
+    """Builds every registered index on a background thread."""
+    def run():
+        with app.app_context():
+            for name in _registry:
+                try:
+                    get_index(name)
+                except Exception as e:
+                    app.logger.error(f"Error building search index {name}: {str(e)}")
+
+    threading.Thread(target=run, name='search-index-warm', daemon=True).start()
+
+
+# --- Text search ---
+
+_WORD = re.compile(r'\w+')
+
+def normalize(text):
+    """Lower-cased words with accents stripped, separated by single spaces."""
+    text = text or ''
+    if not text.isascii():
+        text = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(_WORD.findall(text.lower()))
+
+def trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+@register
+class PropertyTextIndex(SearchIndex):
+    """
+    Autocomplete over property titles, addresses and descriptions.
+
+    Title, street address, suburb and city match anywhere, like the ILIKE
+    search this replaces, through trigram postings. Descriptions are long,
+    so they match on word prefixes only. Matches are ranked by field
+    (title first) and by how closely they match (whole word, prefix,
+    substring).
+    """
+    name = 'property_text'
+    watched = (Property,)
+    fields = ('owner_id', 'title', 'description', 'street_address', 'suburb', 'city')
+
+    SUBSTRING_FIELDS = ('title', 'street_address', 'suburb', 'city')
+    FIELD_WEIGHTS = {'title': 8, 'street_address': 4, 'suburb': 4, 'city': 4, 'description': 1}
+    SCAN_LIMIT = 2000  # Candidate sets up to this size are checked directly
+    RANK_LIMIT = 2000  # At most this many matches are scored
+    _building = False
+
+    def clear(self):
+        self.docs = {}  # id -> (owner_id, {field: normalized text}, display dict)
+        self.by_owner = {}
+        self.grams = {}  # trigram -> ids, over SUBSTRING_FIELDS
+        self.words = {}  # word -> ids, over every field
+        self.title_words = {}
+        self.vocabulary = []  # Sorted keys of self.words, for prefix lookups
+
+    def load(self, connection, keys=None):
+        query = select(
+            Property.id, Property.owner_id, Property.title, Property.description,
+            Property.street_address, Property.suburb, Property.city
+        )
+        if keys is not None:
+            query = query.where(Property.id.in_(list(keys)))
+        return connection.execute(query)
+
+    def _post(self, postings, token, doc_id):
+        ids = postings.get(token)
+        if ids is None:
+            ids = postings[token] = set()
+            if postings is self.words and not self._building:
+                bisect.insort(self.vocabulary, token)
+        ids.add(doc_id)
+
+    def add(self, row):
+        texts = {field: normalize(getattr(row, field)) for field in self.FIELD_WEIGHTS}
+        display = {
+            'id': row.id,
+            'title': row.title,
+            'street_address': row.street_address,
+            'suburb': row.suburb,
+            'city': row.city
+        }
+        self.docs[row.id] = (row.owner_id, texts, display)
+        self.by_owner.setdefault(row.owner_id, set()).add(row.id)
+        for field in self.SUBSTRING_FIELDS:
+            for gram in trigrams(texts[field]):
+                self._post(self.grams, gram, row.id)
+        for word in set(' '.join(texts.values()).split()):
+            self._post(self.words, word, row.id)
+        for word in set(texts['title'].split()):
+            self._post(self.title_words, word, row.id)
+
+    def discard(self, key):
+        doc = self.docs.pop(key, None)
+        if doc is None:
+            return
+        owner_id, texts, _ = doc
+        self.by_owner.get(owner_id, set()).discard(key)
+        for field in self.SUBSTRING_FIELDS:
+            for gram in trigrams(texts[field]):
+                self.grams.get(gram, set()).discard(key)
+        # Emptied word sets stay in the vocabulary; they match nothing
+        for word in set(' '.join(texts.values()).split()):
+            self.words.get(word, set()).discard(key)
+        for word in texts['title'].split():
+            self.title_words.get(word, set()).discard(key)
+
+    def build(self, connection):
+        # Sorting the vocabulary once is cheaper than inserting word by word
+        with self.lock:
+            self._building = True
+            try:
+                super().build(connection)
+            finally:
+                self._building = False
+            self.vocabulary = sorted(self.words)
+
+    # Matching
+
+    def _prefix_matches(self, term, postings=None):
+        postings = self.words if postings is None else postings
+        start = bisect.bisect_left(self.vocabulary, term)
+        ids = set()
+        for word in self.vocabulary[start:]:
+            if not word.startswith(term):
+                break
+            ids |= postings.get(word, set())
+        return ids
+
+    def _matches_doc(self, term, texts):
+        if any(term in texts[field] for field in self.SUBSTRING_FIELDS):
+            return True
+        description = texts['description']
+        return description.startswith(term) or f' {term}' in description
+
+    def _term_matches(self, term, candidates):
+        if candidates is not None and len(candidates) <= self.SCAN_LIMIT:
+            return {doc_id for doc_id in candidates if self._matches_doc(term, self.docs[doc_id][1])}
+
+        matches = self._prefix_matches(term)
+        if len(term) >= 3:
+            postings = sorted((self.grams.get(gram, set()) for gram in trigrams(term)), key=len)
+            found = set(postings[0]).intersection(*postings[1:])
+            if candidates is not None:
+                found &= candidates
+            matches |= {
+                doc_id for doc_id in found
+                if any(term in self.docs[doc_id][1][field] for field in self.SUBSTRING_FIELDS)
+            }
+        return matches if candidates is None else matches & candidates
+
+    def _score(self, terms, texts):
+        score = 0
+        for term in terms:
+            best = 0
+            for field, weight in self.FIELD_WEIGHTS.items():
+                text = texts[field]
+                padded = f' {text} '
+                if f' {term} ' in padded:
+                    best = max(best, weight * 3)
+                elif f' {term}' in padded:
+                    best = max(best, weight * 2)
+                elif field != 'description' and term in text:
+                    best = max(best, weight)
+            score += best
+        return score
+
+    def search(self, query, owner_id=None, limit=10):
+        """[(score, display dict)] for the best matches of every word in query."""
+        terms = normalize(query).split()
+        if not terms:
+            return []
+
+        with self.lock:
+            candidates = None
+            if owner_id is not None:
+                candidates = self.by_owner.get(owner_id, set())
+            # Longest terms are usually the most selective
+            for term in sorted(terms, key=len, reverse=True):
+                candidates = self._term_matches(term, candidates)
+                if not candidates:
+                    return []
+
+            if len(candidates) > self.RANK_LIMIT:
+                # Too many to score: keep title word-prefix matches of the last (still typed) term
+                in_title = candidates & self._prefix_matches(terms[-1], self.title_words)
+                candidates = set(heapq.nsmallest(self.RANK_LIMIT, in_title or candidates))
+
+            ranked = heapq.nlargest(
+                limit,
+                ((self._score(terms, self.docs[doc_id][1]), -doc_id) for doc_id in candidates)
+            )
+            return [(score, self.docs[-negative_id][2]) for score, negative_id in ranked]
+
+def search_properties(query, owner_id=None, limit=10):
+    """Autocomplete matches for query, optionally limited to one owner's properties."""
+    return get_index(PropertyTextIndex.name).search(query, owner_id=owner_id, limit=limit)
+
+
+# --- Spatial search ---
+
+EARTH_RADIUS_KM = 6371.0088
+
+def haversine_km(lat1, lng1, lat2, lng2):
+    lat1, lng1, lat2, lng2 = map(math.radians, (lat1, lng1, lat2, lng2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lng2 - lng1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+def latest_listing_column(column):
+    """Correlated subquery for a column of the property's latest active listing."""
+    return (
+        select(column)
+        .where(Listing.property_id == Property.id, Listing.status == 1)
+        .order_by(Listing.date_created.desc(), Listing.id.desc())
+        .limit(1)
+        .correlate(Property)
+        .scalar_subquery()
+    )
+
+@register
+class PropertyGeoIndex(SearchIndex):
+    """
+    Listed properties bucketed into a fixed latitude/longitude grid.
+
+    Radius and viewport queries only visit the cells overlapping the
+    search area, then filter exactly. When the area covers more cells
+    than are occupied (far zoomed out), the occupied cells are visited
+    instead.
+    """
+    name = 'property_geo'
+    watched = (Property, Listing)
+    fields = (
+        'status', 'latitude', 'longitude', 'title', 'suburb', 'city',  # Property
+        'property_id', 'monthly_rental', 'date_created'  # Listing
+    )
+
+    CELL_DEGREES = 0.05  # About 5.5 km north-south
+
+    @classmethod
+    def keys_for(cls, obj):
+        return {obj.property_id} if isinstance(obj, Listing) else {obj.id}
+
+    def clear(self):
+        self.points = {}  # id -> (lat, lng, cell, display dict)
+        self.cells = {}  # (row, column) -> ids
+        self.geometry = {}  # (row, column) -> (centre lat, centre lng, radius km), cached
+
+    def load(self, connection, keys=None):
+        query = select(
+            Property.id, Property.latitude, Property.longitude, Property.title,
+            Property.suburb, Property.city,
+            latest_listing_column(Listing.id).label('listing_id'),
+            latest_listing_column(Listing.monthly_rental).label('monthly_rental')
+        ).where(
+            Property.status == 'listed',
+            Property.latitude.isnot(None),
+            Property.longitude.isnot(None)
+        )
+        if keys is not None:
+            query = query.where(Property.id.in_(list(keys)))
+        return connection.execute(query)
+
+    def _cell(self, lat, lng):
+        return (math.floor(lat / self.CELL_DEGREES), math.floor(lng / self.CELL_DEGREES))
+
+    def add(self, row):
+        cell = self._cell(row.latitude, row.longitude)
+        display = {
+            'id': row.id,
+            'title': row.title,
+            'suburb': row.suburb,
+            'city': row.city,
+            'latitude': row.latitude,
+            'longitude': row.longitude,
+            'listing_id': row.listing_id,
+            'monthly_rental': float(row.monthly_rental) if row.monthly_rental is not None else None
+        }
+        self.points[row.id] = (row.latitude, row.longitude, cell, display)
+        self.cells.setdefault(cell, set()).add(row.id)
+
+    def discard(self, key):
+        point = self.points.pop(key, None)
+        if point is None:
+            return
+        ids = self.cells.get(point[2])
+        if ids is not None:
+            ids.discard(key)
+            if not ids:
+                del self.cells[point[2]]
+
+    def _cells_in_box(self, south, west, north, east):
+        """
+        [(cell, fully inside)] for occupied cells overlapping the box; west > east
+        means the box crosses the antimeridian.
+        """
+        if west > east:
+            return self._cells_in_box(south, west, north, 180.0) + self._cells_in_box(south, -180.0, north, east)
+
+        size = self.CELL_DEGREES
+        row_min, column_min = self._cell(south, west)
+        row_max, column_max = self._cell(north, east)
+        if (row_max - row_min + 1) * (column_max - column_min + 1) > len(self.cells):
+            cells = [
+                cell for cell in self.cells
+                if row_min <= cell[0] <= row_max and column_min <= cell[1] <= column_max
+            ]
+        else:
+            cells = [
+                (row, column)
+                for row in range(row_min, row_max + 1)
+                for column in range(column_min, column_max + 1)
+                if (row, column) in self.cells
+            ]
+        return [
+            (cell, south <= cell[0] * size and (cell[0] + 1) * size <= north
+                   and west <= cell[1] * size and (cell[1] + 1) * size <= east)
+            for cell in cells
+        ]
+
+    def _cell_centre_and_radius(self, cell):
+        """A cell's centre and the distance from it to the cell's farthest corner."""
+        geometry = self.geometry.get(cell)
+        if geometry is None:
+            size = self.CELL_DEGREES
+            south, west = cell[0] * size, cell[1] * size
+            centre_lat, centre_lng = south + size / 2, west + size / 2
+            radius = max(
+                haversine_km(centre_lat, centre_lng, south, west),
+                haversine_km(centre_lat, centre_lng, south + size, west)
+            )
+            geometry = self.geometry[cell] = (centre_lat, centre_lng, radius)
+        return geometry
+
+    def _bounds(self, lat, lng, cell):
+        """(nearest, farthest) possible distance from a point to anything in a cell."""
+        centre_lat, centre_lng, radius = self._cell_centre_and_radius(cell)
+        distance = haversine_km(lat, lng, centre_lat, centre_lng)
+        return max(0.0, distance - radius), distance + radius
+
+    def _search(self, cells, lat, lng, limit, inside):
+        """
+        (nearest matches, total) over the given [(nearest possible distance,
+        cell, fully inside)], where inside(lat, lng, distance) filters points
+        of partly covered cells. Cells are visited nearest first, and stop
+        being opened once they cannot beat the limit-th match; only their
+        counts are still needed.
+        """
+        ordered = sorted(cells)
+        best = []  # Max-heap of (-distance, -id, display)
+        total = 0
+        for nearest, cell, full in ordered:
+            ids = self.cells[cell]
+            if full and len(best) >= limit and nearest > -best[0][0]:
+                total += len(ids)
+                continue
+            for doc_id in ids:
+                point_lat, point_lng, _, display = self.points[doc_id]
+                distance = haversine_km(lat, lng, point_lat, point_lng)
+                if not full and not inside(point_lat, point_lng, distance):
+                    continue
+                total += 1
+                entry = (-distance, -doc_id, display)
+                if len(best) < limit:
+                    heapq.heappush(best, entry)
+                elif entry[:2] > best[0][:2]:
+                    heapq.heapreplace(best, entry)
+        matches = sorted(best, key=lambda entry: (-entry[0], -entry[1]))
+        return [dict(display, distance_km=round(-negative, 3)) for negative, _, display in matches], total
+
+    def within_radius(self, lat, lng, radius_km, limit=100):
+        """(matches sorted by distance, total) for listed properties within radius_km of a point."""
+        lat_delta = math.degrees(radius_km / EARTH_RADIUS_KM)
+        cos_lat = math.cos(math.radians(lat))
+        lng_delta = 180.0 if cos_lat < 1e-6 else min(180.0, lat_delta / cos_lat)
+        south, north = max(-90.0, lat - lat_delta), min(90.0, lat + lat_delta)
+        if lng_delta >= 180.0:
+            west, east = -180.0, 180.0
+        else:
+            west, east = lng - lng_delta, lng + lng_delta
+            west = west + 360.0 if west < -180.0 else west
+            east = east - 360.0 if east > 180.0 else east
+
+        with self.lock:
+            cells = []
+            for cell, _ in self._cells_in_box(south, west, north, east):
+                nearest, farthest = self._bounds(lat, lng, cell)
+                if nearest <= radius_km:
+                    cells.append((nearest, cell, farthest <= radius_km))
+            return self._search(cells, lat, lng, limit, lambda _lat, _lng, distance: distance <= radius_km)
+
+    def within_box(self, south, west, north, east, limit=200, lat=None, lng=None):
+        """
+        (matches, total) for listed properties inside a map viewport,
+        nearest first to (lat, lng), defaulting to the viewport centre.
+        """
+        if lat is None or lng is None:
+            lat = (south + north) / 2
+            span = (east - west) % 360.0
+            lng = ((west + span / 2 + 180.0) % 360.0) - 180.0
+
+        def inside(point_lat, point_lng, _):
+            inside_lng = west <= point_lng <= east if west <= east else (point_lng >= west or point_lng <= east)
+            return south <= point_lat <= north and inside_lng
+
+        with self.lock:
+            cells = [
+                (self._bounds(lat, lng, cell)[0], cell, full)
+                for cell, full in self._cells_in_box(south, west, north, east)
+            ]
+            return self._search(cells, lat, lng, limit, inside)
+
+def properties_near(lat, lng, radius_km, limit=100):
+    return get_index(PropertyGeoIndex.name).within_radius(lat, lng, radius_km, limit=limit)
+
+def properties_in_view(south, west, north, east, limit=200, lat=None, lng=None):
+    return get_index(PropertyGeoIndex.name).within_box(south, west, north, east, limit=limit, lat=lat, lng=lng)
+
+
+# --- Faceted listing search ---
+
+AMENITIES = (
+    'swimming_pool', 'garden', 'air_conditioning', 'heating', 'gym', 'laundry',
+    'fireplace', 'balcony', 'pet_friendly', 'bbq_area', 'jacuzzi', 'tennis_court'
+)
+ROOM_COUNTS = ('bedroom', 'bathroom', 'garage')
+SORT_KEYS = ('rent', 'available_from', 'available_until', 'created')
+SORTS = {  # name -> (sort key, descending)
+    'newest': ('created', True),
+    'price_asc': ('rent', False),
+    'price_desc': ('rent', True),
+    'available': ('available_from', False),
+}
+
+def _bitmap(slots, size):
+    """An int with the given bit positions set, built in one pass."""
+    buffer = bytearray((size + 7) // 8)
+    for slot in slots:
+        buffer[slot >> 3] |= 1 << (slot & 7)
+    return int.from_bytes(buffer, 'little')
+
+@register
+class ListingFacetIndex(SearchIndex):
+    """
+    Tenant-facing search over listed properties and their latest active
+    listing.
+
+    Every listing holds a slot. Each amenity, and each bedroom, bathroom or
+    garage count, has a bitmap (a Python int) of the slots that have it, so
+    filters and facet counts are ANDs and popcounts. Rent and availability
+    dates are kept as sorted arrays. A range turns into a bitmap through
+    bisect, and the same arrays give the sort orders for pagination.
+    """
+    name = 'listing_facets'
+    watched = (Property, Listing)
+    fields = AMENITIES + ROOM_COUNTS + (
+        'status', 'title', 'suburb', 'city',  # Property
+        'property_id', 'monthly_rental', 'available_start_date', 'available_end_date', 'date_created'  # Listing
+    )
+
+    COUNT_CAP = 10  # Room counts above this share the top bucket
+    RANGE_BUCKETS = 64  # Per sort key, for turning ranges into bitmaps
+    _building = False
+
+    @classmethod
+    def keys_for(cls, obj):
+        return {obj.property_id} if isinstance(obj, Listing) else {obj.id}
+
+    def clear(self):
+        self.slots = {}  # property id -> slot
+        self.free = []
+        self.entries = []  # slot -> public dict, or None when free
+        self.sort_keys = []  # slot -> values of SORT_KEYS
+        self.live = 0
+        self.features = {name: 0 for name in AMENITIES}
+        self.counts = {name: {} for name in ROOM_COUNTS}  # name -> {count: bitmap}
+        self.sorted = [[] for _ in SORT_KEYS]  # Per sort key, (key, slot) pairs in ascending order
+        # Per sort key, bucket i holds keys in [bounds[i], bounds[i + 1]) (the first
+        # bucket also anything lower) with one bitmap per bucket. Bounds are set at build.
+        self.bounds = [[] for _ in SORT_KEYS]
+        self.buckets = [[0] for _ in SORT_KEYS]
+
+    def load(self, connection, keys=None):
+        latest = select(
+            Listing.id, Listing.property_id, Listing.monthly_rental,
+            Listing.available_start_date, Listing.available_end_date, Listing.date_created,
+            func.row_number().over(
+                partition_by=Listing.property_id,
+                order_by=(Listing.date_created.desc(), Listing.id.desc())
+            ).label('position')
+        ).where(Listing.status == 1).subquery()
+
+        query = select(
+            Property.id, Property.title, Property.suburb, Property.city,
+            *[getattr(Property, name) for name in AMENITIES + ROOM_COUNTS],
+            latest.c.id.label('listing_id'),
+            latest.c.monthly_rental,
+            latest.c.available_start_date,
+            latest.c.available_end_date,
+            latest.c.date_created
+        ).join(
+            latest, and_(latest.c.property_id == Property.id, latest.c.position == 1)
+        ).where(Property.status == 'listed')
+        if keys is not None:
+            query = query.where(Property.id.in_(list(keys)))
+        return connection.execute(query)
+
+    def _room_count(self, row, name):
+        return min(getattr(row, name) or 0, self.COUNT_CAP)
+
+    def _store(self, row):
+        """Claims a slot for row and fills in its entry; returns the slot."""
+        slot = self.free.pop() if self.free else len(self.entries)
+        if slot == len(self.entries):
+            self.entries.append(None)
+            self.sort_keys.append(None)
+        self.slots[row.id] = slot
+        self.entries[slot] = {
+            'property_id': row.id,
+            'listing_id': row.listing_id,
+            'title': row.title,
+            'suburb': row.suburb,
+            'city': row.city,
+            'monthly_rental': float(row.monthly_rental),
+            'available_start_date': row.available_start_date.isoformat(),
+            'available_end_date': row.available_end_date.isoformat() if row.available_end_date else None,
+            'amenities': [name for name in AMENITIES if getattr(row, name)],
+            **{name: getattr(row, name) for name in ROOM_COUNTS}
+        }
+        self.sort_keys[slot] = (
+            float(row.monthly_rental),
+            row.available_start_date,
+            row.available_end_date or date.max,
+            row.date_created or datetime.min
+        )
+        for position, key in enumerate(self.sort_keys[slot]):
+            if self._building:
+                self.sorted[position].append((key, slot))
+            else:
+                bisect.insort(self.sorted[position], (key, slot))
+        return slot
+
+    def _bucket(self, position, key):
+        return max(0, bisect.bisect_right(self.bounds[position], key) - 1)
+
+    def add(self, row):
+        slot = self._store(row)
+        bit = 1 << slot
+        self.live |= bit
+        for position, key in enumerate(self.sort_keys[slot]):
+            self.buckets[position][self._bucket(position, key)] |= bit
+        for name in AMENITIES:
+            if getattr(row, name):
+                self.features[name] |= bit
+        for name in ROOM_COUNTS:
+            buckets = self.counts[name]
+            value = self._room_count(row, name)
+            buckets[value] = buckets.get(value, 0) | bit
+
+    def build(self, connection):
+        # Setting bits one at a time copies the whole int each time; collect slots first
+        with self.lock:
+            self.clear()
+            live, features = [], {name: [] for name in AMENITIES}
+            counts = {name: {} for name in ROOM_COUNTS}
+            self._building = True
+            try:
+                for row in self.load(connection):
+                    slot = self._store(row)
+                    live.append(slot)
+                    for name in AMENITIES:
+                        if getattr(row, name):
+                            features[name].append(slot)
+                    for name in ROOM_COUNTS:
+                        counts[name].setdefault(self._room_count(row, name), []).append(slot)
+            finally:
+                self._building = False
+
+            size = len(self.entries)
+            step = max(1, size // self.RANGE_BUCKETS)
+            for position, pairs in enumerate(self.sorted):
+                pairs.sort()
+                bounds = self.bounds[position] = sorted({pairs[i][0] for i in range(0, len(pairs), step)})
+                bucket_slots = [[] for _ in range(max(1, len(bounds)))]
+                for key, slot in pairs:
+                    bucket_slots[self._bucket(position, key)].append(slot)
+                self.buckets[position] = [_bitmap(slots, size) for slots in bucket_slots]
+            self.live = _bitmap(live, size)
+            self.features = {name: _bitmap(slots, size) for name, slots in features.items()}
+            self.counts = {
+                name: {value: _bitmap(slots, size) for value, slots in buckets.items()}
+                for name, buckets in counts.items()
+            }
+            self.built_at = time.monotonic()
+
+    def discard(self, key):
+        slot = self.slots.pop(key, None)
+        if slot is None:
+            return
+        keep = ~(1 << slot)
+        self.live &= keep
+        for name in AMENITIES:
+            self.features[name] &= keep
+        for buckets in self.counts.values():
+            for value in buckets:
+                buckets[value] &= keep
+        for position, key in enumerate(self.sort_keys[slot]):
+            pairs = self.sorted[position]
+            del pairs[bisect.bisect_left(pairs, (key, slot))]
+            self.buckets[position][self._bucket(position, key)] &= keep
+        self.entries[slot] = None
+        self.sort_keys[slot] = None
+        self.free.append(slot)
+
+    # Querying
+
+    def _exact(self, pairs, low, high, high_inclusive=True):
+        """Bitmap of slots in pairs with low <= key <= high (or < high); None is unbounded."""
+        # Slots are non-negative ints, so (key, -1) sorts before every pair with that key
+        start = 0 if low is None else bisect.bisect_left(pairs, (low, -1))
+        if high is None:
+            end = len(pairs)
+        else:
+            end = bisect.bisect_left(pairs, (high, len(self.entries) if high_inclusive else -1))
+        return _bitmap((slot for _, slot in pairs[start:end]), len(self.entries))
+
+    def _range(self, sort_key, low=None, high=None):
+        """
+        Bitmap of slots whose sort key lies in [low, high]: whole buckets
+        are ORed in, and only the buckets at either end are checked key by key.
+        """
+        position = SORT_KEYS.index(sort_key)
+        pairs, bounds, buckets = self.sorted[position], self.bounds[position], self.buckets[position]
+        mask = 0
+        for i, bitmap in enumerate(buckets):
+            lower = bounds[i] if i and i < len(bounds) else None  # None: unbounded
+            upper = bounds[i + 1] if i + 1 < len(bounds) else None
+            if (low is not None and upper is not None and upper <= low) or \
+                    (high is not None and lower is not None and lower > high):
+                continue  # Disjoint
+            if (low is None or (lower is not None and lower >= low)) and \
+                    (high is None or (upper is not None and upper <= high)):
+                mask |= bitmap
+                continue
+            # Partly covered: the overlap of [lower, upper) and [low, high]
+            start = lower if low is None or (lower is not None and lower > low) else low
+            if upper is not None and (high is None or upper <= high):
+                mask |= self._exact(pairs, start, upper, high_inclusive=False)
+            else:
+                mask |= self._exact(pairs, start, high)
+        return mask
+
+    def _at_least(self, name, minimum):
+        mask = 0
+        for value, bitmap in self.counts[name].items():
+            if value >= min(minimum, self.COUNT_CAP):
+                mask |= bitmap
+        return mask
+
+    def _page(self, result, sort, offset, limit):
+        """Entries of the result bitmap in sort order, skipping offset."""
+        bits = bin(result)[:1:-1]  # One character per slot, lowest slot first
+        sort_key, descending = SORTS[sort]
+        pairs = self.sorted[SORT_KEYS.index(sort_key)]
+
+        page = []
+        for _, slot in (reversed(pairs) if descending else pairs):
+            if slot < len(bits) and bits[slot] == '1':
+                if offset:
+                    offset -= 1
+                    continue
+                page.append(self.entries[slot])
+                if len(page) == limit:
+                    break
+        return page
+
+    def search(self, amenities=(), minimums=None, min_rent=None, max_rent=None,
+               available_by=None, sort='newest', page=1, per_page=20):
+        """
+        Listings with every amenity, at least the given room counts
+        ({'bedroom': 3}), rent within [min_rent, max_rent] and available
+        on available_by. Returns a page of them with the total and facet
+        counts. Room count facets ignore their own minimum, so the other
+        choices stay visible.
+        """
+        minimums = {name: value for name, value in (minimums or {}).items() if value}
+        with self.lock:
+            base = self.live
+            for name in amenities:
+                base &= self.features[name]
+            if min_rent is not None or max_rent is not None:
+                base &= self._range('rent', min_rent, max_rent)
+            if available_by is not None:
+                base &= self._range('available_from', high=available_by) & self._range('available_until', low=available_by)
+
+            room_masks = {name: self._at_least(name, value) for name, value in minimums.items()}
+            result = base
+            for mask in room_masks.values():
+                result &= mask
+
+            facets = {'amenities': {name: (result & bitmap).bit_count() for name, bitmap in self.features.items()}}
+            for name in ROOM_COUNTS:
+                others = base
+                for other, mask in room_masks.items():
+                    if other != name:
+                        others &= mask
+                facets[name] = {
+                    value: (others & bitmap).bit_count()
+                    for value, bitmap in sorted(self.counts[name].items())
+                    if others & bitmap
+                }
+
+            return {
+                'total': result.bit_count(),
+                'page': page,
+                'per_page': per_page,
+                'results': self._page(result, sort, (page - 1) * per_page, per_page),
+                'facets': facets
+            }
+
+def search_listings(**filters):
+    return get_index(ListingFacetIndex.name).search(**filters)
+
+
+# --- Keeping indexes current ---
+
+def _relevant(index_cls, session, obj):
+    if obj in session.new or obj in session.deleted or index_cls.fields is None:
+        return True
+    state = inspect(obj)
+    return any(state.attrs[name].history.has_changes() for name in index_cls.fields if name in state.attrs)
+
+@event.listens_for(Session, 'after_flush')
+def collect_search_changes(session, flush_context):
+    """Notes the index keys touched by a flush (new rows have their ids by now)."""
+    changed = session.info.setdefault('search_changes', {})
+    for obj in list(session.new) + list(session.dirty) + list(session.deleted):
+        for name, index_cls in _registry.items():
+            if isinstance(obj, index_cls.watched) and _relevant(index_cls, session, obj):
+                keys = {key for key in index_cls.keys_for(obj) if key is not None}
+                if keys:
+                    changed.setdefault(name, set()).update(keys)
+    if not changed:
+        session.info.pop('search_changes')
+
+@event.listens_for(Session, 'after_commit')
+def apply_search_changes(session):
+    """Applies committed changes to this process's indexes and logs them for the others."""
+    changed = session.info.pop('search_changes', None)
+    if not changed:
+        return
+    pid = os.getpid()
+    for name, keys in changed.items():
+        try:
+            seq = _publish(name, keys)
+            with _lock:
+                # A copy being rebuilt may have loaded these rows before the commit
+                if (pid, name) in _rebuilding:
+                    _rebuilding[(pid, name)].update(keys)
+                index = _indexes.get((pid, name))
+            if index is None:
+                continue
+            # The session cannot emit SQL after commit
+            with db.engine.connect() as connection:
+                index.refresh(connection, keys)
+            if seq is not None and seq == index.seq + 1:
+                index.seq = seq
+        except Exception as e:
+            current_app.logger.error(f"Error updating search index {name}: {str(e)}")
+
+@event.listens_for(Session, 'after_rollback')
+def discard_search_changes(session):
+    session.info.pop('search_changes', None)
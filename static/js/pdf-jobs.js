@@ -0,0 +1,82 @@
+// static/js/pdf-jobs.js
+// Links marked data-pdf-job ask pdf_renderer for a render job instead of
+// waiting on the file: the job is polled until done, then downloaded. When
+// the server answers with the PDF itself (already cached, or it does not
+// hand out jobs), or the job cannot be polled, the plain link is followed.
+
+const PDF_JOB_POLL_MS = 1000;
+
+function followPdfLink(link) {
+    window.location.href = link.href;
+}
+
+function setPdfLinkBusy(link, busy) {
+    if (busy) {
+        link.dataset.label = link.innerHTML;
+        link.innerHTML = 'Preparing PDF&hellip;';
+        link.classList.add('disabled');
+        link.setAttribute('aria-disabled', 'true');
+    } else {
+        link.innerHTML = link.dataset.label;
+        link.classList.remove('disabled');
+        link.removeAttribute('aria-disabled');
+    }
+}
+
+function pollPdfJob(link, statusUrl) {
+    fetch(statusUrl, { headers: { 'Accept': 'application/json' }, credentials: 'same-origin' })
+        .then(response => response.json().then(data => ({ ok: response.ok, data })))
+        .then(({ ok, data }) => {
+            if (!ok) {
+                throw new Error(data.error || 'PDF job not found');
+            }
+            if (data.status === 'done') {
+                setPdfLinkBusy(link, false);
+                window.location.href = data.download_url;
+            } else if (data.status === 'failed') {
+                setPdfLinkBusy(link, false);
+                alert('The PDF could not be generated. Please try again.');
+            } else {
+                setTimeout(() => pollPdfJob(link, statusUrl), PDF_JOB_POLL_MS);
+            }
+        })
+        .catch(error => {
+            console.error('PDF job:', error);
+            setPdfLinkBusy(link, false);
+            followPdfLink(link);
+        });
+}
+
+function requestPdfJob(link) {
+    const url = new URL(link.href, window.location.href);
+    url.searchParams.set('async', '1');
+
+    setPdfLinkBusy(link, true);
+    fetch(url, { headers: { 'Accept': 'application/json' }, credentials: 'same-origin' })
+        .then(response => {
+            const type = response.headers.get('Content-Type') || '';
+            if (!type.includes('application/json')) {
+                // The PDF itself; following the link serves it from the disk cache
+                setPdfLinkBusy(link, false);
+                followPdfLink(link);
+                return;
+            }
+            return response.json().then(job => pollPdfJob(link, job.status_url));
+        })
+        .catch(error => {
+            console.error('PDF job:', error);
+            setPdfLinkBusy(link, false);
+            followPdfLink(link);
+        });
+}
+
+document.addEventListener('click', event => {
+    const link = event.target.closest('a[data-pdf-job]');
+    if (!link || event.ctrlKey || event.metaKey || event.shiftKey) {
+        return;
+    }
+    event.preventDefault();
+    if (link.getAttribute('aria-disabled') !== 'true') {
+        requestPdfJob(link);
+    }
+});
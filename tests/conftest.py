@@ -0,0 +1,6 @@
+# tests/conftest.py
+import os
+import sys
+
+# Modules live at the project root, as in wsgi.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,57 @@
+# tests/test_account_rules.py
+import pytest
+from account_rules import LEDGER_ACCOUNTS, AccountMatcher, words
+
+RULE_CONFIDENCE = 0.75  # Default CLASSIFICATION_RULE_CONFIDENCE
+
+
+@pytest.fixture(scope='module')
+def matcher():
+    return AccountMatcher.from_constants()
+
+
+def test_words_fold_plurals_and_drop_noise():
+    assert words('Levies & HOA fees 03/2024') == ['levy', 'hoa', 'fee']
+
+@pytest.mark.parametrize('description, account', [
+    ('HOA Fees', 'Home Owners Association Fees'),
+    ('Water & Sewer', 'Utilities'),
+    ('Garden service fee', 'Landscaping'),
+    ('Property Insurance', 'Property Insurance'),
+    ('Monthly levy 03/2024', 'Levies'),
+    ('Bank service fee', 'Bank Fees'),
+])
+def test_confident_matches(matcher, description, account):
+    matched, confidence = matcher.match(description)
+    assert matched == account
+    assert confidence >= RULE_CONFIDENCE
+
+def test_rival_accounts_lower_confidence(matcher):
+    account, confidence = matcher.match('Garden service and pest control')
+    assert account in ('Landscaping', 'Pest Control')
+    assert confidence < RULE_CONFIDENCE
+
+@pytest.mark.parametrize('description', ['', '12345', 'Zzz unknown', None])
+def test_no_match(matcher, description):
+    assert matcher.match(description) == (None, 0.0)
+
+def test_only_ledger_accounts_are_returned(matcher):
+    for description in ('Mortgage interest', 'Rates', 'Security', 'Association Fees', 'Electricity', 'Cleaning'):
+        account, _ = matcher.match(description)
+        assert account in LEDGER_ACCOUNTS
+
+def test_phrase_inside_a_longer_match_is_not_a_rival():
+    matcher = AccountMatcher([
+        ('insurance', 'Insurance', 1.0),
+        ('property insurance', 'Property Insurance', 1.0),
+    ])
+    account, confidence = matcher.match('Property insurance premium')
+    assert account == 'Property Insurance'
+    assert confidence == pytest.approx(0.867, abs=0.001)
+
+def test_heaviest_entry_for_a_phrase_wins():
+    matcher = AccountMatcher([
+        ('water', 'Utilities', 0.9),
+        ('water', 'Maintenance and Repairs', 0.5),
+    ])
+    assert matcher.match('Water')[0] == 'Utilities'
@@ -0,0 +1,59 @@
+# tests/test_ledger.py
+import pytest
+from flask import Flask
+from extensions import cache, db
+from ledger import ledger_version
+from models import Property
+
+
+@pytest.fixture
+def app():
+    """A Flask app over an in-memory SQLite database"""
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', CACHE_TYPE='SimpleCache')
+    db.init_app(app)
+    cache.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+def make_property(**values):
+    columns = dict(
+        owner_id=1, title='Harbour View Loft', description='Loft above the marina', type='apartment',
+        sqm=80, bedroom=2, bathroom=1, garage=1, kitchen=1, max_occupants=4,
+        street_address='1 Dock Road', suburb='Waterfront', city='Cape Town', rental_income_tax_rate=0.2
+    )
+    columns.update(values)
+    return Property(**columns)
+
+def test_tax_rate_changes_move_the_owners_ledger_version(app):
+    prop = make_property()
+    db.session.add(prop)
+    db.session.commit()
+    before = ledger_version(1), ledger_version(2)
+
+    prop.title = 'Seaside Cottage'
+    db.session.commit()
+    assert (ledger_version(1), ledger_version(2)) == before
+
+    prop.rental_income_tax_rate = 0.25
+    db.session.commit()
+    assert ledger_version(1) != before[0]
+    assert ledger_version(2) == before[1]
+
+def test_moving_or_deleting_a_property_moves_the_ledger_versions(app):
+    prop = make_property()
+    db.session.add(prop)
+    db.session.commit()
+
+    first, second = ledger_version(1), ledger_version(2)
+    prop.owner_id = 2
+    db.session.commit()
+    assert ledger_version(1) != first and ledger_version(2) != second
+
+    second = ledger_version(2)
+    db.session.delete(prop)
+    db.session.commit()
+    assert ledger_version(2) != second
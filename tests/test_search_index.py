@@ -0,0 +1,259 @@
+# tests/test_search_index.py
+import random
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+from extensions import cache, db
+from models import Listing, Property
+from search_index import (
+    AMENITIES, ROOM_COUNTS, SORT_KEYS, SORTS, ListingFacetIndex, PropertyGeoIndex, PropertyTextIndex, _indexes,
+    get_index, properties_near, search_listings, search_properties
+)
+
+
+class FakeListingIndex(ListingFacetIndex):
+    """ListingFacetIndex fed from a list of rows instead of the database"""
+
+    def __init__(self, rows):
+        super().__init__()
+        self.rows = {row.id: row for row in rows}
+
+    def load(self, connection, keys=None):
+        return [row for key, row in self.rows.items() if keys is None or key in keys]
+
+
+def make_row(rng, property_id):
+    start = date(2024, 1, 1) + timedelta(days=rng.randint(0, 365))
+    return SimpleNamespace(
+        id=property_id,
+        title=f'Property {property_id}',
+        suburb='Suburb',
+        city='City',
+        listing_id=property_id * 10,
+        monthly_rental=rng.choice([rng.randint(10, 60) * 500, 10000]),  # Repeated rents exercise ties
+        available_start_date=start,
+        available_end_date=rng.choice([None, start + timedelta(days=rng.randint(30, 400))]),
+        date_created=datetime(2023, 1, 1) + timedelta(hours=rng.randint(0, 20000)),
+        **{name: rng.random() < 0.4 for name in AMENITIES},
+        **{name: rng.choice([None, 0, 1, 2, 3, 4, 12]) for name in ROOM_COUNTS}
+    )
+
+def sort_values(row):
+    """A row's keys in SORT_KEYS order, as the index stores them"""
+    return (float(row.monthly_rental), row.available_start_date, row.available_end_date or date.max, row.date_created)
+
+def ids_in(index, bitmap):
+    return {entry['property_id'] for slot, entry in enumerate(index.entries) if entry and bitmap >> slot & 1}
+
+def brute_range(rows, sort_key, low, high):
+    position = SORT_KEYS.index(sort_key)
+    return {
+        row.id for row in rows
+        if (low is None or sort_values(row)[position] >= low) and (high is None or sort_values(row)[position] <= high)
+    }
+
+def brute_search(rows, amenities=(), minimums=None, min_rent=None, max_rent=None, available_by=None):
+    cap = ListingFacetIndex.COUNT_CAP
+    matched = []
+    for row in rows:
+        rent, available_from, available_until, _ = sort_values(row)
+        if not all(getattr(row, name) for name in amenities):
+            continue
+        if any(min(getattr(row, name) or 0, cap) < min(value, cap) for name, value in (minimums or {}).items() if value):
+            continue
+        if (min_rent is not None and rent < min_rent) or (max_rent is not None and rent > max_rent):
+            continue
+        if available_by is not None and not available_from <= available_by <= available_until:
+            continue
+        matched.append(row)
+    return matched
+
+def random_bounds(rng, rows, position):
+    """A (low, high) pair drawn from stored keys, in between them, or unbounded"""
+    values = [sort_values(row)[position] for row in rows]
+
+    def pick():
+        value = rng.choice(values)
+        if rng.random() < 0.3:
+            if isinstance(value, float):
+                value += rng.choice((-0.5, 0.5))
+            elif isinstance(value, datetime):
+                value += timedelta(minutes=rng.choice((-30, 30)))
+            elif value != date.max:
+                value += timedelta(days=rng.choice((-1, 1)))
+        return value
+
+    low = None if rng.random() < 0.2 else pick()
+    high = None if rng.random() < 0.2 else pick()
+    return low, high
+
+def random_filters(rng):
+    filters = {'amenities': rng.sample(AMENITIES, rng.choice((0, 0, 1, 2)))}
+    if rng.random() < 0.5:
+        filters['minimums'] = {name: rng.choice((0, 1, 2, 3, 15)) for name in rng.sample(ROOM_COUNTS, 2)}
+    if rng.random() < 0.5:
+        filters['min_rent'] = rng.choice((None, 5000.0, 10000.0, 12250.0))
+        filters['max_rent'] = rng.choice((None, 10000.0, 20000.0, 30000.0))
+    if rng.random() < 0.4:
+        filters['available_by'] = date(2024, 1, 1) + timedelta(days=rng.randint(0, 500))
+    return filters
+
+
+@pytest.fixture
+def index_and_rows():
+    rng = random.Random(7)
+    rows = [make_row(rng, property_id) for property_id in range(1, 401)]
+    index = FakeListingIndex(rows)
+    index.build(None)
+    return index, rows, rng
+
+def churn(index, rows, rng):
+    """Discards a third of the listings and adds new ones, as after-commit refreshes do"""
+    gone = set(rng.sample([row.id for row in rows], len(rows) // 3))
+    for key in gone:
+        index.discard(key)
+    index.discard(10 ** 6)  # Unknown keys are ignored
+    added = [make_row(rng, property_id) for property_id in range(1001, 1151)]
+    for row in added:
+        index.add(row)
+    return [row for row in rows if row.id not in gone] + added
+
+
+def test_range_matches_brute_force(index_and_rows):
+    index, rows, rng = index_and_rows
+    for sort_key in SORT_KEYS:
+        position = SORT_KEYS.index(sort_key)
+        for _ in range(200):
+            low, high = random_bounds(rng, rows, position)
+            assert ids_in(index, index._range(sort_key, low, high)) == brute_range(rows, sort_key, low, high)
+
+def test_range_after_discards_and_adds(index_and_rows):
+    index, rows, rng = index_and_rows
+    rows = churn(index, rows, rng)
+    assert ids_in(index, index.live) == {row.id for row in rows}
+    for sort_key in SORT_KEYS:
+        position = SORT_KEYS.index(sort_key)
+        for _ in range(200):
+            low, high = random_bounds(rng, rows, position)
+            assert ids_in(index, index._range(sort_key, low, high)) == brute_range(rows, sort_key, low, high)
+
+@pytest.mark.parametrize('churned', [False, True])
+def test_search_matches_brute_force(index_and_rows, churned):
+    index, rows, rng = index_and_rows
+    if churned:
+        rows = churn(index, rows, rng)
+    by_id = {row.id: row for row in rows}
+
+    for _ in range(100):
+        filters = random_filters(rng)
+        sort = rng.choice(list(SORTS))
+        expected = brute_search(rows, **filters)
+
+        first = index.search(sort=sort, per_page=7, **filters)
+        assert first['total'] == len(expected)
+        assert first['facets']['amenities'] == {
+            name: sum(1 for row in expected if getattr(row, name)) for name in AMENITIES
+        }
+
+        # Every match exactly once across the pages, in sort order
+        results, page = [], 1
+        while True:
+            found = index.search(sort=sort, page=page, per_page=7, **filters)['results']
+            if not found:
+                break
+            results.extend(found)
+            page += 1
+        assert sorted(entry['property_id'] for entry in results) == sorted(row.id for row in expected)
+
+        sort_key, descending = SORTS[sort]
+        position = SORT_KEYS.index(sort_key)
+        keys = [sort_values(by_id[entry['property_id']])[position] for entry in results]
+        assert keys == sorted(keys, reverse=descending)
+
+def test_room_count_facets_ignore_their_own_minimum(index_and_rows):
+    index, rows, _ = index_and_rows
+    result = index.search(minimums={'bedroom': 3})
+    cap = ListingFacetIndex.COUNT_CAP
+    expected = {}
+    for row in rows:
+        value = min(row.bedroom or 0, cap)
+        expected[value] = expected.get(value, 0) + 1
+    assert result['facets']['bedroom'] == dict(sorted(expected.items()))
+    assert result['total'] == sum(count for value, count in expected.items() if value >= 3)
+
+
+# --- Session events ---
+
+@pytest.fixture
+def app():
+    """A Flask app over an in-memory SQLite database, with no indexes built yet"""
+    app = Flask(__name__)
+    app.config.update(SQLALCHEMY_DATABASE_URI='sqlite://', CACHE_TYPE='SimpleCache')
+    db.init_app(app)
+    cache.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+    _indexes.clear()
+
+def make_property(**values):
+    columns = dict(
+        owner_id=1, title='Harbour View Loft', description='Loft above the marina', type='apartment',
+        sqm=80, bedroom=2, bathroom=1, garage=1, kitchen=1, max_occupants=4,
+        street_address='1 Dock Road', suburb='Waterfront', city='Cape Town',
+        latitude=-33.905, longitude=18.42, status='listed'
+    )
+    columns.update(values)
+    return Property(**columns)
+
+def matched_ids(query):
+    return [match['id'] for _, match in search_properties(query, owner_id=1)]
+
+def test_property_commits_update_the_text_index(app):
+    get_index(PropertyTextIndex.name)
+
+    prop = make_property()
+    db.session.add(prop)
+    db.session.commit()
+    assert matched_ids('harbour') == [prop.id]
+
+    prop.title = 'Seaside Cottage'
+    db.session.commit()
+    assert matched_ids('harbour') == []
+    assert matched_ids('seaside') == [prop.id]
+
+    db.session.delete(prop)
+    db.session.commit()
+    assert matched_ids('seaside') == []
+
+def test_listing_commits_update_the_listing_indexes(app):
+    get_index(ListingFacetIndex.name)
+    get_index(PropertyGeoIndex.name)
+
+    prop = make_property()
+    db.session.add(prop)
+    db.session.commit()
+    assert search_listings()['total'] == 0
+    matches, _ = properties_near(-33.905, 18.42, 5)
+    assert [match['listing_id'] for match in matches] == [None]
+
+    listing = Listing(
+        property_id=prop.id, deposit=12000, listing_type='long_term', monthly_rental=12000,
+        available_start_date=date(2024, 1, 1), status=1, admin_fee=0
+    )
+    db.session.add(listing)
+    db.session.commit()
+    result = search_listings()
+    assert result['total'] == 1
+    assert result['results'][0]['listing_id'] == listing.id
+    matches, _ = properties_near(-33.905, 18.42, 5)
+    assert [match['listing_id'] for match in matches] == [listing.id]
+
+    listing.status = 0
+    db.session.commit()
+    assert search_listings()['total'] == 0
+    matches, _ = properties_near(-33.905, 18.42, 5)
+    assert [match['listing_id'] for match in matches] == [None]
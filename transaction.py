@@ -1,15 +1,21 @@
 import os
 import re
+import secrets
 from venv import logger
 from flask import Blueprint, g, render_template, request, redirect, url_for, flash, jsonify, current_app
 from flask_login import login_required, current_user
-from datetime import datetime
+from datetime import date, datetime, timedelta
 from models import db, Transaction, Property, Owner
 from forms import TransactionForm
 from app_constants import ACCOUNT_CLASSIFICATIONS, GAAPClassifier, ACCOUNTS
 from werkzeug.utils import secure_filename
-from openai import classify_transaction_with_azure
-from utils import allowed_file
+from classifier import UNCATEGORIZED, classify_description, classify_descriptions, flush_hit_counts, record_correction
+from utils import allowed_file, stream_csv
+from sqlalchemy import false, select
+from ledger import ledger_count
+from pagination import keyset_paginate
+from jobs import get_job, report_progress, submit_job, wait_for_job
+from extensions import workers_share_cache
 
 # Create a blueprint for accounting routes if not already existing
 transaction_routes = Blueprint('transaction_routes', __name__, url_prefix='/transactions')
@@ -76,8 +82,6 @@ def transactions():
     # Create form instance
     form = TransactionForm()
     
-    # Get page number from request args, default to 1
-    page = request.args.get('page', 1, type=int)
     per_page = 20  # Number of items per page
 
     # Get owner information
@@ -91,8 +95,8 @@ def transactions():
     date_to = request.args.get('date_to')
     account_filter = request.args.get('account')
 
-    # Build the query
-    query = Transaction.query
+    # Build the query over the owner's own ledger
+    query = Transaction.query.filter(Transaction.owner_id == owner.id if owner else false())
 
     # Apply date filters if provided
     if date_from:
@@ -104,15 +108,27 @@ def transactions():
     if account_filter:
         query = query.filter(Transaction.account == account_filter)
 
-    # Get paginated transactions
-    transactions_pagination = query.order_by(
-        Transaction.transaction_date.desc()
-    ).paginate(
-        page=page, 
-        per_page=per_page,
-        error_out=False
+    # Seek to the page from its cursor, so deep pages cost the same as the first
+    transactions_page = keyset_paginate(
+        query,
+        (Transaction.transaction_date, Transaction.id),
+        after=request.args.get('after'),
+        before=request.args.get('before'),
+        per_page=per_page
     )
 
+    # Approximate total from the ledger rollup rather than a COUNT(*) over the ledger
+    if owner:
+        start_date = request.args.get('date_from', type=date.fromisoformat)
+        end_date = request.args.get('date_to', type=date.fromisoformat)
+        filters = {'account': account_filter} if account_filter else {}
+        transactions_page.total = ledger_count(
+            start_date,
+            end_date + timedelta(days=1) if end_date else None,
+            owner_id=owner.id,
+            **filters
+        )
+
     # Get account classifications
     account_classifications = get_account_classifications()
 
@@ -120,16 +136,14 @@ def transactions():
     is_dict = isinstance(account_classifications, dict)
 
     # Check if there are no transactions
-    no_transactions = len(transactions_pagination.items) == 0
+    no_transactions = len(transactions_page.items) == 0
 
     return render_template(
         'transaction/transactions.html',
         form=form,
-        transactions=transactions_pagination.items,
+        transactions=transactions_page.items,
         properties=properties,
-        page=page,
-        total_pages=transactions_pagination.pages,
-        total=transactions_pagination.total,
+        pagination=transactions_page,
         account_classifications=account_classifications,
         owner=owner,
         current_date=datetime.utcnow(),
@@ -141,6 +155,70 @@ def transactions():
     )
 
 
+@transaction_routes.route('/export', methods=['GET'])
+@login_required
+def export_transactions():
+    """
+    Streams the owner's transaction ledger as CSV, optionally filtered by
+    date range, account and property. Rows are fetched from a server-side
+    cursor in batches, so long ledgers export in constant memory.
+    """
+    owner = Owner.query.filter_by(user_id=current_user.id).first()
+    if not owner:
+        flash('Owner not found', 'error')
+        return redirect(url_for('transaction_routes.transactions'))
+
+    # Get filter parameters from the request
+    date_from = request.args.get('date_from')
+    date_to = request.args.get('date_to')
+    account_filter = request.args.get('account')
+    property_filter = request.args.get('property_id', type=int)
+
+    query = select(
+        Transaction.transaction_date,
+        Transaction.reference_number,
+        Transaction.description,
+        Property.title,
+        Transaction.main_category,
+        Transaction.sub_category,
+        Transaction.account,
+        Transaction.amount,
+        Transaction.is_reconciled
+    ).outerjoin(
+        Property, Transaction.property_id == Property.id
+    ).where(
+        Transaction.owner_id == owner.id
+    )
+
+    # Apply filters if provided
+    if date_from:
+        query = query.where(Transaction.transaction_date >= date_from)
+    if date_to:
+        query = query.where(Transaction.transaction_date <= date_to)
+    if account_filter:
+        query = query.where(Transaction.account == account_filter)
+    if property_filter:
+        query = query.where(Transaction.property_id == property_filter)
+
+    query = query.order_by(Transaction.transaction_date, Transaction.id).execution_options(yield_per=1000)
+
+    def rows():
+        yield ['Date', 'Reference', 'Description', 'Property', 'Main Category', 'Sub Category', 'Account', 'Amount', 'Reconciled']
+        for row in db.session.execute(query):
+            yield [
+                row.transaction_date.isoformat(),
+                row.reference_number or '',
+                row.description or '',
+                row.title or '',
+                row.main_category,
+                row.sub_category or '',
+                row.account,
+                row.amount,
+                'Yes' if row.is_reconciled else 'No'
+            ]
+
+    return stream_csv(rows(), f"transactions_{datetime.utcnow().strftime('%Y%m%d')}.csv")
+
 @transaction_routes.route('/save', methods=['POST'])
 @login_required
 def transactions_save():
@@ -403,9 +481,14 @@ def transactions_save_all():
                         flash(f'Transaction ID {transaction_id_num} requires a date.', 'error')
                         continue  # Skip this transaction and continue with the next
 
+                    previous_account = transaction.account
                     transaction.property_id = request.form.get(f'property_id_{transaction_id_num}')
                     transaction.account = request.form.get(f'account_{transaction_id_num}')
                     transaction.description = request.form.get(f'description_{transaction_id_num}')
+
+                    # Teach the classifier the owner's choice for this description
+                    if transaction.account and transaction.account != previous_account:
+                        record_correction(transaction.description, transaction.account, owner.id)
                     transaction.amount = float(request.form.get(f'amount_{transaction_id_num}', 0))
                     transaction.is_reconciled = f'is_reconciled_{transaction_id_num}' in request.form
 
@@ -528,8 +611,10 @@ def get_balancing_account(account, main_category, amount):
 @login_required
 def upload_document():
     """
-    Handles document uploads, analyzes them using the AI agent, 
-    and populates the transactions table.
+    Accepts statement uploads and queues one ingestion job per file
+    (parse, classify, journal, commit), returning the job ids at once.
+    Progress is polled from upload_job_status. When workers do not share a
+    cache the poll could land elsewhere, so the outcomes are returned instead.
     """
     current_app.logger.info("=== Starting document upload ===")
 
@@ -538,67 +623,139 @@ def upload_document():
         owner = Owner.query.filter_by(user_id=current_user.id).first()
         if not owner:
             current_app.logger.error(f"Owner not found for user_id: {current_user.id}")
-            flash('Owner not found', 'error')
-            return redirect(url_for('transaction_routes.transactions'))
+            return jsonify({'success': False, 'error': 'Owner not found'}), 404
 
         # Check if the post request has the file part
-        if 'files[]' not in request.files:
-            flash('No file part', 'error')
-            return redirect(request.url)
-
-        files = request.files.getlist('files[]')
+        files = [file for file in request.files.getlist('files[]') if file.filename]
+        if not files:
+            return jsonify({'success': False, 'error': 'No selected file'}), 400
 
+        jobs = []
         for file in files:
-            if file.filename == '':
-                flash('No selected file', 'error')
-                return redirect(request.url)
-
-            if file and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filepath = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
-                file.save(filepath)
-
-                # Analyze the document using the AI agent
-                try:
-                    transactions_data = analyze_document(filepath)  # Get a list of transaction dictionaries
-                    current_app.logger.debug(f"Extracted transactions: {transactions_data}")
-
-                    # Create and save transactions
-                    for transaction_data in transactions_data:
-                        try:
-                            journal_entry = generate_journal_entry(transaction_data)
-                            for transaction in journal_entry:
-                                transaction.owner_id = owner.id
-                                db.session.add(transaction)
-                            db.session.commit()
-                        except Exception as e:
-                            current_app.logger.error(f"Error saving transaction: {str(e)}")
-                            db.session.rollback()
-                            flash(f"Error saving transaction: {str(e)}", 'error')
-                            return jsonify({'success': False, 'error': str(e)})  # Return error response
-
-                except Exception as e:
-                    current_app.logger.error(f"Error analyzing document: {str(e)}")
-                    flash(f"Error analyzing document: {str(e)}", 'error')
-                    return jsonify({'success': False, 'error': str(e)})  # Return error response
-
-                flash('Document uploaded and transactions processed successfully!', 'success')
-                return jsonify({'success': True})  # Return success response
-   
+            if not allowed_file(file.filename):
+                jobs.append({'filename': file.filename, 'error': 'File type not allowed'})
+                continue
+            filename = secure_filename(file.filename)
+            job_id = submit_document(file, owner.id, filename)
+            jobs.append({
+                'job_id': job_id,
+                'filename': filename,
+                'status_url': url_for('transaction_routes.upload_job_status', job_id=job_id)
+            })
+
+        if not workers_share_cache(current_app.config):
+            # Another worker could not see these jobs, so answer with their outcome instead
+            return jsonify({'success': True, 'jobs': [_finished_upload(job) for job in jobs]}), 200
+
+        return jsonify({'success': True, 'jobs': jobs}), 202
+
     except Exception as e:
         current_app.logger.exception(f"Exception in upload_document: {str(e)}")
-        db.session.rollback()
-        flash(f'An error occurred: {str(e)}', 'error')
-        return jsonify({'success': False, 'error': str(e)})
+        return jsonify({'success': False, 'error': str(e)}), 500
 
     finally:
         current_app.logger.info("=== Ending document upload ===")
-        return redirect(url_for('transaction_routes.transactions'))
 
-def analyze_document(filepath):
+def _finished_upload(job):
+    """Waits for an upload's job and returns it as upload_job_status would report it."""
+    if 'job_id' not in job:
+        return job
+    record = wait_for_job(job['job_id'], timeout=None) or {}
+    if record.get('status') == 'done':
+        return {'filename': job['filename'], 'status': 'done', 'transactions': record['result']['transactions']}
+    return {'filename': job['filename'], 'status': 'failed', 'error': record.get('error', 'Document processing failed')}
+
+@transaction_routes.route('/upload/jobs/<job_id>', methods=['GET'])
+@login_required
+def upload_job_status(job_id):
+    """Polls a document ingestion job"""
+    job = get_job(job_id)
+    if job is None or job['user_id'] != current_user.get_id():
+        return jsonify({'job_id': job_id, 'error': 'Job not found or expired'}), 404
+    payload = {
+        'job_id': job_id,
+        'status': job['status'],
+        'filename': job['meta'].get('filename'),
+        'progress': job.get('progress', {})
+    }
+    if job['status'] == 'done':
+        payload['transactions'] = job['result']['transactions']
+    if job['status'] == 'failed':
+        payload['error'] = job.get('error', 'Document processing failed')
+    return jsonify(payload)
+
+def submit_document(upload, owner_id, filename):
+    """Saves an uploaded statement and queues its ingestion; returns the job id."""
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    os.makedirs(upload_folder, exist_ok=True)
+    # Unique prefix so two uploads of 'statement.txt' never overwrite each other mid-ingest
+    filepath = os.path.join(upload_folder, f"{secrets.token_hex(8)}_{filename}")
+    upload.save(filepath)
+    try:
+        return submit_job(
+            'ingest', ingest_document,
+            filepath, owner_id,
+            max_workers=current_app.config.get('INGEST_WORKERS', 2),
+            user_id=current_user.get_id(),
+            meta={'filename': filename}
+        )
+    except Exception:
+        os.remove(filepath)  # The job never ran, so nothing else will remove it
+        raise
+
+def ingest_document(filepath, owner_id):
     """
-    Analyzes the uploaded document and extracts transaction data.
-    Uses Azure LLM to classify items.
+    Job body: parse -> classify -> journal -> commit for one document,
+    reporting each stage through jobs.report_progress. The document's
+    journal entries are committed together, or not at all. The uploaded
+    file is removed once parsed, whether or not parsing succeeds.
+    """
+    report_progress(stage='parse')
+    try:
+        transactions_data = parse_document(filepath)
+    finally:
+        try:
+            os.remove(filepath)
+        except OSError as e:
+            current_app.logger.warning(f"Could not remove uploaded file {filepath}: {str(e)}")
+
+    report_progress(stage='classify', lines=len(transactions_data))
+    classify_lines(transactions_data, owner_id)
+
+    report_progress(stage='journal')
+    entries = []
+    for transaction_data in transactions_data:
+        journal_entry = generate_journal_entry(transaction_data)
+        for transaction in journal_entry:
+            transaction.owner_id = owner_id
+        entries.append((transaction_data, journal_entry))
+
+    report_progress(stage='commit', transactions=sum(len(entry) for _, entry in entries))
+    try:
+        for _, journal_entry in entries:
+            db.session.add_all(journal_entry)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    return {
+        'transactions': [
+            {
+                'id': journal_entry[0].id,
+                'date': transaction_data['transaction_date'],
+                'description': transaction_data['description'],
+                'account': transaction_data['account'],
+                'amount': transaction_data['amount']
+            }
+            for transaction_data, journal_entry in entries
+        ]
+    }
+
+def parse_document(filepath):
+    """
+    Extracts transaction lines from an uploaded document. Expense lines
+    come back without an account; classify_lines fills them in.
     """
     extracted_transactions = []
 
@@ -623,18 +780,32 @@ def analyze_document(filepath):
             'amount': -total_amount_due,  # Negative because it's a debit
         })
 
-        # Classify each expense item using Azure LLM
         for expense_name, expense_amount in expenses:
-            account = get_account_for_item(expense_name.strip())
             extracted_transactions.append({
                 'transaction_date': '2024-10-31',  # Placeholder for transaction date
                 'description': expense_name.strip(),
-                'account': account,
+                'account': None,
                 'amount': float(expense_amount),  # Positive because it's a credit
             })
 
     return extracted_transactions
 
+def classify_lines(transactions_data, owner_id=None):
+    """Fills in the account of every line without one, all in a single classification batch."""
+    unclassified = [line for line in transactions_data if not line['account']]
+    accounts = get_accounts_for_items([line['description'] for line in unclassified], owner_id)
+    for line, account in zip(unclassified, accounts):
+        line['account'] = account
+    flush_hit_counts()
+    return transactions_data
+
+def analyze_document(filepath, owner_id=None):
+    """
+    Analyzes the uploaded document and extracts transaction data.
+    Classifies items from the classification cache, falling back to the Azure LLM.
+    """
+    return classify_lines(parse_document(filepath), owner_id)
+
 def get_account_for_expense(expense_name):
     """
     Maps expense names to account names based on your chart of accounts.
@@ -649,20 +820,28 @@ def get_account_for_expense(expense_name):
     else:
         return 'Other Expenses'  # Default account for unmatched expenses
 
-def get_account_for_item(item_name):
+def get_accounts_for_items(item_names, owner_id=None):
     """
-    Maps item names (expenses, liabilities, assets, revenue, equity) 
-    to account names based on your chart of accounts using Azure LLM.
+    Batch form of get_account_for_item: one account per item name, in order,
+    with every uncached item sent to the Azure LLM in a single request.
     """
-    # Clean and preprocess the item name (if needed)
-    processed_name = item_name.strip().lower()
+    accounts = classify_descriptions(item_names, owner_id)
+    for item_name, account in zip(item_names, accounts):
+        if account == UNCATEGORIZED:
+            current_app.logger.warning(f"Unable to classify the item '{item_name}', using default classification.")
+    return accounts
 
-    # Use Azure LLM for classification
-    account = classify_transaction_with_azure(item_name)
+def get_account_for_item(item_name, owner_id=None):
+    """
+    Maps item names (expenses, liabilities, assets, revenue, equity) 
+    to account names based on your chart of accounts, using the owner's
+    past corrections and cached answers before asking the Azure LLM.
+    """
+    account = classify_description(item_name.strip(), owner_id)
 
     # If classification fails or doesn't match an account, fallback to a default
-    if account == "Uncategorized":
+    if account == UNCATEGORIZED:
         current_app.logger.warning(f"Unable to classify the item '{item_name}', using default classification.")
-        return "Uncategorized"  # Default account or error handling logic
+        return UNCATEGORIZED  # Default account or error handling logic
 
-    return account
\ No newline at end of file
+    return account
@@ -1,27 +1,41 @@
 # utils.py
+import csv
+import io
 import os
 import secrets
-from PIL import Image
-from flask import current_app
+from flask import Response, current_app, stream_with_context
+from images import PHOTO_FOLDER, process_image
 
 def allowed_file(filename):
     ALLOWED_EXTENSIONS = {'pdf', 'csv', 'xls', 'xlsx'}
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def save_photo(photo):
-    random_hex = secrets.token_hex(8)
-    _, f_ext = os.path.splitext(photo.filename)
-    photo_filename = random_hex + f_ext
-    photo_path = os.path.join(current_app.root_path, 'static/uploads/property_photos', 
- photo_filename)
+def stream_csv(rows, filename):
+    """
+    Streams an iterable of rows as a CSV attachment. Each row is written and
+    sent as it is produced, so memory use does not grow with the file.
+    """
+    def generate():
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
 
-    output_size = (800, 600)
-    i = Image.open(photo)
-    i.thumbnail(output_size)
-    i.save(photo_path)
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv',
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
-    return photo_filename
+def save_photo(photo):
+    """Saves resized, metadata-free variants of photo and returns the card JPEG's filename."""
+    variants = process_image(photo, os.path.join(current_app.root_path, 'static'),
+                             PHOTO_FOLDER, secrets.token_hex(8))
+    return os.path.basename(variants['card']['jpeg'])
 
 def get_expense_fields():
     """Return a dictionary of expense field names and their display labels"""